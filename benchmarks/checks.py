@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+'''
+Checks of how Pandown's commands behave, run outside Sublime Text against
+the stub API in stubs/ and the stand-in Pandoc in fakepandoc.py:
+
+    python benchmarks/checks.py
+    python benchmarks/checks.py --only live_preview
+
+Each check raises AssertionError if the behavior it covers is broken.
+'''
+from __future__ import print_function
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(HERE, "stubs"))
+sys.path.insert(1, PACKAGE_DIR)
+
+if "Pandown" not in sys.modules:
+    package = types.ModuleType("Pandown")
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules["Pandown"] = package
+
+import sublime
+import Pandown.pandownProcess as pandownProcess
+from Pandown.pandownBuildCache import PandownBuildCache
+from Pandown.pandownBuildCommand import PandownBuildCommand
+from Pandown.pandownBuildProjectCommand import PandownBuildProjectCommand
+from Pandown.pandownFanOut import PandownFanOut, READER_ARGUMENTS, parseCommand, writerCommand
+from Pandown.pandownCommandBuilder import argumentName
+from Pandown.pandownIncludeIndex import indexFor
+from Pandown.pandownWatchCommand import PandownToggleWatchCommand
+
+
+def fakePandoc(folder):
+    '''
+    A "pandoc" in `folder` that runs fakepandoc.py, for install_path.
+    '''
+    path = os.path.join(folder, "pandoc")
+    with open(path, "w") as f:
+        f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, os.path.join(HERE, "fakepandoc.py")))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return folder
+
+
+def buildView(view, **args):
+    '''
+    Run pandown_build on `view`, returning the pandown_exec arguments it
+    ran with and the bytes it piped to Pandoc.
+    '''
+    window = sublime.Window(view)
+    PandownBuildCommand(window).run(**args)
+    execArgs = [a for (command, a) in window.commands if command == "pandown_exec"][-1]
+    pandownProcess.takeInput(execArgs["timer_key"])
+    return (execArgs, pandownProcess.takeInput(execArgs["input_key"]) if execArgs["input_key"] else None)
+
+
+def checkLivePreview(folder):
+    path = os.path.join(folder, "doc.md")
+    with open(path, "w") as f:
+        f.write("# One\n\nSaved text\n")
+    view = sublime.View(path)
+    view.chunks = ["# One\n\nSaved text\n"]
+    (execArgs, piped) = buildView(view, pandoc_to=["html", ".html"], pandoc_from="markdown")
+    assert piped is None and execArgs["cmd"][-1] == path, "a saved, unmodified view should be read from disk"
+
+    view.chunks = ["# One\n\nUNSAVED EDIT\n"]
+    view.dirty = True
+    (execArgs, piped) = buildView(view, pandoc_to=["html", ".html"], pandoc_from="markdown")
+    assert piped == b"# One\n\nUNSAVED EDIT\n", piped
+    assert execArgs["cmd"][-1] == "-"
+
+    view.dirty = False
+    output = sublime.View()
+    output.set_name("Pandoc Output: doc.md")
+    window = sublime.Window(view)
+    window.views = lambda: [view, output]
+    PandownBuildCommand(window).run(pandoc_to=["html", ".html"], pandoc_from="markdown", to_window=True,
+        view_id=view.id(), live=True)
+    execArgs = [a for (command, a) in window.commands if command == "pandown_exec"][-1]
+    pandownProcess.takeInput(execArgs["timer_key"])
+    assert pandownProcess.takeInput(execArgs["input_key"]) == b"# One\n\nUNSAVED EDIT\n"
+
+
+def checkBuildCache(folder):
+    settings = sublime.load_settings("Pandown.sublime-settings")
+    settings.set("build_cache", True)
+    settings.set("pandoc_arguments", {"command_arguments": {"bibliography": "refs.bib"}})
+    path = os.path.join(folder, "doc.md")
+    bibliography = os.path.join(folder, "refs.bib")
+    with open(path, "w") as f:
+        f.write("# One\n\nAs [@knuth] says.\n")
+    with open(bibliography, "w") as f:
+        f.write("@book{knuth, title={TeX}}\n")
+    view = sublime.View(path)
+    try:
+        (execArgs, piped) = buildView(view, pandoc_to=["html", ".html"], pandoc_from="markdown")
+        assert "--bibliography=refs.bib" in execArgs["cmd"], execArgs["cmd"]
+        key = execArgs["cache_key"]
+        assert key
+        pandownProcess.buildCache().store(key, data=b"<p>Cached</p>\n")
+        window = sublime.Window(view)
+        PandownBuildCommand(window).run(pandoc_to=["html", ".html"], pandoc_from="markdown")
+        assert not window.commands, "an unchanged build should be restored from the cache"
+
+        with open(bibliography, "w") as f:
+            f.write("@book{knuth, title={The TeXbook}}\n")
+        os.utime(bibliography, (0, 0))
+        (execArgs, piped) = buildView(view, pandoc_to=["html", ".html"], pandoc_from="markdown")
+        assert execArgs["cache_key"] != key, "editing the bibliography should miss the cache"
+
+        settings.set("pandoc_arguments", {"command_arguments": {"bibliography": "refs.bib", "self-contained": True}})
+        (execArgs, piped) = buildView(view, pandoc_to=["html", ".html"], pandoc_from="markdown")
+        assert execArgs["cache_key"] is None, "self-contained builds shouldn't be cached"
+    finally:
+        settings.set("build_cache", False)
+        settings.set("pandoc_arguments", None)
+
+
+def checkFanOutCache(folder):
+    path = os.path.join(folder, "doc.md")
+    abbreviations = os.path.join(folder, "abbreviations")
+    with open(path, "w") as f:
+        f.write("# One\n\nAs e.g. Knuth says.\n")
+    with open(abbreviations, "w") as f:
+        f.write("e.g.\n")
+    pandoc = os.path.join(folder, "pandoc")
+    commands = [[pandoc, "--output=%s" % os.path.join(folder, "doc" + ext), "--to=" + to, "--abbreviations=abbreviations", path]
+        for (to, ext) in (("html", ".html"), ("docx", ".docx"))]
+    outFiles = [os.path.join(folder, "doc.html"), os.path.join(folder, "doc.docx")]
+    cache = PandownBuildCache(os.path.join(folder, "cache"), 0, 0)
+
+    def build(cache):
+        fanOut = PandownFanOut(path, commands, outFiles, cache, b"")
+        jobs = fanOut.run()
+        assert jobs and all(job.returncode == 0 for job in jobs), [job.output for job in jobs]
+        assert fanOut.tempDir is None
+        return fanOut.astCached
+
+    assert not build(cache)
+    assert build(cache), "an unchanged parse should come from the cache"
+    with open(abbreviations, "w") as f:
+        f.write("e.g.\ni.e.\n")
+    os.utime(abbreviations, (0, 0))
+    assert not build(cache), "editing the abbreviations should parse again"
+
+    shutil.rmtree(cache.root)
+    assert not build(None)
+    assert not os.path.exists(cache.root), "without a cache, nothing should be stored"
+
+
+def checkFanOutCommands(folder):
+    single = ["pandoc", "--from=markdown", "--smart", "--metadata=lang:en", "--standalone",
+        "--filter=pandoc-crossref", "--bibliography=refs.bib", "--csl=apa.csl", "--natbib",
+        "--lua-filter=format.lua", "--data-dir=data", "--to=latex", "--output=doc.tex", "doc.md"]
+    parse = parseCommand(single, "ast.json")
+    writer = writerCommand(single, "ast.json")
+    read = [arg for arg in single[1:-1] if argumentName(arg) in READER_ARGUMENTS]
+    written = [arg for arg in single[1:-1] if argumentName(arg) not in READER_ARGUMENTS + ("to",)]
+    assert parse == ["pandoc"] + read + ["--data-dir=data", "--to=json", "--output=ast.json", "doc.md"], parse
+    assert writer == ["pandoc", "--from=json", "--to=latex"] + written + ["ast.json"], writer
+    for name in ("filter", "lua-filter", "bibliography", "csl", "natbib"):
+        assert any(argumentName(arg) == name for arg in writer), "the writer should get --" + name
+        assert not any(argumentName(arg) == name for arg in parse), "the parse shouldn't get --" + name
+
+
+def checkThreadBuilds(folder):
+    settings = sublime.load_settings("Pandown.sublime-settings")
+    settings.set("max_concurrent_builds", 1)
+    queue = pandownProcess.jobQueue()
+    panel = sublime.View()
+    release = threading.Event()
+    events = []
+
+    def submit(name, target):
+        def run():
+            events.append("run " + name)
+            release.wait(10)
+            return 0
+        return pandownProcess.submitThreadBuild((0, 0, target), name, panel, run,
+            lambda: events.append("finish " + name), lambda: events.append("cancel " + name))
+
+    try:
+        first = submit("first", "a.pdf")
+        second = submit("second", "b.pdf")
+        assert second.state == "queued", "a thread build should wait for a slot"
+        queue.cancel(first)
+        assert "cancel first" in events and second.state == "running"
+        release.set()
+        sublime.runPending(lambda: second.state == "finished")
+        sublime.runPending(lambda: "finish second" in events)
+        assert "finish first" not in events, "a cancelled build shouldn't finish"
+
+        path = os.path.join(folder, "doc.md")
+        with open(path, "w") as f:
+            f.write("# One\n")
+        window = sublime.Window(sublime.View(path))
+        PandownBuildCommand(window).run(pandoc_targets=[["html", ".html"], ["docx", ".docx"]], pandoc_from="markdown")
+        job = queue.jobs()[0]
+        assert job.description == "doc.md to doc.html, doc.docx", job.description
+        sublime.runPending(lambda: job.state == "finished")
+        sublime.runPending(lambda: "[Built 2 formats" in window.panels["exec"].text())
+    finally:
+        release.set()
+        settings.set("max_concurrent_builds", 2)
+
+
+def checkProjectQueue(folder):
+    settings = sublime.load_settings("Pandown.sublime-settings")
+    settings.set("max_concurrent_builds", 1)
+    queue = pandownProcess.jobQueue()
+    project = os.path.join(folder, "project")
+    os.makedirs(project)
+    for name in ("a", "b", "c"):
+        with open(os.path.join(project, name + ".md"), "w") as f:
+            f.write("# %s\n" % name)
+    window = sublime.Window(folders=[project])
+    running = []
+
+    def watch(done):
+        running.append(len(queue.running))
+        return done()
+
+    try:
+        PandownBuildProjectCommand(window).run()
+        sublime.runPending(lambda: watch(lambda: len(queue.active()) == 3))
+        waiting = [job for job in queue.active() if job.description == "c.md to c.html"]
+        assert waiting and waiting[0].state == "queued", [job.describe() for job in queue.active()]
+        queue.cancel(waiting[0])
+        panel = window.panels["exec"]
+        sublime.runPending(lambda: watch(lambda: "[Built 3 documents" in panel.text()))
+        assert max(running) == 1, "project builds should share max_concurrent_builds"
+        assert "[Built 3 documents, 1 failed" in panel.text(), panel.text()
+        assert os.path.isfile(os.path.join(project, "b.html")) and not os.path.isfile(os.path.join(project, "c.html"))
+    finally:
+        settings.set("max_concurrent_builds", 2)
+
+
+def checkWatchIndex(folder):
+    project = os.path.join(folder, "project")
+    os.makedirs(os.path.join(project, "chapters"))
+    path = os.path.join(project, "chapters", "one.md")
+    with open(path, "w") as f:
+        f.write("# One\n")
+    index = indexFor([project])
+    changed = PandownToggleWatchCommand(sublime.Window(sublime.View())).changed
+
+    added = os.path.join(project, "chapters", "two.md")
+    with open(added, "w") as f:
+        f.write("# Two\n")
+    os.makedirs(os.path.join(project, "chapters", "images"))
+    changed([added, os.path.join(project, "chapters", "images")])
+    assert index.dirsContaining("two.md"), "a new file should be indexed"
+    assert not index.dirsContaining("images"), "a directory isn't a file to include"
+
+    os.remove(path)
+    changed([path])
+    assert not index.dirsContaining("one.md"), "a deleted file should be dropped"
+    shutil.rmtree(os.path.join(project, "chapters"))
+    changed([os.path.join(project, "chapters")])
+    assert not index.dirsContaining("two.md"), "a deleted directory's files should be dropped"
+
+
+CHECKS = (
+    ("live_preview", checkLivePreview),
+    ("build_cache", checkBuildCache),
+    ("fan_out_cache", checkFanOutCache),
+    ("fan_out_commands", checkFanOutCommands),
+    ("thread_builds", checkThreadBuilds),
+    ("project_queue", checkProjectQueue),
+    ("watch_index", checkWatchIndex),
+)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Check Pandown's commands against the stub API.")
+    parser.add_argument("--only", action="append", default=[], help="run only the named check (%s)" % ", ".join(name for (name, fn) in CHECKS))
+    args = parser.parse_args(argv)
+
+    settings = sublime.load_settings("Pandown.sublime-settings")
+    settings.set("log_build_timings", False)
+    failed = 0
+    cwd = os.getcwd()
+    for (name, fn) in CHECKS:
+        if args.only and name not in args.only:
+            continue
+        folder = tempfile.mkdtemp()
+        settings.set("install_path", fakePandoc(folder))
+        try:
+            fn(folder)
+        except AssertionError as e:
+            failed += 1
+            print("%-24s FAILED: %s" % (name, e))
+        else:
+            print("%-24s ok" % name)
+        finally:
+            # Builds change to their document's folder.
+            os.chdir(cwd)
+            shutil.rmtree(folder)
+    shutil.rmtree(sublime.packages_path(), ignore_errors=True)
+    pandownProcess.plugin_unloaded()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+'''
+Stands in for Pandoc in the benchmarks: copies its input file (or stdin,
+for "-") to --output (or stdout), unchanged, so that what's measured is
+Pandown's side of a build.
+'''
+import shutil
+import sys
+
+
+def main(argv):
+    if "--version" in argv:
+        sys.stdout.write("pandoc 2.4 (fake)\n")
+        return 0
+    output = None
+    inputs = []
+    for arg in argv:
+        if arg.startswith("--output="):
+            output = arg[len("--output="):]
+        elif arg == "-" or not arg.startswith("-"):
+            inputs.append(arg)
+    stdout = getattr(sys.stdout, "buffer", sys.stdout)
+    stdin = getattr(sys.stdin, "buffer", sys.stdin)
+    out = open(output, "wb") if output else stdout
+    try:
+        for path in inputs or ["-"]:
+            if path == "-":
+                shutil.copyfileobj(stdin, out, 2 ** 16)
+            else:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out, 2 ** 16)
+    finally:
+        if output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
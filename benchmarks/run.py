@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+'''
+Benchmarks for Pandown's hot paths, run outside Sublime Text against the
+stub API in stubs/ and the stand-in Pandoc in fakepandoc.py:
+
+    python benchmarks/run.py                  # writes benchmarks/results/<commit>.json
+    python benchmarks/run.py --quick --only critic
+    python benchmarks/run.py --compare benchmarks/results/1a2b3c4.json
+
+Each benchmark's median and best times are saved as JSON, so a run on one
+commit can be compared with a run on another.
+'''
+from __future__ import print_function
+import importlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(HERE, "stubs"))
+sys.path.insert(1, PACKAGE_DIR)
+
+# Load the plugin modules as the Pandown package, as Sublime Text 3 does.
+if "Pandown" not in sys.modules:
+    package = types.ModuleType("Pandown")
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules["Pandown"] = package
+
+import sublime
+import minify_json
+from Pandown.pandownCommandBuilder import PandownCommandBuilder
+from Pandown.pandownCriticPreprocessor import PandownCriticPreprocessor
+from Pandown.pandownIncludeIndex import PandownIncludeIndex
+from Pandown.pandownOutputDiff import outputEdits
+import Pandown.pandownConfig as pandownConfig
+import Pandown.pandownProcess as pandownProcess
+
+clock = getattr(time, "perf_counter", time.time)
+
+PLAIN = "Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur.\n\n"
+MARKED = "Sunt in culpa qui {++officia++} deserunt {--mollit--} anim {~~id~>est~~} {==laborum==}{>>note<<}.\n\n"
+
+
+def measure(fn, repeat=5, number=1):
+    '''
+    Call fn() `number` times in each of `repeat` runs, and return the time
+    per call of each run.
+    '''
+    times = []
+    for i in range(repeat):
+        start = clock()
+        for j in range(number):
+            fn()
+        times.append((clock() - start) / number)
+    return times
+
+
+def result(times, size=None, **params):
+    times = sorted(times)
+    record = {
+        "runs": len(times),
+        "median_s": times[len(times) // 2],
+        "min_s": times[0],
+    }
+    if size:
+        record["bytes"] = size
+        record["mb_per_s"] = size / 1e6 / times[len(times) // 2]
+    if params:
+        record["params"] = params
+    return record
+
+
+def sizeLabel(size):
+    for (unit, scale) in (("MB", 10 ** 6), ("KB", 10 ** 3)):
+        if size >= scale:
+            return "%d%s" % (size // scale, unit)
+    return "%dB" % size
+
+
+def countLabel(count):
+    return "%dk" % (count // 1000) if count >= 1000 else str(count)
+
+
+def makeTree(root, files, perDir=25, depth=4):
+    '''
+    A project of `files` files spread over nested directories, with a
+    pandoc-config.json and a stylesheet at the top. Returns the deepest
+    directory, from which lookups have the furthest to walk.
+    '''
+    with open(os.path.join(root, "pandoc-config.json"), "w") as f:
+        f.write('{"pandoc_arguments": {"css": ["styles.css"], "standalone": true}}')
+    with open(os.path.join(root, "styles.css"), "w") as f:
+        f.write("body {}\n")
+    deepest = root
+    made = 2
+    d = 0
+    while made < files:
+        parts = []
+        n = d
+        for level in range(depth):
+            parts.append("d%d" % (n % 10))
+            n //= 10
+        folder = os.path.join(root, *parts)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        for i in range(min(perDir, files - made)):
+            open(os.path.join(folder, "chapter%d.md" % i), "w").close()
+        made += perDir
+        if folder.count(os.sep) >= deepest.count(os.sep):
+            deepest = folder
+        d += 1
+    return deepest
+
+
+def benchConfig(results, quick):
+    folder = tempfile.mkdtemp()
+    try:
+        workingDIR = makeTree(folder, 200)
+        index = PandownIncludeIndex([folder])
+        index.build()
+        defaults = pandownConfig.packageDefaultsLayer()
+        arguments = pandownConfig.argumentsLayer({"toc": True, "number-sections": True})
+        inFile = os.path.join(workingDIR, "chapter0.md")
+
+        def build():
+            builder = PandownCommandBuilder(workingDIR, [], index, defaults=defaults)
+            builder.buildPandocCmd(inFile, ["html5", ".html"], "markdown", arguments)
+
+        results["buildPandocCmd"] = result(measure(build, number=200))
+
+        def rawArguments():
+            builder = PandownCommandBuilder(workingDIR, [], index, defaults=defaults)
+            builder.buildPandocCmd(inFile, ["html5", ".html"], "markdown", {"toc": True, "number-sections": True})
+
+        results["buildPandocCmd.raw_arguments"] = result(measure(rawArguments, number=200))
+
+        def cold():
+            # As the first build after Sublime starts, or after every config
+            # file has changed.
+            pandownConfig._fileLayers.clear()
+            pandownConfig._dataLayers.clear()
+            pandownConfig._resolved.clear()
+            builder = PandownCommandBuilder(workingDIR, [], index, defaults=pandownConfig.packageDefaultsLayer())
+            builder.buildPandocCmd(inFile, ["html5", ".html"], "markdown", {"toc": True, "number-sections": True})
+
+        results["buildPandocCmd.cold"] = result(measure(cold, number=20))
+
+        # A project config with dozens of includes, some found only in
+        # includes_paths.
+        includes = os.path.join(folder, "includes")
+        os.makedirs(includes)
+        for i in range(20):
+            open(os.path.join(folder, "style%d.css" % i), "w").close()
+            open(os.path.join(includes, "header%d.html" % i), "w").close()
+        with open(os.path.join(folder, "pandoc-config.json"), "w") as f:
+            json.dump({"pandoc_arguments": {"command_arguments": {
+                "css": ["style%d.css" % i for i in range(20)],
+                "include-in-header": ["header%d.html" % i for i in range(20)]}}}, f)
+        index.refresh()
+
+        def largeConfig():
+            builder = PandownCommandBuilder(workingDIR, [includes], index, defaults=defaults)
+            builder.buildPandocCmd(inFile, ["html5", ".html"], "markdown", arguments)
+
+        results["buildPandocCmd.large_config"] = result(measure(largeConfig, number=200))
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchIncludes(results, quick):
+    for count in (1000, 10000) if quick else (1000, 10000, 100000):
+        folder = tempfile.mkdtemp()
+        try:
+            workingDIR = makeTree(folder, count)
+            label = countLabel(count)
+            index = PandownIncludeIndex([folder])
+            results["includes.index_build." + label] = result(measure(index.build, repeat=3), files=count)
+            results["includes.refresh." + label] = result(measure(index.refresh, number=10), files=count)
+            builder = PandownCommandBuilder(workingDIR, [], index)
+
+            def walk():
+                builder.walkIncludes("pandoc-config.json")
+                builder.walkIncludes("styles.css", prepend="--css=")
+                builder.walkIncludes("missing.bib", prepend="--bibliography=")
+                del builder.dependencies[:]
+
+            results["walkIncludes." + label] = result(measure(walk, number=200), files=count)
+        finally:
+            shutil.rmtree(folder)
+
+
+def criticText(size):
+    rng = random.Random(size)
+    pieces = []
+    total = 0
+    while total < size:
+        piece = MARKED if rng.random() < 0.1 else PLAIN
+        pieces.append(piece)
+        total += len(piece)
+    return "".join(pieces)
+
+
+def benchCritic(results, quick):
+    folder = tempfile.mkdtemp()
+    try:
+        preprocessor = PandownCriticPreprocessor()
+        for size in (10 ** 4, 10 ** 5, 10 ** 6) if quick else (10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7):
+            path = os.path.join(folder, "critic.md")
+            with open(path, "w") as f:
+                f.write(criticText(size))
+            repeat = 3 if size >= 10 ** 7 else 5
+            times = measure(lambda: preprocessor.preprocessCritic(path), repeat=repeat)
+            results["preprocessCritic." + sizeLabel(size)] = result(times, size)
+            text = criticText(size)
+            chunks = [text[i:i + 2 ** 16] for i in range(0, len(text), 2 ** 16)]
+            times = measure(lambda: "".join(preprocessor.preprocessChunks(chunks)), repeat=repeat)
+            results["preprocessChunks." + sizeLabel(size)] = result(times, size, chunk=2 ** 16)
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchMinify(results, quick):
+    with open(os.path.join(PACKAGE_DIR, "default-pandoc-config.json")) as f:
+        config = f.read()
+    for size in (10 ** 5, 10 ** 6) if quick else (10 ** 5, 10 ** 6, 10 ** 7):
+        data = "[" + ",".join([config] * max(1, size // len(config))) + "]"
+        times = measure(lambda: minify_json.json_minify(data), repeat=3 if size >= 10 ** 7 else 5)
+        results["json_minify." + sizeLabel(size)] = result(times, len(data))
+
+
+def loadPlugins():
+    '''
+    Import every plugin module, as Sublime Text does when it loads the
+    package, so that their commands can be run by name.
+    '''
+    for name in sorted(os.listdir(PACKAGE_DIR)):
+        if name.startswith("pandown") and name.endswith(".py"):
+            importlib.import_module("Pandown." + name[:-3])
+
+
+def streamOnce(path, size):
+    window = sublime.Window()
+    command = pandownProcess.PandownExecCommand(window)
+    command.run(cmd=[sys.executable, os.path.join(HERE, "fakepandoc.py"), path], env={},
+        output_view=window.view.id(), quiet=True)
+    # The output view is updated in one edit once the build has ended.
+    sublime.runPending(lambda: not pandownProcess.jobQueue().active() and window.view.edits, timeout=120)
+    if window.view.size() != size:
+        raise RuntimeError("streamed %d of %d characters" % (window.view.size(), size))
+    return window.view.appends + window.view.edits
+
+
+def benchStreaming(results, quick):
+    settings = sublime.load_settings("Pandown.sublime-settings")
+    settings.set("log_build_timings", False)
+    loadPlugins()
+    folder = tempfile.mkdtemp()
+    try:
+        line = "<p>Streaming output, line after line of it.</p>\n"
+        for size in (10 ** 6, 10 ** 7) if quick else (10 ** 6, 10 ** 7, 5 * 10 ** 7):
+            path = os.path.join(folder, "output.html")
+            with open(path, "wb") as f:
+                f.write((line * (size // len(line))).encode("utf-8"))
+            written = os.path.getsize(path)
+            edits = []
+            times = measure(lambda: edits.append(streamOnce(path, written)), repeat=3)
+            results["exec_streaming." + sizeLabel(size)] = result(times, written, edits=max(edits))
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchOutputDiff(results, quick):
+    line = "<p>Rebuilt output, line after line of it.</p>\n"
+    for size in (10 ** 6, 10 ** 7) if quick else (10 ** 6, 10 ** 7, 5 * 10 ** 7):
+        lines = [line] * (size // len(line))
+        old = "".join(lines)
+        lines[len(lines) // 2] = "<p>Rebuilt output, <em>edited</em>.</p>\n"
+        new = "".join(lines)
+        times = measure(lambda: outputEdits(old, new), repeat=3)
+        results["output_diff." + sizeLabel(size)] = result(times, len(new))
+
+
+BENCHMARKS = (
+    ("config", benchConfig),
+    ("includes", benchIncludes),
+    ("critic", benchCritic),
+    ("minify", benchMinify),
+    ("streaming", benchStreaming),
+    ("diff", benchOutputDiff),
+)
+
+
+def currentCommit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PACKAGE_DIR, stderr=subprocess.STDOUT)
+        return commit.decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    '''
+    A table of each benchmark's median in two runs, flagging any more than
+    10% slower.
+    '''
+    lines = ["%-36s %12s %12s %9s" % ("", "before ms", "after ms", "change")]
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        before = old["results"][name]["median_s"] * 1000
+        after = new["results"][name]["median_s"] * 1000
+        change = (after - before) / before * 100 if before else 0.0
+        lines.append("%-36s %12.3f %12.3f %+8.1f%%%s" % (name, before, after, change, "  slower" if change > 10 else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark Pandown's hot paths.")
+    parser.add_argument("--quick", action="store_true", help="skip the largest inputs")
+    parser.add_argument("--only", action="append", default=[], help="run only the named group (%s)" % ", ".join(name for (name, fn) in BENCHMARKS))
+    parser.add_argument("--output", default=None, help="where to write the results (default: benchmarks/results/COMMIT.json)")
+    parser.add_argument("--compare", default=None, help="earlier results to compare with")
+    args = parser.parse_args(argv)
+
+    commit = currentCommit()
+    results = {}
+    for (name, fn) in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        start = clock()
+        fn(results, args.quick)
+        print("[%s: %.1fs]" % (name, clock() - start))
+    for name in sorted(results):
+        record = results[name]
+        extra = " (%.1f MB/s)" % record["mb_per_s"] if "mb_per_s" in record else ""
+        print("%-36s %12.3f ms%s" % (name, record["median_s"] * 1000, extra))
+
+    run = {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "quick": args.quick,
+        "results": results,
+    }
+    output = args.output or os.path.join(HERE, "results", "%s.json" % (commit or "unknown"))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+    print("[Results written to %s]" % output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), run))
+    shutil.rmtree(sublime.packages_path(), ignore_errors=True)
+    pandownProcess.plugin_unloaded()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+'''
+Just enough of Sublime Text's API to load Pandown's plugins outside the
+editor. set_timeout() queues callbacks for runPending(), which plays the
+part of Sublime's main thread.
+'''
+import heapq
+import itertools
+import os
+import re
+import tempfile
+import threading
+import time
+
+_lock = threading.Lock()
+_pending = []
+_counter = itertools.count()
+_settings = {}
+_root = tempfile.mkdtemp(prefix="pandown-bench-")
+_ids = itertools.count(1)
+
+
+def version():
+    return "3211"
+
+
+def platform():
+    return "windows" if os.name == "nt" else "linux"
+
+
+def packages_path():
+    return _root
+
+
+def cache_path():
+    return _root
+
+
+def load_resource(name):
+    # Packages/Pandown/... is the package itself.
+    package = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with open(os.path.join(package, name.split("/", 2)[2])) as f:
+        return f.read()
+
+
+def status_message(message):
+    pass
+
+
+def error_message(message):
+    raise RuntimeError(message)
+
+
+def set_timeout(callback, delay=0):
+    with _lock:
+        heapq.heappush(_pending, (time.time() + delay / 1000.0, next(_counter), callback))
+
+
+set_timeout_async = set_timeout
+
+
+def runPending(until, timeout=60):
+    '''
+    Run queued callbacks as they fall due, until until() is true.
+    '''
+    deadline = time.time() + timeout
+    while not until():
+        if time.time() > deadline:
+            raise RuntimeError("timed out")
+        callback = None
+        with _lock:
+            if _pending and _pending[0][0] <= time.time():
+                callback = heapq.heappop(_pending)[2]
+        if callback:
+            callback()
+        else:
+            time.sleep(0.0005)
+
+
+class Settings(dict):
+    def __init__(self):
+        dict.__init__(self)
+        self.callbacks = {}
+
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+        for callback in list(self.callbacks.values()):
+            callback()
+
+    def add_on_change(self, key, callback):
+        self.callbacks[key] = callback
+
+    def clear_on_change(self, key):
+        self.callbacks.pop(key, None)
+
+
+def load_settings(name):
+    return _settings.setdefault(name, Settings())
+
+
+class Region(object):
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return self.end() - self.begin()
+
+
+class View(object):
+    '''
+    A view that keeps its text in a list of appended chunks. Commands other
+    than "append" run the plugin's TextCommand of that name.
+    '''
+
+    def __init__(self, fileName=None):
+        self._id = next(_ids)
+        self._settings = Settings()
+        self.fileName = fileName
+        self.chunks = []
+        self.appends = 0
+        self.edits = 0
+        self.viewport = (0.0, 0.0)
+        self.dirty = False
+        self._name = ""
+
+    def id(self):
+        return self._id
+
+    def name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+
+    def is_dirty(self):
+        return self.dirty
+
+    def settings(self):
+        return self._settings
+
+    def file_name(self):
+        return self.fileName
+
+    def encoding(self):
+        return "UTF-8"
+
+    def size(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def text(self):
+        return "".join(self.chunks)
+
+    def substr(self, region):
+        return self.text()[region.begin():region.end()]
+
+    def replace(self, edit, region, string):
+        text = self.text()
+        self.chunks = [text[:region.begin()], string, text[region.end():]]
+        self.edits += 1
+
+    def viewport_position(self):
+        return self.viewport
+
+    def set_viewport_position(self, position, animate=True):
+        self.viewport = position
+
+    def run_command(self, command, args=None):
+        if command == "append":
+            self.chunks.append(args["characters"])
+            self.appends += 1
+            return
+        import sublime_plugin
+        for cls in sublime_plugin.TextCommand.__subclasses__():
+            name = re.sub(r"(?<!^)([A-Z])", r"_\1", cls.__name__[:-len("Command")]).lower()
+            if name == command:
+                cls(self).run(None, **(args or {}))
+
+    def assign_syntax(self, syntax):
+        pass
+
+    def set_syntax_file(self, syntax):
+        pass
+
+    def find_all_results(self):
+        return []
+
+
+class Window(object):
+    '''
+    A window with one view in it. Window commands aren't run, only recorded.
+    '''
+
+    def __init__(self, view=None, folders=()):
+        self._id = next(_ids)
+        self.view = view or View()
+        self._folders = list(folders)
+        self.panels = {}
+        self.commands = []
+
+    def id(self):
+        return self._id
+
+    def active_view(self):
+        return self.view
+
+    def views(self):
+        return [self.view]
+
+    def folders(self):
+        return self._folders
+
+    def create_output_panel(self, name):
+        if name not in self.panels:
+            self.panels[name] = View()
+        return self.panels[name]
+
+    def run_command(self, command, args=None):
+        self.commands.append((command, args))
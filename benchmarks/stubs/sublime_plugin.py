@@ -0,0 +1,12 @@
+class WindowCommand(object):
+    def __init__(self, window):
+        self.window = window
+
+
+class TextCommand(object):
+    def __init__(self, view):
+        self.view = view
+
+
+class EventListener(object):
+    pass
@@ -4,52 +4,44 @@ Created on 20/01/2011
 v0.1 (C) Gerald Storer
 MIT License
 
+v0.2: single-pass tokenizer, linear in the size of the input.
+
 Based on JSON.minify.js: 
 https://github.com/getify/JSON.minify
 '''
 
+import json as _json
 import re
 
-def json_minify(json,strip_space=True):
-    tokenizer=re.compile('"|(/\*)|(\*/)|(//)|\n|\r')
-    in_string = False
-    in_multiline_comment = False
-    in_singleline_comment = False
-    
+# Every character of the input belongs to exactly one of these tokens, so a
+# single left-to-right scan classifies the whole document. Strings are matched
+# whole (escapes included), which is what makes comment markers inside them
+# harmless; unterminated strings and comments simply run to the end.
+_TOKENIZER = re.compile(r'''
+      (?P<string>"[^"\\]*(?:\\.[^"\\]*)*"?)
+    | (?P<comment>/\*.*?(?:\*/|\Z)|//[^\n\r]*[\n\r]?)
+    | (?P<space>[ \t\n\r]+)
+    | (?P<other>[^"/ \t\n\r]+|/)
+''', re.DOTALL | re.VERBOSE)
+
+
+def json_minify(json, strip_space=True):
     new_str = []
-    from_index = 0 # from is a keyword in Python
-    
-    for match in re.finditer(tokenizer,json):
-        
-        if not in_multiline_comment and not in_singleline_comment:
-            tmp2 = json[from_index:match.start()]
-            if not in_string and strip_space:
-                tmp2 = re.sub('[ \t\n\r]*','',tmp2) # replace only white space defined in standard
-            new_str.append(tmp2)
-            
-        from_index = match.end()
-        
-        if match.group() == '"' and not in_multiline_comment and not in_singleline_comment:
-            escaped = re.search('(\\\\)*$',json[:match.start()])
-            if not in_string or escaped is None or len(escaped.group()) % 2 == 0:
-                # start of string with ", or unescaped " character found to end string
-                in_string = not in_string
-            from_index -= 1 # include " character in next catch
-            
-        elif match.group() == '/*' and not in_string and not in_multiline_comment and not in_singleline_comment:
-            in_multiline_comment = True
-        elif match.group() == '*/' and not in_string and in_multiline_comment and not in_singleline_comment:
-            in_multiline_comment = False
-        elif match.group() == '//' and not in_string and not in_multiline_comment and not in_singleline_comment:
-            in_singleline_comment = True
-        elif (match.group() == '\n' or match.group() == '\r') and not in_string and not in_multiline_comment and in_singleline_comment:
-            in_singleline_comment = False
-        elif not in_multiline_comment and not in_singleline_comment and (  
-             match.group() not in ['\n','\r',' ','\t'] or not strip_space):
-                new_str.append(match.group()) 
-    
-    new_str.append(json[from_index:])
-    return ''.join(new_str)
+    append = new_str.append
+    for match in _TOKENIZER.finditer(json):
+        kind = match.lastgroup
+        if kind == "comment" or (kind == "space" and strip_space):
+            continue
+        append(match.group())
+    return "".join(new_str)
+
+
+def json_loads(json, **kwargs):
+    '''
+    Parse JSON that may contain comments.
+    '''
+    return _json.loads(json_minify(json), **kwargs)
+
 
 if __name__ == '__main__':
     import json # requires Python 2.6+ to run tests
@@ -109,4 +101,63 @@ something else */"blah"
     assert test_json(test3) == json.loads(test3_res),'Failed test 3'
     assert test_json(test4) == json.loads(test4_res),'Failed test 4'
     if __debug__: # Don't print passed message if the asserts didn't run
-        print('Passed all tests')
\ No newline at end of file
+        print('Passed all tests')
+
+    # Benchmark against v0.1, which re-scanned the document's whole prefix for
+    # backslashes at every quotation mark.
+    import timeit
+
+    def json_minify_legacy(json,strip_space=True):
+        tokenizer=re.compile('"|(/\*)|(\*/)|(//)|\n|\r')
+        in_string = False
+        in_multiline_comment = False
+        in_singleline_comment = False
+        
+        new_str = []
+        from_index = 0 # from is a keyword in Python
+        
+        for match in re.finditer(tokenizer,json):
+            
+            if not in_multiline_comment and not in_singleline_comment:
+                tmp2 = json[from_index:match.start()]
+                if not in_string and strip_space:
+                    tmp2 = re.sub('[ \t\n\r]*','',tmp2) # replace only white space defined in standard
+                new_str.append(tmp2)
+                
+            from_index = match.end()
+            
+            if match.group() == '"' and not in_multiline_comment and not in_singleline_comment:
+                escaped = re.search('(\\\\)*$',json[:match.start()])
+                if not in_string or escaped is None or len(escaped.group()) % 2 == 0:
+                    # start of string with ", or unescaped " character found to end string
+                    in_string = not in_string
+                from_index -= 1 # include " character in next catch
+                
+            elif match.group() == '/*' and not in_string and not in_multiline_comment and not in_singleline_comment:
+                in_multiline_comment = True
+            elif match.group() == '*/' and not in_string and in_multiline_comment and not in_singleline_comment:
+                in_multiline_comment = False
+            elif match.group() == '//' and not in_string and not in_multiline_comment and not in_singleline_comment:
+                in_singleline_comment = True
+            elif (match.group() == '\n' or match.group() == '\r') and not in_string and not in_multiline_comment and in_singleline_comment:
+                in_singleline_comment = False
+            elif not in_multiline_comment and not in_singleline_comment and (  
+                 match.group() not in ['\n','\r',' ','\t'] or not strip_space):
+                    new_str.append(match.group()) 
+        
+        new_str.append(json[from_index:])
+        return ''.join(new_str)
+
+    for (test, expected) in ((test1, test1_res), (test2, test2_res), (test3, test3_res), (test4, test4_res)):
+        assert json.loads(json_minify_legacy(test)) == json.loads(expected)
+        assert json_minify(test) == json_minify_legacy(test).strip()
+
+    # A config whose values are the test documents themselves, comments and
+    # all, repeated to grow it.
+    cases = [test1, test2, test3, test4]
+    for size in (5, 10, 20, 40):
+        big = "{" + ",".join('"key%d": %s' % (i, case) for (i, case) in enumerate(cases * size)) + "}"
+        assert json.loads(json_minify(big)) == json.loads(json_minify_legacy(big))
+        new = min(timeit.repeat(lambda: json_minify(big), number=10, repeat=3)) / 10
+        old = timeit.timeit(lambda: json_minify_legacy(big), number=1)
+        print("%8d bytes: v0.2 %.4fs, v0.1 %.4fs (%.0fx)" % (len(big), new, old, old / new))
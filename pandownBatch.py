@@ -0,0 +1,228 @@
+from __future__ import print_function
+import codecs
+import fnmatch
+import os
+import subprocess
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from multiprocessing import cpu_count
+except ImportError:
+    def cpu_count():
+        return 2
+try:
+    import Pandown.minify_json as minify_json
+    import Pandown.pandownIncludeIndex as pandownIncludeIndex
+    from Pandown.pandownCore import PandownConversion, SOURCE_EXTENSIONS, readerFor
+    from Pandown.pandownDependencies import fileArguments
+    from Pandown.pandownJobs import processGroupOptions, terminateGroup
+    from Pandown.pandownPdf import PandownPdfBuild, usesPipeline
+except ImportError:
+    import minify_json
+    import pandownIncludeIndex
+    from pandownCore import PandownConversion, SOURCE_EXTENSIONS, readerFor
+    from pandownDependencies import fileArguments
+    from pandownJobs import processGroupOptions, terminateGroup
+    from pandownPdf import PandownPdfBuild, usesPipeline
+
+
+def projectSourcePatterns(folder):
+    '''
+    The "project_sources" glob list from the pandoc-config.json at the top of
+    a project folder, if there is one.
+    '''
+    configFile = os.path.join(folder, "pandoc-config.json")
+    if not os.path.isfile(configFile):
+        return None
+    try:
+        with codecs.open(configFile, "r", "utf-8") as f:
+            config = minify_json.json_loads(f.read())
+    except (IOError, ValueError):
+        return None
+    patterns = config.get("project_sources", None)
+    return patterns if isinstance(patterns, list) and patterns else None
+
+
+def discoverSources(folders, index=None):
+    '''
+    Every document under `folders` that a project build should convert: those
+    matching the folder's "project_sources" patterns (shell-style, relative to
+    the folder) if it has any, or else everything with a known source
+    extension.
+    '''
+    index = index or pandownIncludeIndex.indexFor(folders)
+    sources = []
+    files = index.files()
+    for folder in index.folders:
+        patterns = projectSourcePatterns(folder)
+        prefix = folder.rstrip(os.sep) + os.sep
+        for dirPath in sorted(files):
+            if dirPath != folder and not dirPath.startswith(prefix):
+                continue
+            relDir = os.path.relpath(dirPath, folder)
+            if any(part.startswith(".") for part in relDir.split(os.sep) if part != "."):
+                continue
+            for name in sorted(files[dirPath]):
+                path = os.path.join(dirPath, name)
+                if patterns:
+                    relPath = os.path.normpath(os.path.join(relDir, name)).replace(os.sep, "/")
+                    if any(fnmatch.fnmatch(relPath, pattern) for pattern in patterns):
+                        sources.append(path)
+                elif os.path.splitext(name)[1].lower() in SOURCE_EXTENSIONS:
+                    sources.append(path)
+    return sources
+
+
+class PandownBatchJob(object):
+    def __init__(self, source, cmd, outFile, inputData=None):
+        self.source = source
+        self.cmd = cmd
+        self.outFile = outFile
+        # Bytes to pipe to Pandoc, if cmd reads from stdin.
+        self.inputData = inputData
+        # What the build reads, for the dependency graph.
+        self.record = None
+        # A PandownPdfBuild to run in place of cmd, for PDFs.
+        self.pipeline = None
+        # Pandoc, while it's running.
+        self.proc = None
+        self.cancelled = False
+        self.returncode = None
+        self.elapsed = 0.0
+        self.output = ""
+
+
+def makeJob(source, to, pandoc_from, arguments, includes_paths, index=None, defaults=None, preprocess=None, pandoc=None,
+        pdfBuildDir=None):
+    '''
+    Build the Pandoc command for one document exactly as a single-file build
+    would. `pandoc_from` may be None to pick the reader from the extension.
+    `arguments` and `defaults` are config layers (or, for `arguments`, a
+    pandoc_arguments dict); `defaults` is the package's if not given.
+    `preprocess`, if given, takes a path and returns the text to convert
+    instead (e.g. with CriticMarkup converted), which is piped to Pandoc.
+    `pandoc` is Pandoc's path, if it's been resolved. With `pdfBuildDir`, PDFs
+    are made by a PandownPdfBuild that keeps its files in that directory.
+    '''
+    conversion = PandownConversion(source, to, pandoc_from or readerFor(source), arguments, includes_paths,
+        index, defaults=defaults, text=preprocess(source) if preprocess else None, pandoc=pandoc)
+    job = PandownBatchJob(source, conversion.cmd, conversion.outFile, inputData=conversion.inputData)
+    if pdfBuildDir and conversion.cmd and usesPipeline(conversion.cmd):
+        job.pipeline = PandownPdfBuild(conversion.cmd, conversion.workingDIR, conversion.inputData, pdfBuildDir)
+    if conversion.cmd:
+        inputs = [source] + conversion.dependencies + fileArguments(conversion.cmd, conversion.workingDIR)
+        job.record = {"source": source, "inputs": inputs, "to": list(to), "from": pandoc_from, "built": time.time()}
+    return job
+
+
+class PandownBatchRunner(object):
+    '''
+    Runs a list of PandownBatchJobs through a bounded pool of worker threads,
+    each of which waits on one Pandoc process at a time.
+    '''
+
+    def __init__(self, jobs, env=None, workers=None, onResult=None):
+        self.jobs = jobs
+        self.env = env
+        self.workers = max(1, min(workers or cpu_count(), len(jobs) or 1))
+        self.onResult = onResult
+        self.queue = queue.Queue()
+        self.cancelled = False
+        self.elapsed = 0.0
+
+    def run(self):
+        start = time.time()
+        for job in self.jobs:
+            self.queue.put(job)
+        threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        self.elapsed = time.time() - start
+        return self.jobs
+
+    def cancel(self):
+        self.cancelled = True
+
+    def cancelJob(self, job):
+        '''
+        Stop a single job, and whatever its Pandoc started, if it's running,
+        or keep it from starting if it isn't.
+        '''
+        job.cancelled = True
+        if job.pipeline:
+            job.pipeline.cancel()
+        elif job.proc and job.proc.poll() is None:
+            terminateGroup(job.proc.pid)
+
+    def work(self):
+        while not self.cancelled:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.runJob(job)
+            if self.onResult:
+                self.onResult(job)
+
+    def runJob(self, job):
+        start = time.time()
+        if job.cancelled:
+            job.returncode = -1
+            job.output = "[Cancelled]"
+            return
+        if not job.cmd:
+            job.returncode = -1
+            job.output = "Error constructing Pandoc command."
+            return
+        startupinfo = None
+        if os.name == "nt":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        if job.pipeline:
+            try:
+                (job.returncode, output) = job.pipeline.run(self.env)
+                job.output = output.strip()
+            finally:
+                job.elapsed = time.time() - start
+            return
+        stdin = subprocess.PIPE if job.inputData is not None else None
+        try:
+            job.proc = subprocess.Popen(job.cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                cwd=os.path.dirname(job.source), env=self.env, startupinfo=startupinfo, **processGroupOptions())
+            if job.cancelled:
+                # Cancelled while it was starting.
+                terminateGroup(job.proc.pid)
+            output = job.proc.communicate(job.inputData)[0]
+            job.returncode = job.proc.returncode
+            job.output = output.decode("utf-8", "replace").strip()
+        except OSError as e:
+            job.returncode = -1
+            job.output = str(e)
+        finally:
+            job.proc = None
+            job.elapsed = time.time() - start
+
+
+def describeJob(job, root=None):
+    source = os.path.relpath(job.source, root) if root else job.source
+    if job.returncode == 0:
+        line = "[ok] %s (%.1fs)" % (source, job.elapsed)
+    else:
+        line = "[failed] %s (%.1fs, exit code %s)" % (source, job.elapsed, job.returncode)
+    if job.output:
+        line += "\n    " + job.output.replace("\n", "\n    ")
+    return line
+
+
+def describeRun(jobs, elapsed, workers):
+    failed = len([job for job in jobs if job.returncode != 0])
+    return "[Built %d documents, %d failed, in %.1fs with %d workers]" % (len(jobs), failed, elapsed, workers)
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+# Options that have Pandoc read files the document itself refers to, such as
+# images, which aren't known beforehand and so can't be hashed.
+UNCACHEABLE_ARGUMENTS = ("self-contained", "embed-resources", "extract-media")
+
+
+def cacheable(cmd):
+    '''
+    Whether a build with `cmd` reads only files a cache key can cover.
+    '''
+    return not any(arg[2:].split("=", 1)[0] in UNCACHEABLE_ARGUMENTS for arg in cmd if arg.startswith("--"))
+
+
+class PandownBuildCache(object):
+    '''
+    A content-addressed store of build outputs. An entry's key hashes the
+    Pandoc command line, the bytes of the input, and the contents of the
+    files the build is known to read (includes, stylesheets, templates,
+    bibliographies, filters, config), so a hit means Pandoc would have
+    produced the cached bytes, unless it read something else: a filter
+    found on the PATH, or a file that one of those reads in turn.
+    '''
+
+    EVICT_INTERVAL = 60
+
+    def __init__(self, root, maxSize, maxAge):
+        self.root = root
+        self.maxSize = maxSize
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.fileHashes = {}
+        self.lastEvict = 0
+
+    def hashFile(self, path):
+        '''
+        Hash a file's contents, remembering the result for as long as its
+        size and mtime stay the same.
+        '''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return "missing"
+        if not os.path.isfile(path):
+            return "directory"
+        stamp = (st.st_mtime, st.st_size)
+        cached = self.fileHashes.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(2 ** 16)
+                if not block:
+                    break
+                h.update(block)
+        digest = h.hexdigest()
+        self.fileHashes[path] = (stamp, digest)
+        return digest
+
+    def key(self, cmd, inputData, dependencies):
+        '''
+        `cmd` is the argv without the input file, whose name is irrelevant
+        (and, for unsaved or preprocessed buffers, a random temp file);
+        `inputData` is the input's bytes.
+        '''
+        h = hashlib.sha1()
+        for arg in cmd:
+            h.update(arg.encode("utf-8"))
+            h.update(b"\0")
+        h.update(hashlib.sha1(inputData).hexdigest().encode("ascii"))
+        for dep in sorted(set(dependencies)):
+            h.update(dep.encode("utf-8"))
+            h.update(self.hashFile(dep).encode("ascii"))
+        return h.hexdigest()
+
+    def pathFor(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key):
+        '''
+        Return the path of the cached output for `key`, or None.
+        '''
+        path = self.pathFor(key)
+        if not os.path.isfile(path):
+            return None
+        if self.maxAge and time.time() - os.path.getmtime(path) > self.maxAge:
+            self.remove(path)
+            return None
+        # Bump the mtime so eviction is least-recently-used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def store(self, key, data=None, fromFile=None):
+        path = self.pathFor(key)
+        tmp = path + ".tmp"
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            if fromFile is not None:
+                shutil.copyfile(fromFile, tmp)
+            else:
+                with open(tmp, "wb") as f:
+                    f.write(data)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            self.remove(tmp)
+            return False
+        if time.time() - self.lastEvict > self.EVICT_INTERVAL:
+            self.evict()
+        return True
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def entries(self):
+        found = []
+        if not os.path.isdir(self.root):
+            return found
+        for sub in os.listdir(self.root):
+            subPath = os.path.join(self.root, sub)
+            if not os.path.isdir(subPath):
+                continue
+            for name in os.listdir(subPath):
+                path = os.path.join(subPath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, path))
+        return found
+
+    def evict(self):
+        '''
+        Drop entries older than maxAge, then the least recently used entries
+        until the cache fits in maxSize.
+        '''
+        with self.lock:
+            self.lastEvict = time.time()
+            now = time.time()
+            entries = sorted(self.entries())
+            total = 0
+            kept = []
+            for (mtime, size, path) in entries:
+                if self.maxAge and now - mtime > self.maxAge:
+                    self.remove(path)
+                else:
+                    kept.append((mtime, size, path))
+                    total += size
+            for (mtime, size, path) in kept:
+                if not self.maxSize or total <= self.maxSize:
+                    break
+                self.remove(path)
+                total -= size
+
+    def clear(self):
+        with self.lock:
+            self.fileHashes = {}
+            if os.path.isdir(self.root):
+                shutil.rmtree(self.root, ignore_errors=True)
+
+
+_caches = {}
+
+
+def cacheFor(root, maxSize, maxAge):
+    '''
+    The shared cache rooted at `root`. Sizes are in bytes, ages in seconds.
+    '''
+    cache = _caches.get(root)
+    if cache is None:
+        cache = PandownBuildCache(root, maxSize, maxAge)
+        _caches[root] = cache
+    else:
+        cache.maxSize = maxSize
+        cache.maxAge = maxAge
+    return cache
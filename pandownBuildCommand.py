@@ -7,12 +7,33 @@ import time
 import subprocess
 import json
 if __ST3:
-    import Pandown.minify_json as minify_json
-    from Pandown.pandownCriticPreprocessor import *
+    import Pandown.pandownIncludeIndex as pandownIncludeIndex
+    from Pandown.pandownProcess import buildCache, appendToView, stashInput, takeInput, logTimings, recordDependencies, dependencyGraph, submitThreadBuild
+    from Pandown.pandownDependencies import fileArguments
+    from Pandown.pandownBuildCache import cacheable
+    from Pandown.pandownPdf import PandownPdfBuild, usesPipeline
+    from Pandown.pandownTimings import PandownTimer
+    from Pandown.pandownFanOut import PandownFanOut
+    from Pandown.pandownIncremental import PandownIncrementalBuild
+    import Pandown.pandownConfig as pandownConfig
+    from Pandown.pandownCore import PandownConversion, streamsInput, toolchainForSettings
+    from Pandown.pandownStream import regionChunks
+    from Pandown.pandownOutputDiff import outputEdits
 else:
-    import minify_json
-    from pandownCriticPreprocessor import *
-import tempfile
+    import pandownIncludeIndex
+    from pandownProcess import buildCache, appendToView, stashInput, takeInput, logTimings, recordDependencies, dependencyGraph, submitThreadBuild
+    from pandownDependencies import fileArguments
+    from pandownBuildCache import cacheable
+    from pandownPdf import PandownPdfBuild, usesPipeline
+    from pandownTimings import PandownTimer
+    from pandownFanOut import PandownFanOut
+    from pandownIncremental import PandownIncrementalBuild
+    import pandownConfig
+    from pandownCore import PandownConversion, streamsInput, toolchainForSettings
+    from pandownStream import regionChunks
+    from pandownOutputDiff import outputEdits
+import codecs
+import shutil
 
 DEBUG_MODE = False
 
@@ -26,25 +47,50 @@ def err(e):
     print("[Pandown: " + str(e) + "]")
 
 
+def defaultArgumentsLayer():
+    unzipped = os.path.join(sublime.packages_path(), 'Pandown', 'default-pandoc-config-plain.json')
+    if os.path.exists(unzipped):
+        return pandownConfig.fileLayer(unzipped)
+    resource = "Packages/Pandown/default-pandoc-config-plain.json"
+    return pandownConfig.dataLayer(("resource", resource), lambda: json.loads(sublime.load_resource(resource)))
+
+
+_settingsGeneration = [0]
+
+
+def userArgumentsLayer(s):
+    '''
+    The pandoc_arguments from the user's settings, re-read only after Sublime
+    reports that the settings have changed.
+    '''
+    if _settingsGeneration[0] == 0:
+        def bump():
+            _settingsGeneration[0] += 1
+        s.clear_on_change("pandown-config")
+        s.add_on_change("pandown-config", bump)
+        _settingsGeneration[0] = 1
+    return pandownConfig.dataLayer(("settings", _settingsGeneration[0]), lambda: s.get("pandoc_arguments", None))
+
+
 class PandownBuildCommand(sublime_plugin.WindowCommand):
-    def run(self, pandoc_from="", pandoc_to=["", ""], do_open=False, prevent_viewing=False, to_window=False, **kwargs):
+    def run(self, pandoc_from="", pandoc_to=["", ""], do_open=False, prevent_viewing=False, to_window=False, pandoc_targets=None, view_id=None, live=False, **kwargs):
         global DEBUG_MODE, __ST3
-        env = {}
         self.view = self.window.active_view()
+        for aView in self.window.views():
+            if aView.id() == view_id:
+                self.view = aView
+        # Live previews rebuild as the user types, so they mustn't take the
+        # focus or pop up the build panel.
+        self.live = live
+        self.timer = PandownTimer()
+        self.timer.mark("settings")
         s = sublime.load_settings("Pandown.sublime-settings")
-        user_env = s.get("build_env", None)
-        if user_env:
-            env.update(user_env)
-        env.update(os.environ.copy())
-        if sublime.platform() == "osx" or sublime.platform() == "linux":
-            env['PATH'] = s.get("install_path", "/usr/local/bin") + ":" + s.get("texbin_path", "/usr/texbin") + ":" + env['PATH']
-        else:
-            env['PATH'] = s.get("install_path", "C:\\Program Files\\") + ";" + s.get("texbin_path", "C:\\Program Files\\MiKTeX 2.9\\miktex\\bin\\") + ";" + env['PATH']
-            env['PATH'] = str(env['PATH'])
+        toolchain = toolchainForSettings(s)
+        env = toolchain.env
 
-        # if not self.checkPandoc(env):
-        #     sublime.error_message("Pandown requires Pandoc")
-        #     return
+        if not toolchain.pandoc and not s.get("pandoc_server", False):
+            sublime.error_message("Pandown requires Pandoc, which isn't in install_path or on the PATH.")
+            return
 
         DEBUG_MODE = s.get("PANDOWN_DEBUG", False)
 
@@ -56,16 +102,18 @@ class PandownBuildCommand(sublime_plugin.WindowCommand):
             return
 
         inFile = self.view.file_name()
+        # The text to pipe to Pandoc, when it isn't reading inFile itself,
+        # or for a large buffer, the same a piece at a time.
+        inputText = None
+        inputChunks = None
+        # Whether a large criticized file is read a piece at a time. Every
+        # target of a fan-out build reads the same input, so it's read whole.
+        stream = False
 
         if inFile is None:
             self.toWindow = True
             self.workingDIR = ""
-            workingTemp = tempfile.NamedTemporaryFile("w+", delete=False)
-            buff = self.view.substr(sublime.Region(0, self.view.size()))
-            workingTemp.close()
-            with codecs.open(workingTemp.name, "w+", "utf-8") as f:
-                f.write(buff)
-            inFile = workingTemp.name
+            (inputText, inputChunks) = self.bufferInput(s)
             self.shouldOpen = False
             self.shouldDisplay = True
             self.outFile = ""
@@ -75,26 +123,46 @@ class PandownBuildCommand(sublime_plugin.WindowCommand):
             self.shouldOpen = True if (s.get("always_open", False) or do_open) else False
             self.shouldDisplay = True if (s.get("always_display", False) and not prevent_viewing) else False
             self.toWindow = to_window
-            workingTemp = None
+            if live or self.view.is_dirty():
+                # What's on disk is out of date; Pandoc still runs in the
+                # file's folder, so its includes resolve as they would.
+                (inputText, inputChunks) = self.bufferInput(s)
+            else:
+                stream = (self.toWindow or not pandoc_targets) and os.path.isfile(inFile) and streamsInput(s, os.path.getsize(inFile))
 
         self.includes_paths = s.get("includes_paths", [])
         if not isinstance(self.includes_paths, list):
             sublime.error_message("Pandown: includes_paths should be a list, or not set.")
             sublime.status_message("Build failed")
             return
-        self.includes_paths_len = len(self.includes_paths)
 
-        argDict = s.get("pandoc_arguments", None)
-
-        if s.get("preprocess_critic", False):
-            preprocessor = PandownCriticPreprocessor()
-            self.origIn = inFile
-            self.criticized = True
-            inFile = preprocessor.preprocessCritic(inFile)
+        allFolders = self.window.folders()
+        debug("allFolders: " + str(allFolders))
+        self.includeIndex = pandownIncludeIndex.indexFor(allFolders) if allFolders else None
+
+        argDict = userArgumentsLayer(s)
+        self.timer.stop("settings")
+
+        conversion = PandownConversion(inFile, pandoc_to, pandoc_from, argDict, self.includes_paths,
+            self.includeIndex, defaults=defaultArgumentsLayer(), text=inputText,
+            critic=s.get("preprocess_critic", False), toWindow=self.toWindow,
+            debug=debug, status=sublime.status_message, timer=self.timer, pandoc=toolchain.pandoc,
+            chunks=inputChunks, stream=stream)
+        self.origIn = inFile
+        self.piped = conversion.piped
+        self.builder = conversion.builder
+        inFile = conversion.inFile
+        inputText = conversion.text
+        cmd = conversion.cmd
+        self.timer.source = os.path.basename(self.origIn) if self.origIn else "untitled"
+        if self.toWindow:
+            self.timer.target = "window"
+        elif pandoc_targets:
+            self.timer.target = "+".join(target[0] for target in pandoc_targets)
         else:
-            self.criticized = False
-
-        cmd = self.buildPandocCmd(inFile, pandoc_to, pandoc_from, argDict)
+            self.timer.target = pandoc_to[0]
+        self.outFile = conversion.outFile
+        self.dependencies = conversion.dependencies
 
         debug(cmd)
 
@@ -103,17 +171,83 @@ class PandownBuildCommand(sublime_plugin.WindowCommand):
             sublime.error_message("Pandown: Error constructing Pandoc command.")
             return
 
-        if self.view.settings().get("show_panel_on_build", True):
+        # Checked against what Pandoc said it supports when it was probed,
+        # which the first build starts in the background.
+        for problem in toolchain.problems(cmd):
+            err(problem)
+            sublime.status_message("Pandown: " + problem)
+        toolchain.probeInBackground()
+
+        inputData = conversion.inputData
+        if conversion.streamed:
+            # There's no text to key the cache on or to split into sections.
+            debug("Streaming the input to Pandoc, without the build cache or incremental builds")
+
+        if pandoc_targets and not self.toWindow:
+            self.fanOut(inFile, pandoc_targets, pandoc_from, argDict, inputData, env)
+            return
+
+        cacheKey = None
+        cached = None
+        if s.get("build_cache", False) and not conversion.streamed and cacheable(cmd):
+            # The input's name doesn't matter, only its contents: for unsaved
+            # and criticized builds there's no file at all.
+            with self.timer.phase("cache lookup"):
+                cacheKey = buildCache().key(cmd[:-1] + [env['PATH']], inputData if self.piped else self.readInput(inFile),
+                    self.dependencies + fileArguments(cmd, self.workingDIR))
+                cached = buildCache().lookup(cacheKey)
+            debug("Cache key: %s (%s)" % (cacheKey, "hit" if cached else "miss"))
+
+        if self.view.settings().get("show_panel_on_build", True) and not cached and not live:
             self.window.run_command("show_panel", {"panel": "output.exec"})
 
+        use_server = s.get("pandoc_server", False)
+
+        incremental = None
+        if s.get("incremental_builds", False) and not cached and not conversion.streamed:
+            text = inputText if self.piped else self.readInput(inFile).decode("utf-8", "replace")
+            incremental = PandownIncrementalBuild(cmd, text, self.dependencies)
+            reason = incremental.fallbackReason()
+            if reason:
+                debug("Full build because " + reason)
+                incremental = None
+
+        pdf = None
+        if s.get("pdf_pipeline", False) and not cached and not self.toWindow and usesPipeline(cmd):
+            pdf = PandownPdfBuild(cmd, self.workingDIR, inputData, s.get("pdf_build_dir", ".pandown-build"))
+
         if not self.toWindow:
-            self.window.run_command("pandown_exec", {"cmd": cmd, "env": env})
-            self.openAndDisplay()
+            if cached:
+                try:
+                    shutil.copyfile(cached, self.outFile)
+                except (IOError, OSError) as e:
+                    err(e)
+                    cached = None
+                else:
+                    sublime.status_message("Build restored from cache")
+            record = self.dependencyRecord(cmd, pandoc_to, pandoc_from)
+            if cached:
+                recordDependencies(self.outFile, record)
+            execArgs = {"cmd": cmd, "env": env, "use_server": use_server, "cache_key": cacheKey, "out_file": self.outFile,
+                "input_key": stashInput(inputData) if self.piped else None, "view_id": self.view.id(),
+                "timer_key": stashInput(self.timer), "dependency_record": record}
+            if incremental:
+                self.buildIncrementally(incremental, env, execArgs)
+            elif pdf:
+                self.buildPdf(pdf, env, execArgs)
+            elif not cached:
+                self.window.run_command("pandown_exec", execArgs)
+                self.openAndDisplay()
+            else:
+                takeInput(execArgs["timer_key"])
+                self.openAndDisplay()
+                logTimings(self.timer, cached=True)
         else:
             wasShowing = False
             for theView in self.window.views():
                 if "Pandoc Output: " in theView.name():
-                    self.window.focus_view(theView)
+                    if not live:
+                        self.window.focus_view(theView)
                     outView = theView
                     wasShowing = True
                     break
@@ -121,27 +255,230 @@ class PandownBuildCommand(sublime_plugin.WindowCommand):
                 self.splitWindowAndFocus()
                 self.window.new_file()
                 outView = self.window.active_view()
-            outView.run_command("pandown_out_view_erase")
+                if live:
+                    self.window.focus_view(self.view)
             buffView = outView
 
-            self.window.run_command("pandown_exec", {"cmd": cmd, "env": env, "output_view": buffView.id()})
+            if cached:
+                with codecs.open(cached, "r", "utf-8") as f:
+                    output = f.read()
+                output = output.replace("\r\n", "\n").replace("\r", "\n")
+                with self.timer.phase("output streaming"):
+                    buffView.run_command("pandown_out_view_replace", {"text_key": stashInput(output)})
+                sublime.status_message("Build restored from cache")
+                logTimings(self.timer, cached=True)
+            else:
+                execArgs = {"cmd": cmd, "env": env, "output_view": buffView.id(), "use_server": use_server, "cache_key": cacheKey,
+                    "input_key": stashInput(inputData) if self.piped else None, "view_id": self.view.id(), "live": live,
+                    "timer_key": stashInput(self.timer)}
+                if incremental:
+                    self.buildIncrementally(incremental, env, execArgs, buffView)
+                else:
+                    self.window.run_command("pandown_exec", execArgs)
 
-            if not workingTemp and not self.criticized:
-                outView.set_name("Pandoc Output: " + os.path.split(inFile)[1])
-            elif self.criticized:
+            if self.origIn:
                 outView.set_name("Pandoc Output: " + os.path.split(self.origIn)[1])
             else:
                 outView.set_name("Pandoc Output: " + time.strftime("%X on %x"))
 
-    def checkPandoc(self, env):
-        cmd = ['pandoc', '--version']
-        try:
-            output = subprocess.check_call(cmd, env=env, shell=False)
-        except Exception as e:
-            err("Exception: " + str(e))
-            return False
+    def bufferInput(self, s):
+        '''
+        The view's text to pipe to Pandoc, as (text, None), or for a large
+        buffer (None, chunks) to read it a piece at a time.
+        '''
+        size = self.view.size()
+        if int(sublime.version()) >= 3000 and streamsInput(s, size):
+            # Read by the thread that writes to Pandoc, which Sublime Text
+            # 2's API can't be used from. Edits made meanwhile can shift
+            # what the later pieces hold, until the next build.
+            view = self.view
+            return (None, regionChunks(lambda start, end: view.substr(sublime.Region(start, end)), size))
+        return (self.view.substr(sublime.Region(0, size)), None)
+
+    def buildIncrementally(self, incremental, env, execArgs, outView=None):
+        '''
+        Convert only the sections that changed since the last build, off the
+        main thread, and write the stitched result to outView or the output
+        file. If Pandoc fails, run a full build so that it reports the errors.
+        '''
+        if int(sublime.version()) >= 3000:
+            panel = self.window.create_output_panel("exec")
+        else:
+            panel = self.window.get_output_panel("exec")
+        sublime.status_message("Building")
+        result = {}
+
+        def finish():
+            (output, elapsed) = (result["output"], result["elapsed"])
+            self.timer.add("pandoc", elapsed)
+            if output is None:
+                debug("Incremental build failed; running a full build")
+                self.window.run_command("pandown_exec", execArgs)
+                if outView is None:
+                    self.openAndDisplay()
+                return
+            # The full build's input and timer won't be needed.
+            takeInput(execArgs["input_key"])
+            takeInput(execArgs["timer_key"])
+            if outView is not None:
+                with self.timer.phase("output streaming"):
+                    outView.run_command("pandown_out_view_replace", {"text_key": stashInput(output.replace("\r\n", "\n"))})
+            else:
+                try:
+                    with codecs.open(self.outFile, "w", "utf-8") as f:
+                        f.write(output)
+                except (IOError, OSError) as e:
+                    err(e)
+                    sublime.status_message("Build failed")
+                    return
+                recordDependencies(self.outFile, execArgs["dependency_record"])
+                self.openAndDisplay()
+            appendToView(panel, "%s[Converted %d of %d sections in %.1fs]" % (incremental.messages, incremental.converted,
+                incremental.converted + incremental.reused, elapsed))
+            sublime.status_message("Build finished")
+            logTimings(self.timer, incremental=True, sections_converted=incremental.converted)
+
+        def build():
+            start = time.time()
+            result["output"] = incremental.run(env, self.workingDIR)
+            result["elapsed"] = time.time() - start
+            return 0 if result["output"] is not None else 1
+
+        def cancel():
+            # The full build's input and timer won't be needed either.
+            takeInput(execArgs["input_key"])
+            takeInput(execArgs["timer_key"])
+
+        if outView is None:
+            self.queueThreadBuild(self.outFile, os.path.basename(self.outFile), panel, build, finish, cancel)
+        else:
+            self.queueThreadBuild("window %s" % outView.id(), "Pandoc Output", panel, build, finish, cancel)
 
-        return output == 0
+    def dependencyRecord(self, cmd, to, pandoc_from):
+        '''
+        What a build with `cmd` reads, for the dependency graph: the source,
+        every file walkIncludes resolved, the files named by string
+        arguments, and the user's settings.
+        '''
+        inputs = [self.origIn] + self.dependencies + fileArguments(cmd, self.workingDIR)
+        userSettings = os.path.join(sublime.packages_path(), "User", "Pandown.sublime-settings")
+        if os.path.isfile(userSettings):
+            inputs.append(userSettings)
+        return {"source": self.origIn, "inputs": inputs, "to": list(to), "from": pandoc_from, "built": self.timer.started}
+
+    def queueThreadBuild(self, target, outName, panel, run, finish, cancel=None):
+        '''
+        Run a build that isn't a single pandown_exec process through the job
+        queue all the same, keyed as pandown_exec keys it, so that it waits
+        its turn, replaces an unfinished build of the same output, and can
+        be cancelled from "Pandown: Build Jobs".
+        '''
+        source = os.path.basename(self.view.file_name() or "") or self.view.name()
+        description = "%s to %s" % (source or "untitled", outName)
+        return submitThreadBuild((self.window.id(), self.view.id(), target), description, panel, run, finish, cancel)
+
+    def buildPdf(self, pdf, env, execArgs):
+        '''
+        Make the PDF with a PandownPdfBuild, off the main thread, cancelling
+        any earlier one of the same file.
+        '''
+        takeInput(execArgs["input_key"])
+        takeInput(execArgs["timer_key"])
+        if int(sublime.version()) >= 3000:
+            panel = self.window.create_output_panel("exec")
+        else:
+            panel = self.window.get_output_panel("exec")
+        sublime.status_message("Building")
+        result = {}
+
+        def finish():
+            (returncode, messages, elapsed) = (result["returncode"], result["messages"], result["elapsed"])
+            self.timer.add("pandoc", elapsed)
+            if messages:
+                appendToView(panel, messages + "\n")
+            if returncode == 0:
+                recordDependencies(self.outFile, execArgs["dependency_record"])
+                self.openAndDisplay()
+                appendToView(panel, "[Finished in %.1fs, %s]" % (elapsed, pdf.describe()))
+                sublime.status_message("Build finished")
+            else:
+                appendToView(panel, "[Finished in %.1fs with exit code %d]" % (elapsed, returncode))
+                sublime.status_message("Build failed")
+            logTimings(self.timer, exit_code=returncode, latex_passes=pdf.passes, format_reused=pdf.formatReused)
+
+        def build():
+            start = time.time()
+            (result["returncode"], result["messages"]) = pdf.run(env)
+            result["elapsed"] = time.time() - start
+            return result["returncode"]
+
+        self.queueThreadBuild(self.outFile, os.path.basename(self.outFile), panel, build, finish, pdf.cancel)
+
+    def readInput(self, inFile):
+        with open(inFile, "rb") as f:
+            return f.read()
+
+    def fanOut(self, inFile, targets, pandoc_from, argDict, inputData, env):
+        '''
+        Build several formats from a single parse of the document.
+        '''
+        commands = []
+        outFiles = []
+        records = {}
+        for target in targets:
+            targetCmd = self.builder.buildPandocCmd(inFile, target, pandoc_from, argDict)
+            if not targetCmd:
+                sublime.status_message("Build failed.")
+                sublime.error_message("Pandown: Error constructing Pandoc command.")
+                return
+            commands.append(targetCmd)
+            outFiles.append(self.builder.outFile)
+            records[self.builder.outFile] = self.dependencyRecord(targetCmd, target, pandoc_from)
+        if inputData is None:
+            inputData = self.readInput(inFile)
+
+        if int(sublime.version()) >= 3000:
+            panel = self.window.create_output_panel("exec")
+        else:
+            panel = self.window.get_output_panel("exec")
+        if self.view.settings().get("show_panel_on_build", True):
+            self.window.run_command("show_panel", {"panel": "output.exec"})
+        sublime.status_message("Building")
+
+        def report(job):
+            name = "AST" if job is fanOut.parseJob else os.path.basename(job.outFile)
+            if job.returncode == 0:
+                if job.outFile in records:
+                    recordDependencies(job.outFile, records[job.outFile], save=False)
+                line = "[ok] %s (%.1fs)\n" % (name, job.elapsed)
+            else:
+                line = "[failed] %s (%.1fs, exit code %s)\n" % (name, job.elapsed, job.returncode)
+            if job.output:
+                line += job.output + "\n"
+            sublime.set_timeout(lambda: appendToView(panel, line), 0)
+
+        cache = buildCache() if sublime.load_settings("Pandown.sublime-settings").get("build_cache", False) else None
+        fanOut = PandownFanOut(self.origIn, commands, outFiles, cache, inputData, self.dependencies, env, report)
+
+        result = {}
+
+        def build():
+            start = time.time()
+            jobs = fanOut.run()
+            failed = len([job for job in jobs if job.returncode != 0]) if jobs else 1
+            result["line"] = "[Built %d formats from %s AST in %.1fs]" % (len(jobs), "a cached" if fanOut.astCached else "one", time.time() - start)
+            result["message"] = "Build finished" if not failed else "Build finished with %d errors" % failed
+            self.timer.add("pandoc", time.time() - start)
+            dependencyGraph().save()
+            return 1 if failed else 0
+
+        def finish():
+            appendToView(panel, result["line"])
+            sublime.status_message(result["message"])
+            logTimings(self.timer, ast_cached=fanOut.astCached)
+
+        self.queueThreadBuild(tuple(outFiles), ", ".join(os.path.basename(outFile) for outFile in outFiles), panel,
+            build, finish, fanOut.cancel)
 
     def splitWindowAndFocus(self):
         theLayout = self.window.get_layout()
@@ -152,6 +489,10 @@ class PandownBuildCommand(sublime_plugin.WindowCommand):
         self.window.focus_group(1)
 
     def openAndDisplay(self):
+        with self.timer.phase("open/display"):
+            self.openOutput()
+
+    def openOutput(self):
         if self.shouldOpen:
             plat = sublime.platform()
             if plat == "osx":
@@ -183,201 +524,27 @@ class PandownBuildCommand(sublime_plugin.WindowCommand):
             theLayout = {"cells": [[0, 0, 1, 1]], "rows": [0.0, 1.0], "cols": [0.0, 1.0]}
             self.window.set_layout(theLayout)
 
-    def walkIncludes(self, lookFor, prepend=None):
-        '''
-        Check the includes_paths, then the project hierarchy, for the file to include,
-        but only if we don't already have a path.
-        Order of preference should be: working DIR, project DIRs, then includes_paths,
-        then finally giving up and passing the filename to Pandoc.
-        '''
-
-        debug("Looking for " + lookFor)
-        # Did the user pass a specific file?
-        tryAbs = os.path.abspath(os.path.expanduser(lookFor))
-        if os.path.isfile(tryAbs):
-            debug("It's a path! Returning.")
-            return prepend + tryAbs if prepend else tryAbs
 
-        # Is the file in the current build directory?
-        tryWorking = os.path.join(self.workingDIR, lookFor)
-        if os.path.exists(tryWorking):
-            debug("It's in the build directory! Returning.")
-            return prepend + tryWorking if prepend else tryWorking
-
-        # Is the file anywhere in the project hierarchy?
-        allFolders = self.window.folders()
-        debug("allFolders: " + str(allFolders))
-        if len(allFolders) > 0:
-            topLevel = ""
-            (garbage, localName) = os.path.split(self.workingDIR)
-            for folder in allFolders:
-                for root, dirs, files in os.walk(folder, topdown=False):
-                    (garbage, rootTail) = os.path.split(root)
-                    if rootTail == localName:
-                        topLevel = root
-                    for name in dirs:
-                        debug("name: " + name)
-                        if name == localName:
-                            topLevel = folder
-            debug("topLevel: " + topLevel)
-            checkDIR = self.workingDIR
-            debug("Initial checkDIR: " + checkDIR)
-            if topLevel:
-                while True:
-                    fileToCheck = os.path.join(checkDIR, lookFor)
-                    if os.path.exists(fileToCheck):
-                        debug("It's in the project! Returning %s." % fileToCheck)
-                        return prepend + fileToCheck if prepend else fileToCheck
-                    if checkDIR == topLevel:
-                        break
-                    else:
-                        checkDIR = os.path.abspath(os.path.join(checkDIR, os.path.pardir))
-
-        # Are there no paths to check?
-        if self.includes_paths_len == 0 and lookFor != "pandoc-config.json":
-            debug("No includes paths to check. Returning the input for Pandoc to handle.")
-            return prepend + lookFor if prepend else lookFor
-        # Is the file in the includes_paths?
-        for pathToCheck in self.includes_paths:
-            pathToCheck = os.path.expanduser(pathToCheck)
-            pathToCheck = os.path.abspath(pathToCheck)
-            fileToCheck = os.path.join(pathToCheck, lookFor)
-            if os.path.isfile(fileToCheck):
-                debug("It's in the includes paths! Returning: " + fileToCheck)
-                return prepend + fileToCheck if prepend else fileToCheck
-
-        # If the script was checking for a pandoc-config.json, return None.
-        if lookFor == "pandoc-config.json":
-            debug("Couldn't find config file in project path.")
-            return None
-        else:
-            # The file wasn't anywhere, so let Pandoc handle it.
-            debug("Can't find %s. Letting Pandoc deal with it." % lookFor)
-            return prepend + lookFor if prepend else lookFor
-
-        sublime.error_message("Fatal error looking for {0}".format(lookFor))
-        return None
-
-    def buildPandocCmd(self, inFile, to, pandoc_from, a):
-        __ST3 = int(sublime.version()) >= 3000
-        cmd = ['pandoc']
-
-        unzipped = os.path.join(sublime.packages_path(), 'Pandown', 'default-pandoc-config-plain.json')
-        if os.path.exists(unzipped):
-            with codecs.open(unzipped, "r", "utf-8") as f:
-                s = json.load(f)
-            s = s["pandoc_arguments"]
-        else:
-            r = sublime.load_resource("Packages/Pandown/default-pandoc-config-plain.json")
-            s = json.loads(r)
-            s = s["pandoc_arguments"]
-
-        s["command_arguments"]["indented-code-classes"].extend(a["command_arguments"].pop("indented-code-classes", []))
-        s["command_arguments"]["variables"].update(a["command_arguments"].pop("variables", {}))
-        s["command_arguments"]["include-in-header"].extend(a["command_arguments"].pop("include-in-header", []))
-        s["command_arguments"]["include-before-body"].extend(a["command_arguments"].pop("include-before-body", []))
-        s["command_arguments"]["include-after-body"].extend(a["command_arguments"].pop("include-after-body", []))
-        s["command_arguments"]["css"].extend(a["command_arguments"].pop("css", []))
-        s["command_arguments"]["number-offset"].extend(a["command_arguments"].pop("number-offset", []))
-        s["command_arguments"].update(a["command_arguments"])
-        s["markdown_extensions"].update(a.get("markdown_extensions", {}))
-
-        configLoc = self.walkIncludes("pandoc-config.json")
-        if configLoc:
-            try:
-                f = codecs.open(configLoc, "r", "utf-8")
-            except IOError as e:
-                sublime.status_message("Error: pandoc-config exists, but could not be read.")
-                err("Pandown Exception: " + str(e))
-                err("See README for help and support information.")
-                f.close()
-            else:
-                pCommentedStr = f.read()
-                f.close()
-                pStr = minify_json.json_minify(pCommentedStr)
-                try:
-                    p = json.loads(pStr)
-                except (KeyError, ValueError) as e:
-                    sublime.status_message("JSON Error: Cannot parse pandoc-config. See console for details.")
-                    err("Pandown Exception: " + str(e))
-                    err("See README for help and support information.")
-                    return None
-                if "pandoc_arguments" in p:
-                    pArg = p["pandoc_arguments"]
-                    p = pArg
-
-            if p.get("command_arguments", None):
-                s["command_arguments"]["indented-code-classes"].extend(p["command_arguments"].pop("indented-code-classes", []))
-                s["command_arguments"]["variables"].update(p["command_arguments"].pop("variables", {}))
-                s["command_arguments"]["include-in-header"].extend(p["command_arguments"].pop("include-in-header", []))
-                s["command_arguments"]["include-before-body"].extend(p["command_arguments"].pop("include-before-body", []))
-                s["command_arguments"]["include-after-body"].extend(p["command_arguments"].pop("include-after-body", []))
-                s["command_arguments"]["css"].extend(p["command_arguments"].pop("css", []))
-                s["command_arguments"]["number-offset"].extend(p["command_arguments"].pop("number-offset", []))
-                s["command_arguments"].update(p["command_arguments"])
-            if p.get("markdown_extensions", None):
-                s["markdown_extensions"].update(p["markdown_extensions"])
-
-        markdown_extensions = s["markdown_extensions"]
-        if pandoc_from == "markdown":
-            md_config = "markdown"
-            for (k, v) in markdown_extensions.items():
-                sign = "+" if v else "-"
-                append = "%s%s" % (sign, k)
-                md_config += append
-            pandoc_from = md_config
-
-        # if self.makePDF:
-        #     self.outFile = os.path.splitext(inFile)[0] + ".pdf" if not self.criticized else os.path.splitext(self.origIn)[0] + ".pdf"
-        #     cmd.append("--output=" + self.outFile)
-        #     cmd.append("--from=" + pandoc_from)
-        if self.toWindow:
-            pass
-        else:
-            self.outFile = os.path.splitext(inFile)[0] + to[1] if not self.criticized else os.path.splitext(self.origIn)[0] + to[1]
-            cmd.append("--output=" + self.outFile)
-            cmd.append("--to=" + to[0])
-            cmd.append("--from=" + pandoc_from)
-
-        command_arguments = s["command_arguments"]
-        for (k, v) in command_arguments.items():
-            if v is False:
-                pass
-            elif v is True and k != "toc-depth" and k != "base-header-level" and k != "slide-level" and k != "tab-stop":
-                cmd.append("--%s" % k)
-            elif isinstance(v, list) and len(v) > 0:
-                if k == "indented-code-classes" or k == "number-offset":
-                    buff = "--%s=" % k
-                    for item in v:
-                        buff += str(item) + ","
-                    cmd.append(buff[:-1])
-                else:
-                    for theFile in v:
-                        toAppend = self.walkIncludes(theFile, prepend="--%s=" % k)
-                        cmd.append(toAppend)
-            elif isinstance(v, dict):
-                for (_k, _v) in v.items():
-                    if isinstance(_v, list):
-                        for item in _v:
-                            cmd.append("--variable=" + _k + ":" + item)
-                    else:
-                        if _v is not False:
-                            cmd.append("--variable=" + _k + ":" + _v)
-            elif not __ST3 and (((isinstance(v, unicode) or isinstance(v, str)) and len(v) > 0) or isinstance(v, int)):
-                if k == "template":
-                    cmd.append(self.walkIncludes(v, prepend="--%s=" % k))
-                else:
-                    cmd.append("--%s=%s" % (k, v))
-            elif __ST3 and ((isinstance(v, str) and len(v) > 0) or isinstance(v, int)):
-                if k == "template":
-                    cmd.append(self.walkIncludes(v, prepend="--%s=" % k))
-                else:
-                    cmd.append("--%s=%s" % (k, v))
-        cmd.append(inFile)
+class PandownOutViewReplaceCommand(sublime_plugin.TextCommand):
+    '''
+    Show a build's output in place of what the view holds, changing only the
+    lines that differ, in one edit, without moving the viewport. The output
+    is stashed under `text_key`, since it can be too big to pass as an
+    argument.
+    '''
 
-        return cmd
+    def run(self, edit, text_key=None):
+        text = takeInput(text_key)
+        if text is None:
+            return
+        old = self.view.substr(sublime.Region(0, self.view.size()))
+        position = self.view.viewport_position()
+        for (begin, end, characters) in reversed(outputEdits(old, text)):
+            self.view.replace(edit, sublime.Region(begin, end), characters)
+        self.view.set_viewport_position(position, False)
 
 
-class PandownOutViewEraseCommand(sublime_plugin.TextCommand):
-    def run(self, edit):
-        self.view.erase(edit, sublime.Region(0, self.view.size()))
+class PandownIncludeIndexListener(sublime_plugin.EventListener):
+    def on_post_save(self, view):
+        if view.file_name():
+            pandownIncludeIndex.noteFile(view.file_name())
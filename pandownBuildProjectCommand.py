@@ -0,0 +1,131 @@
+from __future__ import print_function
+import sublime
+import sublime_plugin
+import os
+import threading
+import time
+if int(sublime.version()) >= 3000:
+    from Pandown.pandownBatch import discoverSources, makeJob, PandownBatchRunner, describeJob, describeRun
+    from Pandown.pandownBuildCommand import defaultArgumentsLayer, userArgumentsLayer
+    from Pandown.pandownCore import toolchainForSettings
+    from Pandown.pandownCriticPreprocessor import criticPreprocessor
+    from Pandown.pandownProcess import appendToView, recordDependencies, dependencyGraph, jobQueue, submitThreadBuild
+    import Pandown.pandownIncludeIndex as pandownIncludeIndex
+else:
+    from pandownBatch import discoverSources, makeJob, PandownBatchRunner, describeJob, describeRun
+    from pandownBuildCommand import defaultArgumentsLayer, userArgumentsLayer
+    from pandownCore import toolchainForSettings
+    from pandownCriticPreprocessor import criticPreprocessor
+    from pandownProcess import appendToView, recordDependencies, dependencyGraph, jobQueue, submitThreadBuild
+    import pandownIncludeIndex
+
+
+class PandownBuildProjectCommand(sublime_plugin.WindowCommand):
+    def run(self, pandoc_from="", pandoc_to=["html", ".html"], queue_if_busy=False, **kwargs):
+        folders = self.window.folders()
+        if not folders:
+            sublime.status_message("Pandown: there are no project folders to build.")
+            return
+        if getattr(self, "runner", None):
+            if queue_if_busy:
+                # Run again once this build is done, since what changed may
+                # have been read too early.
+                self.queued = (pandoc_from, pandoc_to)
+            else:
+                sublime.status_message("Pandown: a project build is already running.")
+            return
+
+        s = sublime.load_settings("Pandown.sublime-settings")
+        toolchain = toolchainForSettings(s)
+        self.pandoc = toolchain.pandoc
+        self.pdfBuildDir = s.get("pdf_build_dir", ".pandown-build") if s.get("pdf_pipeline", False) else None
+        env = toolchain.env
+        includes_paths = s.get("includes_paths", [])
+        arguments = userArgumentsLayer(s)
+        preprocess = None
+        if s.get("preprocess_critic", False):
+            preprocess = criticPreprocessor().preprocessCritic
+        # Loading the package defaults may need the Sublime API, which is only
+        # safe to call from here.
+        defaults = defaultArgumentsLayer()
+        userSettings = os.path.join(sublime.packages_path(), "User", "Pandown.sublime-settings")
+        self.settingsFiles = [userSettings] if os.path.isfile(userSettings) else []
+
+        if int(sublime.version()) >= 3000:
+            self.output_view = self.window.create_output_panel("exec")
+        else:
+            self.output_view = self.window.get_output_panel("exec")
+        self.output_view.settings().set("word_wrap", True)
+        self.output_view.settings().set("line_numbers", False)
+        self.output_view.settings().set("gutter", False)
+        self.window.run_command("show_panel", {"panel": "output.exec"})
+        sublime.status_message("Building project")
+
+        self.runner = True
+        threading.Thread(target=self.build, args=(folders, pandoc_from, pandoc_to, arguments, includes_paths, defaults, preprocess, env)).start()
+
+    def build(self, folders, pandoc_from, pandoc_to, arguments, includes_paths, defaults, preprocess, env):
+        jobs = []
+        try:
+            index = pandownIncludeIndex.indexFor(folders)
+            jobs = self.makeJobs(folders, index, pandoc_from, pandoc_to, arguments, includes_paths, defaults, preprocess)
+            for job in jobs:
+                if job.record:
+                    job.record["inputs"] += self.settingsFiles
+        finally:
+            root = folders[0] if len(folders) == 1 else None
+            sublime.set_timeout(lambda: self.submit(jobs, env, root), 0)
+
+    def submit(self, jobs, env, root):
+        '''
+        Queue each document's conversion in the job queue, where it waits
+        its turn with every other build and can be cancelled from "Pandown:
+        Build Jobs".
+        '''
+        self.runner = PandownBatchRunner(jobs, env)
+        self.pending = len(jobs)
+        self.started = time.time()
+        if not jobs:
+            self.finished(jobs)
+        for job in jobs:
+            self.submitJob(job, jobs, root)
+
+    def submitJob(self, job, jobs, root):
+        def run():
+            self.runner.runJob(job)
+            if job.returncode == 0 and job.record:
+                recordDependencies(job.outFile, job.record, save=False)
+            self.append(describeJob(job, root) + "\n")
+            return job.returncode
+
+        def ended(queued):
+            if job.returncode is None:
+                # Cancelled before it started, or while it ran.
+                job.returncode = -1
+            self.pending -= 1
+            if not self.pending:
+                self.finished(jobs)
+
+        description = "%s to %s" % (os.path.basename(job.source), os.path.basename(job.outFile or ""))
+        submitThreadBuild((self.window.id(), job.outFile or job.source), description, self.output_view, run,
+            lambda: None, lambda: self.runner.cancelJob(job), ended)
+
+    def finished(self, jobs):
+        dependencyGraph().save()
+        self.append(describeRun(jobs, time.time() - self.started, jobQueue().limit))
+        failed = len([job for job in jobs if job.returncode != 0])
+        sublime.status_message("Project build finished" if not failed else "Project build finished with %d errors" % failed)
+        self.runner = None
+        queued = getattr(self, "queued", None)
+        if queued:
+            self.queued = None
+            self.run(*queued)
+
+    def makeJobs(self, folders, index, pandoc_from, pandoc_to, arguments, includes_paths, defaults, preprocess):
+        sources = discoverSources(folders, index)
+        self.append("[Converting %d documents to %s]\n" % (len(sources), pandoc_to[0]))
+        return [makeJob(source, pandoc_to, pandoc_from, arguments, includes_paths, index,
+            defaults=defaults, preprocess=preprocess, pandoc=self.pandoc, pdfBuildDir=self.pdfBuildDir) for source in sources]
+
+    def append(self, string):
+        sublime.set_timeout(lambda: appendToView(self.output_view, string), 0)
@@ -0,0 +1,25 @@
+import sublime
+import sublime_plugin
+if int(sublime.version()) >= 3000:
+    from Pandown.pandownProcess import timingLog
+    from Pandown.pandownTimings import summarize
+else:
+    from pandownProcess import timingLog
+    from pandownTimings import summarize
+
+
+class PandownBuildTimingsCommand(sublime_plugin.WindowCommand):
+    '''
+    Summarize the logged build timings, per target format, in a new view.
+    '''
+
+    def run(self):
+        records = timingLog().records()
+        if not records:
+            sublime.status_message("Pandown: no build timings logged yet")
+            return
+        view = self.window.new_file()
+        view.set_name("Pandown Build Timings")
+        view.set_scratch(True)
+        view.run_command("append", {"characters": "Timings for the last %d builds\n\n%s" % (len(records), summarize(records)), "force": True})
+        view.set_read_only(True)
@@ -0,0 +1,12 @@
+import sublime
+import sublime_plugin
+if int(sublime.version()) >= 3000:
+    from Pandown.pandownProcess import buildCache
+else:
+    from pandownProcess import buildCache
+
+
+class PandownClearBuildCacheCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        buildCache().clear()
+        sublime.status_message("Pandown build cache cleared")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''
+Build Pandown documents without Sublime Text, using the same settings,
+pandoc-config.json files, and include resolution as the editor:
+
+    python pandownCli.py convert chapter1.md --to docx
+    python pandownCli.py build-project ~/book --to html5 --ext .html
+
+Settings are read from the package's Pandown.sublime-settings and then from
+any files passed with --settings (e.g. Packages/User/Pandown.sublime-settings),
+later files taking precedence, just as in Sublime.
+'''
+from __future__ import print_function
+import os
+import sys
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from Pandown.pandownBatch import discoverSources, makeJob, PandownBatchRunner, describeJob, describeRun
+    from Pandown.pandownCore import convert, extensionFor, loadSettings, toolchainForSettings
+    from Pandown.pandownCriticPreprocessor import criticPreprocessor
+    import Pandown.pandownConfig as pandownConfig
+    import Pandown.pandownIncludeIndex as pandownIncludeIndex
+except ImportError:
+    from pandownBatch import discoverSources, makeJob, PandownBatchRunner, describeJob, describeRun
+    from pandownCore import convert, extensionFor, loadSettings, toolchainForSettings
+    from pandownCriticPreprocessor import criticPreprocessor
+    import pandownConfig
+    import pandownIncludeIndex
+
+
+def buildProject(args):
+    settings = loadSettings(args.settings)
+    folders = [os.path.abspath(folder) for folder in args.folders]
+    toolchain = toolchainForSettings(settings)
+    preprocess = None
+    if args.critic or settings.get("preprocess_critic", False):
+        preprocess = criticPreprocessor().preprocessCritic
+    index = pandownIncludeIndex.indexFor(folders)
+    sources = discoverSources(folders, index)
+    print("[Converting %d documents to %s]" % (len(sources), args.to))
+    arguments = pandownConfig.argumentsLayer(settings.get("pandoc_arguments", None))
+    pdfBuildDir = settings.get("pdf_build_dir", ".pandown-build") if settings.get("pdf_pipeline", False) else None
+    jobs = [makeJob(source, [args.to, args.ext], args.pandoc_from, arguments, settings.get("includes_paths", []), index,
+        preprocess=preprocess, pandoc=toolchain.pandoc, pdfBuildDir=pdfBuildDir) for source in sources]
+    root = folders[0] if len(folders) == 1 else None
+    runner = PandownBatchRunner(jobs, toolchain.env, args.jobs or settings.get("project_build_workers", 0) or None,
+        onResult=lambda job: print(describeJob(job, root)))
+    runner.run()
+    print(describeRun(jobs, runner.elapsed, runner.workers))
+    return 0 if all(job.returncode == 0 for job in jobs) else 1
+
+
+def convertFile(args):
+    settings = loadSettings(args.settings)
+    critic = True if args.critic else None
+    result = convert(args.file, args.to, args.ext, args.pandoc_from, settings, args.folders, critic=critic, toStdout=args.stdout)
+    if args.stdout:
+        sys.stdout.write(result.output)
+    if result.messages:
+        print(result.messages, file=sys.stderr)
+    if result.returncode == 0 and not args.stdout:
+        print("[Wrote %s in %.2fs]" % (result.outFile, result.elapsed))
+    return 0 if result.returncode == 0 else 1
+
+
+def main(argv=None):
+    # Imported here so that Sublime Text 2's Python 2.6, which lacks
+    # argparse, can still load this module as a plugin.
+    import argparse
+    parser = argparse.ArgumentParser(prog="pandown", description="Build documents with Pandown's Pandoc configuration.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    single = subparsers.add_parser("convert", help="convert one document")
+    single.add_argument("file", help="document to convert")
+    single.add_argument("--to", default="html", help="Pandoc writer (default: html)")
+    single.add_argument("--ext", default=None, help="output file extension (default: .TO)")
+    single.add_argument("--from", dest="pandoc_from", default=None, help="Pandoc reader (default: by file extension)")
+    single.add_argument("--folder", dest="folders", action="append", default=[], help="project folder to find includes and pandoc-config.json files in")
+    single.add_argument("--critic", action="store_true", help="convert CriticMarkup first (default: the preprocess_critic setting)")
+    single.add_argument("--stdout", action="store_true", help="write Pandoc's default output to stdout instead of a file")
+    single.add_argument("--settings", action="append", default=[], help="additional Pandown.sublime-settings file")
+    single.set_defaults(func=convertFile)
+
+    project = subparsers.add_parser("build-project", help="convert every document under one or more project folders")
+    project.add_argument("folders", nargs="+", help="project folders to search for documents")
+    project.add_argument("--to", default="html", help="Pandoc writer (default: html)")
+    project.add_argument("--ext", default=None, help="output file extension (default: .TO)")
+    project.add_argument("--from", dest="pandoc_from", default=None, help="Pandoc reader (default: by file extension)")
+    project.add_argument("--critic", action="store_true", help="convert CriticMarkup first (default: the preprocess_critic setting)")
+    project.add_argument("--jobs", "-j", type=int, default=0, help="number of parallel conversions (default: CPU count)")
+    project.add_argument("--settings", action="append", default=[], help="additional Pandown.sublime-settings file")
+    project.set_defaults(func=buildProject)
+
+    args = parser.parse_args(argv)
+    if not getattr(args, "func", None):
+        parser.print_help()
+        return 2
+    if getattr(args, "ext", None) is None and hasattr(args, "to"):
+        args.ext = extensionFor(args.to)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+from __future__ import print_function
+import os
+import threading
+try:
+    import Pandown.pandownConfig as pandownConfig
+    from Pandown.pandownTimings import PandownTimer
+except ImportError:
+    import pandownConfig
+    from pandownTimings import PandownTimer
+
+PACKAGE_DIR = pandownConfig.PACKAGE_DIR
+# The input file that tells Pandoc to read from stdin, for text that isn't
+# (or isn't yet) on disk.
+STDIN = "-"
+
+_templatesLock = threading.Lock()
+_templates = {}
+MAX_TEMPLATES = 128
+
+
+def argumentName(arg):
+    return arg[2:].partition("=")[0]
+
+
+def buildEnvironment(install_path=None, texbin_path=None, user_env=None):
+    '''
+    The environment Pandoc runs in: the user's build_env, the current
+    environment, and the Pandoc and TeX directories at the front of PATH.
+    '''
+    env = {}
+    if user_env:
+        env.update(user_env)
+    env.update(os.environ.copy())
+    if os.name == "nt":
+        install_path = install_path or "C:\\Program Files\\"
+        texbin_path = texbin_path or "C:\\Program Files\\MiKTeX 2.9\\miktex\\bin\\"
+    else:
+        install_path = install_path or "/usr/local/bin"
+        texbin_path = texbin_path or "/usr/texbin"
+    env['PATH'] = str(install_path + os.pathsep + texbin_path + os.pathsep + env.get('PATH', ''))
+    return env
+
+
+class PandownCommandBuilder(object):
+    '''
+    Constructs Pandoc command lines and resolves included files, independent
+    of Sublime, so the same logic serves editor builds and headless ones.
+    '''
+
+    def __init__(self, workingDIR, includes_paths, includeIndex=None, defaults=None, toWindow=False, origIn=None, debug=None, status=None, timer=None, pandoc=None):
+        self.workingDIR = workingDIR
+        self.includes_paths = includes_paths
+        self.includes_paths_len = len(includes_paths)
+        self.includeIndex = includeIndex
+        self.defaults = defaults
+        self.toWindow = toWindow
+        self.origIn = origIn
+        self.criticized = origIn is not None
+        self.debug = debug or (lambda message: None)
+        self.status = status or (lambda message: None)
+        self.timer = timer or PandownTimer()
+        # Pandoc's absolute path, if it's been resolved.
+        self.pandoc = pandoc or "pandoc"
+        self.outFile = ""
+        self.dependencies = []
+
+    def err(self, e):
+        print("[Pandown: " + str(e) + "]")
+
+    def walkIncludes(self, lookFor, prepend=None):
+        with self.timer.phase("include resolution"):
+            return self.findInclude(lookFor, prepend)
+
+    def findInclude(self, lookFor, prepend=None):
+        '''
+        Check the includes_paths, then the project hierarchy, for the file to include,
+        but only if we don't already have a path.
+        Order of preference should be: working DIR, project DIRs, then includes_paths,
+        then finally giving up and passing the filename to Pandoc.
+        '''
+
+        debug = self.debug
+        debug("Looking for " + lookFor)
+        # Did the user pass a specific file?
+        tryAbs = os.path.abspath(os.path.expanduser(lookFor))
+        if os.path.isfile(tryAbs):
+            debug("It's a path! Returning.")
+            self.dependencies.append(tryAbs)
+            return prepend + tryAbs if prepend else tryAbs
+
+        # Is the file in the current build directory?
+        tryWorking = os.path.join(self.workingDIR, lookFor)
+        if os.path.exists(tryWorking):
+            debug("It's in the build directory! Returning.")
+            self.dependencies.append(tryWorking)
+            return prepend + tryWorking if prepend else tryWorking
+
+        # Is the file anywhere in the project hierarchy?
+        if self.includeIndex and self.workingDIR:
+            fileToCheck = self.includeIndex.find(lookFor, self.workingDIR)
+            if fileToCheck:
+                debug("It's in the project! Returning %s." % fileToCheck)
+                self.dependencies.append(fileToCheck)
+                return prepend + fileToCheck if prepend else fileToCheck
+
+        # Are there no paths to check?
+        if self.includes_paths_len == 0 and lookFor != "pandoc-config.json":
+            debug("No includes paths to check. Returning the input for Pandoc to handle.")
+            return prepend + lookFor if prepend else lookFor
+        # Is the file in the includes_paths?
+        for pathToCheck in self.includes_paths:
+            pathToCheck = os.path.expanduser(pathToCheck)
+            pathToCheck = os.path.abspath(pathToCheck)
+            fileToCheck = os.path.join(pathToCheck, lookFor)
+            if os.path.isfile(fileToCheck):
+                debug("It's in the includes paths! Returning: " + fileToCheck)
+                self.dependencies.append(fileToCheck)
+                return prepend + fileToCheck if prepend else fileToCheck
+
+        # If the script was checking for a pandoc-config.json, return None.
+        if lookFor == "pandoc-config.json":
+            debug("Couldn't find config file in project path.")
+            return None
+        else:
+            # The file wasn't anywhere, so let Pandoc handle it.
+            debug("Can't find %s. Letting Pandoc deal with it." % lookFor)
+            return prepend + lookFor if prepend else lookFor
+
+    def resolveConfig(self, a):
+        '''
+        The merged configuration for this build: the package defaults, then
+        `a` (the user's pandoc_arguments, as a dict or a config layer), then
+        the project's pandoc-config.json, if there is one.
+        '''
+        layers = [self.defaults or pandownConfig.packageDefaultsLayer()]
+        if isinstance(a, pandownConfig.PandownConfigLayer):
+            layers.append(a)
+        elif a:
+            layers.append(pandownConfig.argumentsLayer(a))
+
+        configLoc = self.walkIncludes("pandoc-config.json")
+        if configLoc:
+            try:
+                layers.append(pandownConfig.fileLayer(configLoc))
+            except (IOError, OSError) as e:
+                self.status("Error: pandoc-config exists, but could not be read.")
+                self.err("Pandown Exception: " + str(e))
+                self.err("See README for help and support information.")
+            except (KeyError, ValueError) as e:
+                self.status("JSON Error: Cannot parse pandoc-config. See console for details.")
+                self.err("Pandown Exception: " + str(e))
+                self.err("See README for help and support information.")
+                return None
+
+        return pandownConfig.resolve(layers)
+
+    def buildPandocCmd(self, inFile, to, pandoc_from, a):
+        cmd = [self.pandoc]
+
+        with self.timer.phase("config merge"):
+            config = self.resolveConfig(a)
+        if config is None:
+            return None
+
+        if self.toWindow:
+            pass
+        else:
+            self.outFile = os.path.splitext(inFile)[0] + to[1] if not self.criticized else os.path.splitext(self.origIn)[0] + to[1]
+            cmd.append("--output=" + self.outFile)
+
+        cmd.extend(self.argumentTemplate(config, to, pandoc_from))
+        cmd.append(inFile)
+
+        return cmd
+
+    def argumentTemplate(self, config, to, pandoc_from):
+        '''
+        The arguments between the output and input files, with every include
+        resolved. They're the same for every document in a directory built
+        to the same format, so they're reused until the configuration, the
+        include index, or the directories lookups fall back on change.
+        '''
+        folders = [self.workingDIR] + [os.path.abspath(os.path.expanduser(folder)) for folder in self.includes_paths]
+        stamps = []
+        for folder in folders:
+            try:
+                stamps.append(os.stat(folder).st_mtime)
+            except OSError:
+                stamps.append(None)
+        key = (config, self.workingDIR, tuple(self.includes_paths), tuple(to[:1]), pandoc_from, self.toWindow, self.pandoc,
+            (self.includeIndex.folders, self.includeIndex.generation) if self.includeIndex else None, tuple(stamps))
+        with _templatesLock:
+            template = _templates.get(key)
+        if template is not None and all(os.path.isfile(path) for path in template[2]):
+            self.dependencies.extend(template[1])
+            return template[0]
+
+        args = []
+        if not self.toWindow:
+            args.append("--to=" + to[0])
+            args.append("--from=" + config.pandocFrom(pandoc_from))
+        resolvedFrom = len(self.dependencies)
+        for fragment in config.fragments:
+            if isinstance(fragment, tuple):
+                args.append(self.walkIncludes(fragment[1], prepend=fragment[0]))
+            else:
+                args.append(fragment)
+        resolved = tuple(self.dependencies[resolvedFrom:])
+        # Files given by absolute paths, or found outside the project, could
+        # go away without any of the key's stamps changing.
+        unwatched = tuple(path for path in resolved if os.path.dirname(path) not in folders
+            and not (self.includeIndex and self.includeIndex.projectFolderFor(path)))
+        with _templatesLock:
+            if len(_templates) >= MAX_TEMPLATES:
+                _templates.clear()
+            _templates[key] = (tuple(args), resolved, unwatched)
+        return args
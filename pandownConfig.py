@@ -0,0 +1,221 @@
+import codecs
+import json
+import os
+import threading
+try:
+    import Pandown.minify_json as minify_json
+except ImportError:
+    import minify_json
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# These arguments take numbers, so `true` isn't a meaningful flag for them.
+NUMERIC_ARGUMENTS = ("toc-depth", "base-header-level", "slide-level", "tab-stop")
+# List arguments that are joined with commas rather than repeated.
+JOINED_ARGUMENTS = ("indented-code-classes", "number-offset")
+# List arguments whose entries are merged across settings layers rather than
+# replaced.
+MERGED_LISTS = ("indented-code-classes", "include-in-header", "include-before-body", "include-after-body", "css", "number-offset")
+
+
+class FrozenDict(dict):
+    '''
+    A dict that refuses to be modified, so that a resolved configuration can
+    be shared between builds without one build's changes leaking into the
+    next.
+    '''
+
+    def refuse(self, *args, **kwargs):
+        raise TypeError("Pandown configurations are read-only; copy.deepcopy() one to modify it.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = refuse
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def freeze(obj):
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for (k, v) in obj.items())
+    if isinstance(obj, list):
+        return tuple(freeze(item) for item in obj)
+    return obj
+
+
+def thaw(obj):
+    '''
+    A mutable deep copy of a frozen (or plain) configuration.
+    '''
+    if isinstance(obj, dict):
+        return dict((k, thaw(v)) for (k, v) in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [thaw(item) for item in obj]
+    return obj
+
+
+def mergeArguments(s, a):
+    '''
+    Merge the pandoc_arguments dict `a` into `s`, in place. Lists and the
+    variables dict are combined; everything else in `a` wins.
+    '''
+    a = thaw(a or {})
+    command_arguments = a.get("command_arguments", {})
+    for k in MERGED_LISTS:
+        s["command_arguments"][k].extend(command_arguments.pop(k, []))
+    s["command_arguments"]["variables"].update(command_arguments.pop("variables", {}))
+    s["command_arguments"].update(command_arguments)
+    s["markdown_extensions"].update(a.get("markdown_extensions", {}))
+    return s
+
+
+class PandownConfigLayer(object):
+    '''
+    One source of pandoc_arguments: the package defaults, the user's
+    settings, or a project's pandoc-config.json. `key` identifies this
+    version of the layer's contents.
+    '''
+
+    def __init__(self, key, arguments, path=None):
+        self.key = key
+        self.arguments = freeze(arguments)
+        self.path = path
+
+
+_layersLock = threading.Lock()
+_fileLayers = {}
+_dataLayers = {}
+MAX_DATA_LAYERS = 64
+
+
+def fileLayer(path):
+    '''
+    The layer for a (commented) JSON file, re-read only if its mtime or size
+    has changed. Raises IOError or ValueError if it can't be read.
+    '''
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size)
+    with _layersLock:
+        cached = _fileLayers.get(path)
+    if cached and cached.key[1] == stamp:
+        return cached
+    with codecs.open(path, "r", "utf-8") as f:
+        data = minify_json.json_loads(f.read())
+    layer = PandownConfigLayer((path, stamp), data.get("pandoc_arguments", data), path)
+    with _layersLock:
+        _fileLayers[path] = layer
+    return layer
+
+
+def dataLayer(key, loader):
+    '''
+    A layer for arguments that don't come straight from a file, e.g. Sublime's
+    settings or a zipped package resource. `loader` is only called if there's
+    no layer for `key` yet, so callers must change `key` whenever the data
+    would change.
+    '''
+    with _layersLock:
+        cached = _dataLayers.get(key)
+    if cached:
+        return cached
+    data = loader() or {}
+    layer = PandownConfigLayer(key, data.get("pandoc_arguments", data))
+    with _layersLock:
+        if len(_dataLayers) >= MAX_DATA_LAYERS:
+            _dataLayers.clear()
+        _dataLayers[key] = layer
+    return layer
+
+
+def argumentsLayer(arguments):
+    '''
+    A layer for a pandoc_arguments dict with no better identity than its
+    contents.
+    '''
+    return dataLayer(("arguments", json.dumps(arguments, sort_keys=True)), lambda: arguments)
+
+
+def packageDefaultsLayer():
+    return fileLayer(os.path.join(PACKAGE_DIR, "default-pandoc-config-plain.json"))
+
+
+class PandownResolvedConfig(object):
+    '''
+    The merged, read-only result of a stack of layers, along with the parts of
+    the Pandoc command line that don't depend on the document being built:
+    the Markdown reader string and the argument list. Arguments that name
+    files to be found by walkIncludes are left as (prefix, filename) pairs.
+    '''
+
+    def __init__(self, layers):
+        merged = thaw(layers[0].arguments)
+        for layer in layers[1:]:
+            mergeArguments(merged, layer.arguments)
+        self.arguments = freeze(merged)
+        self.markdownFrom = self.compileMarkdownFrom()
+        self.fragments = self.compileFragments()
+
+    def compileMarkdownFrom(self):
+        md_config = "markdown"
+        for (k, v) in self.arguments["markdown_extensions"].items():
+            sign = "+" if v else "-"
+            md_config += "%s%s" % (sign, k)
+        return md_config
+
+    def compileFragments(self):
+        fragments = []
+        for (k, v) in self.arguments["command_arguments"].items():
+            if v is False:
+                pass
+            elif v is True and k not in NUMERIC_ARGUMENTS:
+                fragments.append("--%s" % k)
+            elif isinstance(v, (list, tuple)) and len(v) > 0:
+                if k in JOINED_ARGUMENTS:
+                    fragments.append("--%s=%s" % (k, ",".join(str(item) for item in v)))
+                else:
+                    for theFile in v:
+                        fragments.append(("--%s=" % k, theFile))
+            elif isinstance(v, dict):
+                for (_k, _v) in v.items():
+                    if isinstance(_v, (list, tuple)):
+                        for item in _v:
+                            fragments.append("--variable=" + _k + ":" + item)
+                    else:
+                        if _v is not False:
+                            fragments.append("--variable=" + _k + ":" + _v)
+            elif (isinstance(v, string_types) and len(v) > 0) or isinstance(v, int):
+                if k == "template":
+                    fragments.append(("--%s=" % k, v))
+                else:
+                    fragments.append("--%s=%s" % (k, v))
+        return tuple(fragments)
+
+    def pandocFrom(self, pandoc_from):
+        return self.markdownFrom if pandoc_from == "markdown" else pandoc_from
+
+
+_resolvedLock = threading.Lock()
+_resolved = {}
+MAX_RESOLVED = 64
+
+
+def resolve(layers):
+    '''
+    Merge `layers` (lowest precedence first), reusing the result of any
+    earlier merge of the same versions of the same layers.
+    '''
+    key = tuple(layer.key for layer in layers)
+    with _resolvedLock:
+        config = _resolved.get(key)
+    if config is not None:
+        return config
+    config = PandownResolvedConfig(layers)
+    with _resolvedLock:
+        if len(_resolved) >= MAX_RESOLVED:
+            _resolved.clear()
+        _resolved[key] = config
+    return config
@@ -0,0 +1,217 @@
+'''
+Pandown's conversions, without Sublime Text. The editor's build commands, the
+project build, and pandownCli.py all construct their Pandoc commands here, so
+a document converts the same way in the editor, in CI, or on a build server:
+
+    import pandownCore
+    settings = pandownCore.loadSettings(["/path/to/User/Pandown.sublime-settings"])
+    result = pandownCore.convert("chapter1.md", to="html5", settings=settings)
+    if result.returncode != 0:
+        print(result.messages)
+'''
+from __future__ import print_function
+import codecs
+import os
+import subprocess
+import time
+try:
+    import Pandown.minify_json as minify_json
+    import Pandown.pandownConfig as pandownConfig
+    import Pandown.pandownIncludeIndex as pandownIncludeIndex
+    from Pandown.pandownCommandBuilder import PACKAGE_DIR, PandownCommandBuilder, STDIN
+    from Pandown.pandownCriticPreprocessor import criticPreprocessor
+    from Pandown.pandownStream import communicate, encodeChunks, fileChunks
+    from Pandown.pandownTimings import PandownTimer
+    from Pandown.pandownToolchain import toolchainFor
+except ImportError:
+    import minify_json
+    import pandownConfig
+    import pandownIncludeIndex
+    from pandownCommandBuilder import PACKAGE_DIR, PandownCommandBuilder, STDIN
+    from pandownCriticPreprocessor import criticPreprocessor
+    from pandownStream import communicate, encodeChunks, fileChunks
+    from pandownTimings import PandownTimer
+    from pandownToolchain import toolchainFor
+
+# Source extensions picked up by a project build, and the reader for each.
+SOURCE_EXTENSIONS = {
+    ".md": "markdown",
+    ".mdown": "markdown",
+    ".markdown": "markdown",
+    ".mkd": "markdown",
+    ".mkdn": "markdown",
+    ".rst": "rst",
+}
+
+# Output extensions for writers whose name isn't one, as in the build systems.
+EXTENSIONS = {
+    "html5": ".html",
+    "native": ".hs",
+    "plain": ".txt",
+    "markdown": ".md",
+    "latex": ".tex",
+    "beamer": ".tex",
+    "context": ".tex",
+    "mediawiki": ".txt",
+    "asciidoc": ".txt",
+    "docbook": ".xml",
+    "opendocument": ".odt",
+    "slidy": ".html",
+    "slideous": ".html",
+    "dzslides": ".html",
+    "s5": ".html",
+    "revealjs": ".html",
+}
+
+# The most text a streamed critic conversion holds back for markup to close.
+CRITIC_LIMIT = 2 ** 22
+
+
+def loadSettings(paths=()):
+    '''
+    The package's Pandown.sublime-settings, overlaid with each of `paths`
+    (e.g. Packages/User/Pandown.sublime-settings) in turn, just as in Sublime.
+    '''
+    settings = {}
+    for path in [os.path.join(PACKAGE_DIR, "Pandown.sublime-settings")] + list(paths):
+        with codecs.open(path, "r", "utf-8") as f:
+            settings.update(minify_json.json_loads(f.read()))
+    return settings
+
+
+def extensionFor(writer):
+    writer = writer.split("+")[0].split("-")[0]
+    return EXTENSIONS.get(writer, "." + writer)
+
+
+def readerFor(source):
+    return SOURCE_EXTENSIONS.get(os.path.splitext(source)[1].lower(), "markdown")
+
+
+def toolchainForSettings(settings):
+    return toolchainFor(settings.get("install_path", None), settings.get("texbin_path", None), settings.get("build_env", None))
+
+
+def environmentFor(settings):
+    return toolchainForSettings(settings).env
+
+
+def streamsInput(settings, size):
+    '''
+    Whether input of `size` bytes (or characters) is to be piped to Pandoc a
+    piece at a time, by the streaming_threshold setting.
+    '''
+    threshold = settings.get("streaming_threshold", 8)
+    return bool(threshold) and size >= threshold * 2 ** 20
+
+
+class PandownResult(object):
+    def __init__(self, cmd, outFile, returncode, output="", messages="", elapsed=0.0):
+        self.cmd = cmd
+        self.outFile = outFile
+        self.returncode = returncode
+        # What Pandoc wrote to stdout, for conversions without an output file.
+        self.output = output
+        self.messages = messages
+        self.elapsed = elapsed
+
+
+class PandownConversion(object):
+    '''
+    Everything needed to convert one document: its Pandoc command, and the
+    text to pipe to Pandoc when it isn't reading `source` itself (unsaved
+    text, or text whose CriticMarkup has been converted).
+
+    `source` is the document's path, or None for text that has never been
+    saved. `to` is a [writer, extension] pair, `arguments` and `defaults`
+    config layers (or, for `arguments`, a pandoc_arguments dict), and
+    `index` the project's PandownIncludeIndex, if there is one. With
+    `toWindow`, Pandoc writes to stdout in its default format. `pandoc` is
+    Pandoc's path, if it's been resolved.
+
+    `chunks`, in place of `text`, is the text in pieces, and with `stream` a
+    criticized `source` is read a piece at a time. Either way the text is
+    then converted and encoded only as Pandoc reads it: `inputData` is an
+    iterator of bytes, good for one build, and `text` is None.
+    '''
+
+    def __init__(self, source, to, pandoc_from, arguments, includes_paths=(), index=None, defaults=None,
+            text=None, critic=False, toWindow=False, timer=None, debug=None, status=None, pandoc=None,
+            chunks=None, stream=False):
+        self.source = source
+        self.workingDIR = os.path.dirname(source) if source else ""
+        self.timer = timer or PandownTimer()
+        if stream and critic and text is None and chunks is None:
+            chunks = fileChunks(source)
+        self.streamed = chunks is not None
+        if self.streamed:
+            if critic:
+                chunks = criticPreprocessor().preprocessChunks(chunks, CRITIC_LIMIT)
+            self.inputData = encodeChunks(chunks)
+        elif critic:
+            with self.timer.phase("critic preprocessing"):
+                if text is None:
+                    text = criticPreprocessor().preprocessCritic(source)
+                else:
+                    text = criticPreprocessor().preprocessText(text)
+        self.text = text
+        self.piped = text is not None or self.streamed
+        self.inFile = STDIN if self.piped else source
+        if not self.streamed:
+            self.inputData = text.encode("utf-8") if self.piped else None
+
+        self.builder = PandownCommandBuilder(self.workingDIR, list(includes_paths), index,
+            defaults=defaults, toWindow=toWindow, origIn=source if self.piped else None,
+            debug=debug, status=status, timer=self.timer, pandoc=pandoc)
+        self.cmd = self.builder.buildPandocCmd(self.inFile, to, pandoc_from, arguments)
+        self.outFile = self.builder.outFile
+        self.dependencies = self.builder.dependencies
+
+    def run(self, env=None):
+        '''
+        Run Pandoc to completion and return a PandownResult.
+        '''
+        start = time.time()
+        if not self.cmd:
+            return PandownResult(self.cmd, self.outFile, -1, messages="Error constructing Pandoc command.")
+        startupinfo = None
+        if os.name == "nt":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        stdin = subprocess.PIPE if self.piped else None
+        try:
+            proc = subprocess.Popen(self.cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                cwd=self.workingDIR or None, env=env, startupinfo=startupinfo)
+            (out, errors) = communicate(proc, self.inputData)
+        except OSError as e:
+            return PandownResult(self.cmd, self.outFile, -1, messages=str(e), elapsed=time.time() - start)
+        self.timer.add("pandoc", time.time() - start)
+        return PandownResult(self.cmd, self.outFile, proc.returncode, out.decode("utf-8", "replace"),
+            errors.decode("utf-8", "replace").strip(), time.time() - start)
+
+
+def convert(source, to="html", ext=None, pandoc_from=None, settings=None, folders=None, text=None,
+        critic=None, toStdout=False, env=None):
+    '''
+    Convert one document with Pandown's settings, the same way the editor
+    would, and return a PandownResult.
+
+    `settings` is a dict from loadSettings() (the package defaults if not
+    given), and `folders` the project folders to find included files and
+    pandoc-config.json files in. `text`, if given, is converted in place of
+    the file's contents. `critic` overrides the preprocess_critic setting.
+    With `toStdout`, nothing is written to disk and the result's output is
+    what Pandoc produced.
+    '''
+    if settings is None:
+        settings = loadSettings()
+    source = os.path.abspath(source)
+    index = pandownIncludeIndex.indexFor([os.path.abspath(folder) for folder in folders]) if folders else None
+    if critic is None:
+        critic = settings.get("preprocess_critic", False)
+    toolchain = toolchainForSettings(settings)
+    stream = critic and text is None and streamsInput(settings, os.path.getsize(source))
+    conversion = PandownConversion(source, [to, ext or extensionFor(to)], pandoc_from or readerFor(source),
+        pandownConfig.argumentsLayer(settings.get("pandoc_arguments", None)), settings.get("includes_paths", []),
+        index, text=text, critic=critic, toWindow=toStdout, pandoc=toolchain.pandoc, stream=stream)
+    return conversion.run(env or toolchain.env)
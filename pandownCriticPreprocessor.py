@@ -5,89 +5,467 @@
 # License: Apache 2
 
 import re
-import tempfile
 import codecs
-import sublime
+
 
 class PandownCriticPreprocessor:
+    add_pattern = re.compile(r'''(?s)\{\+\+(?P<value>.*?)\+\+[ \t]*(\[(?P<meta>.*?)\])?[ \t]*\}''')
+
+    del_pattern = re.compile(r'''(?s)\{\-\-(?P<value>.*?)\-\-[ \t]*(\[(?P<meta>.*?)\])?[ \t]*\}''')
+
+    comm_pattern = re.compile(r'''(?s)\{\>\>(?P<value>.*?)\<\<\}''')
+
+    gen_comm_pattern = re.compile(r'''(?s)\{[ \t]*\[(?P<meta>.*?)\][ \t]*\}''')
+
+    subs_pattern = re.compile(r'''(?s)\{\~\~(?P<original>(?:[^\~\>]|(?:\~(?!\>)))+)\~\>(?P<new>(?:[^\~\~]|(?:\~(?!\~\})))+)\~\~\}''')
+
+    # mark_pattern = r'''(?s)\{\{(?P<value>.*?)\}\}'''
+    mark_pattern = re.compile(r'''(?s)\{==(?P<value>.*?)==\}''')
+
+    # Each kind of markup's opening, and its pattern, in the order that
+    # render() applies them.
+    delimiters = (
+        ("{--", del_pattern, "deletionProcess"),
+        ("{++", add_pattern, "additionProcess"),
+        ("{>>", comm_pattern, "highlightProcess"),
+        ("{==", mark_pattern, "markProcess"),
+        ("{~~", subs_pattern, "subsProcess"),
+    )
+
+    # Any kind of markup's opening.
+    opener_pattern = re.compile(r'''\{(?:\+\+|\-\-|\>\>|==|\~\~)''')
+
+    # The start of an addition's or deletion's [meta], and its end.
+    meta_pattern = re.compile(r'''(\+\+|\-\-)[ \t]*\[''')
+    meta_end_pattern = re.compile(r'''\][ \t]*\}''')
+
+    def deletion(self, value):
+        if value == '\n\n':
+            return "<del>&nbsp;</del>"
+        return '<del>' + value.replace("\n\n", "&nbsp;") + '</del>'
+
     def deletionProcess(self, group_object):
-        replaceString = ''
-        if group_object.group('value') == '\n\n':
-            replaceString = "<del>&nbsp;</del>"
-        else:
-            replaceString = '<del>' + group_object.group('value').replace("\n\n", "&nbsp;") + '</del>'
-        return replaceString
+        return self.deletion(group_object.group('value'))
 
-    def subsProcess(self, group_object):
-        delString = '<del>' + group_object.group('original') + '</del>'
-        insString  = '<ins>' + group_object.group('new') + '</ins>'
+    def substitution(self, original, new):
+        delString = '<del>' + original + '</del>'
+        insString  = '<ins>' + new + '</ins>'
         return delString + insString
 
+    def subsProcess(self, group_object):
+        return self.substitution(group_object.group('original'), group_object.group('new'))
+
     # Converts Addition markup to HTML
-    def additionProcess(self, group_object):
+    def addition(self, value):
         replaceString = ''
 
         # Is there a new paragraph followed by new text
-        if group_object.group('value').startswith('\n\n') and group_object.group('value') != "\n\n":
+        if value.startswith('\n\n') and value != "\n\n":
             replaceString = "\n\n<ins class='critic' break>&nbsp;</ins>\n\n"
-            replaceString = replaceString + '<ins>' + group_object.group('value').replace("\n", " ")
+            replaceString = replaceString + '<ins>' + value.replace("\n", " ")
             replaceString = replaceString +  '</ins>'
 
         # Is the addition just a single new paragraph
-        elif group_object.group('value') == "\n\n":
+        elif value == "\n\n":
             replaceString = "\n\n<ins class='critic break'>&nbsp;" + '</ins>\n\n'
 
         # Is it added text followed by a new paragraph?
-        elif group_object.group('value').endswith('\n\n') and group_object.group('value') != "\n\n":
-            replaceString = '<ins>' + group_object.group('value').replace("\n", " ") + '</ins>'
+        elif value.endswith('\n\n') and value != "\n\n":
+            replaceString = '<ins>' + value.replace("\n", " ") + '</ins>'
             replaceString = replaceString + "\n\n<ins class='critic break'>&nbsp;</ins>\n\n"
 
         else:
-            replaceString = '<ins>' + group_object.group('value').replace("\n", " ") + '</ins>'
+            replaceString = '<ins>' + value.replace("\n", " ") + '</ins>'
 
         return replaceString
 
+    def additionProcess(self, group_object):
+        return self.addition(group_object.group('value'))
+
+    def highlight(self, value):
+        return '<span class="critic comment">' + value.replace("\n", " ") + '</span>'
+
     def highlightProcess(self, group_object):
-        replaceString = '<span class="critic comment">' + group_object.group('value').replace("\n", " ") + '</span>'
-        return replaceString
+        return self.highlight(group_object.group('value'))
+
+    def mark(self, value):
+        return '<mark>' + value + '</mark>'
 
     def markProcess(self, group_object):
-        replaceString = '<mark>' + group_object.group('value') + '</mark>'
-        return replaceString
+        return self.mark(group_object.group('value'))
+
+    def render(self, h):
+        '''
+        Convert all of the CriticMarkup in `h` in a single scan, writing the
+        text between markup and each piece of converted markup to a list
+        that's joined once.
+
+        This is the same as renderPasses(), since converting one kind of
+        markup can't close another (what it writes never ends just before a
+        "}"), so each kind matches where it would have anyway. Except where
+        markup contains the opening of more, which converts differently
+        depending on which kind goes first: from there on, the rest of the
+        document is converted a kind at a time.
+        '''
+        return self.scan(h, True)
+
+    def scan(self, h, passes=False):
+        '''
+        render() as far as the first nested markup, after which the rest is
+        converted by renderPasses(), or with `passes` false, None is
+        returned.
+        '''
+        kinds = {}
+        for (opener, pattern, process) in self.delimiters:
+            end = self.matchEnd(h, opener)
+            if end:
+                kinds[opener] = (pattern, getattr(self, process), end)
+        if not kinds:
+            return h
+        pieces = []
+        last = 0
+        for found in self.opener_pattern.finditer(h):
+            kind = kinds.get(found.group())
+            if not kind:
+                continue
+            (pattern, process, end) = kind
+            match = pattern.match(h, found.start(), end)
+            if not match:
+                continue
+            pieces.append(h[last:found.start()])
+            if self.opener_pattern.search(h, found.end(), match.end()):
+                if not passes:
+                    return None
+                pieces.append(self.renderPasses(h[found.start():]))
+                return "".join(pieces)
+            pieces.append(process(match))
+            last = match.end()
+        pieces.append(h[last:])
+        return "".join(pieces)
+
+    def renderPasses(self, h):
+        '''
+        Convert `h` one re.sub over the document per kind of markup, as the
+        Marked preprocessor does, each stopping where the last markup of its
+        kind could end.
+        '''
+        for (opener, pattern, process) in self.delimiters:
+            h = self.substitute(h, opener, pattern, process)
+        return h
 
     def preprocessCritic(self, inFile):
-        add_pattern = r'''(?s)\{\+\+(?P<value>.*?)\+\+[ \t]*(\[(?P<meta>.*?)\])?[ \t]*\}'''
+        '''
+        The converted contents of `inFile`, to be piped to Pandoc.
+        '''
+        with codecs.open(inFile, "r", "utf-8") as f:
+            h = f.read()
 
-        del_pattern = r'''(?s)\{\-\-(?P<value>.*?)\-\-[ \t]*(\[(?P<meta>.*?)\])?[ \t]*\}'''
+        return self.preprocessText(h)
 
-        comm_pattern = r'''(?s)\{\>\>(?P<value>.*?)\<\<\}'''
+    def preprocessText(self, text):
+        '''
+        The converted text, for a buffer that has no file, or whose file is
+        out of date.
+        '''
+        return self.render(text)
 
-        gen_comm_pattern = r'''(?s)\{[ \t]*\[(?P<meta>.*?)\][ \t]*\}'''
+    def preprocessChunks(self, chunks, limit=None):
+        '''
+        Convert text arriving a piece at a time, yielding converted text as
+        soon as no markup can still be open across it: each piece that's
+        yielded ends at a paragraph break, and together they're exactly
+        preprocessText() of the whole.
 
-        subs_pattern = r'''(?s)\{\~\~(?P<original>(?:[^\~\>]|(?:\~(?!\>)))+)\~\>(?P<new>(?:[^\~\~]|(?:\~(?!\~\})))+)\~\~\}'''
+        With `limit`, no more than about that many characters are held back
+        waiting for markup to close. Past it, most of what's pending is
+        converted as it stands, so markup spanning more text than that may
+        be left unconverted.
+        '''
+        pending = ""
+        wait = 0
+        for chunk in chunks:
+            pending += chunk
+            # Markup left open can hold up everything after it, so look
+            # again only once what's pending has doubled.
+            if len(pending) < wait:
+                continue
+            (cut, converted) = self.convertSettled(pending)
+            if cut:
+                yield converted
+                pending = pending[cut:]
+            if limit and len(pending) > limit:
+                cut = self.forcedCut(pending)
+                yield self.render(pending[:cut])
+                pending = pending[cut:]
+            wait = 2 * len(pending)
+            if limit:
+                wait = min(wait, limit)
+        if pending:
+            yield self.render(pending)
 
-        # mark_pattern = r'''(?s)\{\{(?P<value>.*?)\}\}'''
-        mark_pattern = r'''(?s)\{==(?P<value>.*?)==\}'''
+    def forcedCut(self, text):
+        '''
+        Where to split `text` when markup is open across too much of it: at
+        the last paragraph break, or failing that line break, in its second
+        half.
+        '''
+        half = len(text) // 2
+        end = text.rfind("\n\n", half)
+        if end != -1:
+            return end + 2
+        end = text.rfind("\n", half)
+        return end + 1 if end != -1 else len(text)
 
-        with codecs.open(inFile, "r", "utf-8") as f:
-            h = f.read()
+    def convertSettled(self, text):
+        '''
+        Convert as much of `text` as converts the same whatever follows it:
+        up to the last paragraph break that no markup spans, or could span
+        once more text arrives. Returns the length converted and the result.
+        '''
+        limit = len(text)
+        while True:
+            end = text.rfind("\n\n", 0, limit)
+            if end == -1:
+                return (0, "")
+            cut = end + 2
+            converted = self.convertBefore(text[:cut], text[cut:])
+            if converted is not None:
+                return (cut, converted)
+            # Step back past the first markup that's open across the break
+            # in the original text, or if there's none, to the paragraph
+            # before.
+            starts = [self.openAt(text, cut, opener, pattern) for (opener, pattern, process) in self.delimiters]
+            limit = min([start for start in starts if start != -1] or [end])
 
-        if int(sublime.version()) < 3000:
-            h = re.sub(del_pattern, self.deletionProcess, h)
-            h = re.sub(add_pattern, self.additionProcess, h)
-            h = re.sub(comm_pattern, self.highlightProcess, h)
-            h = re.sub(mark_pattern, self.markProcess, h)
-            h = re.sub(subs_pattern, self.subsProcess, h)
-        else:
-            h = re.sub(del_pattern, self.deletionProcess, h, flags=re.DOTALL)
-            h = re.sub(add_pattern, self.additionProcess, h, flags=re.DOTALL)
-            h = re.sub(comm_pattern, self.highlightProcess, h, flags=re.DOTALL)
-            h = re.sub(mark_pattern, self.markProcess, h, flags=re.DOTALL)
-            h = re.sub(subs_pattern, self.subsProcess, h, flags=re.DOTALL)
-
-        workingTemp = tempfile.NamedTemporaryFile("w", delete=False)
-        workingTemp.close()
-        with codecs.open(workingTemp.name, "w", "utf-8") as f:
-            f.write(h)
-
-        return workingTemp.name
+    def convertBefore(self, before, after):
+        '''
+        render() of `before`, or None if any of its passes would
+        convert markup that spans the end of `before`, or might once more
+        text arrives.
+        '''
+        for (opener, pattern, process) in self.delimiters:
+            if self.openAt(before + after, len(before), opener, pattern) != -1:
+                return None
+            before = self.substitute(before, opener, pattern, process)
+            after = self.substitute(after, opener, pattern, process)
+        return before
+
+    def substitute(self, text, opener, pattern, process):
+        end = self.matchEnd(text, opener)
+        if end == 0:
+            return text
+        if text.find(opener, end) == -1:
+            # Nothing past the bound to skip, so save copying the text.
+            return pattern.sub(getattr(self, process), text)
+        return pattern.sub(getattr(self, process), text[:end]) + text[end:]
+
+    def matchEnd(self, text, opener):
+        '''
+        How far into `text` markup of `opener`'s kind could reach, since it
+        ends with its closer. Searching no further keeps openers that are
+        never closed from each sending the search to the end of the text:
+        but for substitutions, the patterns match anything up to their
+        closer, so an opener before the last closer always matches, and one
+        after it never can.
+        '''
+        if opener in ("{++", "{--"):
+            # The last "}" after the closer or a [meta], and any blanks.
+            end = len(text)
+            while True:
+                end = text.rfind("}", 0, end)
+                if end == -1:
+                    return 0
+                before = end
+                while before and text[before - 1] in " \t":
+                    before -= 1
+                if (before >= 1 and text[before - 1] == "]") or (before >= 2 and text[before - 2:before] == opener[1:]):
+                    break
+            end += 1
+            return end if text.find(opener, 0, end) != -1 else 0
+        closer = {"{>>": "<<}", "{==": "==}", "{~~": "~~}"}[opener]
+        end = text.rfind(closer)
+        return end + 3 if end != -1 and text.find(opener, 0, end) != -1 else 0
+
+    def openAt(self, text, cut, opener, pattern):
+        '''
+        The position of the first of one kind of markup that starts before
+        `cut` but might not end before it, or -1.
+        '''
+        # Where a [meta] could start that might end in text that's yet to
+        # arrive.
+        metaFrom = None
+        if opener in ("{++", "{--"):
+            metaFrom = self.lastMetaEnd(text) + 1
+        pos = 0
+        for match in pattern.finditer(text, 0, self.matchEnd(text, opener)):
+            if match.start() >= cut:
+                break
+            # Markup other than a substitution that hasn't been closed is
+            # never followed by any that has.
+            if opener == "{~~":
+                stray = self.strayOpener(text, pos, match.start(), opener)
+                if stray != -1:
+                    return stray
+            if match.end() > cut:
+                return match.start()
+            if metaFrom is not None and self.meta_pattern.search(text, max(metaFrom, match.start()), match.end()):
+                return match.start()
+            pos = match.end()
+        return self.strayOpener(text, pos, cut, opener)
+
+    def strayOpener(self, text, start, end, opener):
+        '''
+        The position of markup between `start` and `end` that hasn't been
+        closed, but might be, or -1.
+        '''
+        while True:
+            start = text.find(opener, start, end)
+            if start == -1 or opener != "{~~":
+                return start
+            # A substitution's original text can't contain ">", so one that
+            # reaches a ">" that isn't its "~>" never will be.
+            arrow = text.find(">", start + 3)
+            if arrow == -1 or text[arrow - 1] == "~":
+                return start
+            start += 1
+
+    def lastMetaEnd(self, text):
+        end = len(text)
+        while True:
+            end = text.rfind("]", 0, end)
+            if end == -1 or self.meta_end_pattern.match(text, end):
+                return end
+
+_preprocessor = PandownCriticPreprocessor()
+
+
+def criticPreprocessor():
+    '''
+    The preprocessor shared by every build, which is safe because it keeps
+    nothing between documents.
+    '''
+    return _preprocessor
+
+
+if __name__ == '__main__':
+    # Check the scan, and the bounded passes it falls back on, against the
+    # Marked preprocessor's unbounded passes, and time them on a large
+    # manuscript.
+    import random
+    import time
+
+    preprocessor = PandownCriticPreprocessor()
+
+    def unbounded(h):
+        for (opener, pattern, process) in preprocessor.delimiters:
+            h = pattern.sub(getattr(preprocessor, process), h)
+        return h
+
+    corpus = [
+        "",
+        "No markup at all.",
+        "{++added++} {--deleted--} {>>comment<<} {==marked==} {~~old~>new~~}",
+        "{++\n\n++}{++\n\nnew paragraph++}{++trailing\n\n++}{--\n\n--}{--a\n\nb--}",
+        "{++added++ [@editor] } and {--deleted-- [note]}",
+        "{==marked==}{>>with a\ncomment<<}",
+        "{++ outer {--inner--} text ++}",
+        "{-- outer {++inner++} text --}",
+        "{== a {>> b <<} c {++ d ++} ==}",
+        "{>> a {== b ==} c <<}",
+        "{~~ a {++ b ++} ~> c ~~}",
+        "{~~ a ~> b {++ c ++} ~~}",
+        "{++ a {-- b ++} c --}",
+        "{-- a {++ b --} c ++}",
+        "{== a {-- b ==} --}",
+        "{++ unterminated addition",
+        "{-- unterminated {++ nested ++} deletion",
+        "{~~ no arrow ~~}",
+        "{~~a~>b~~}{~~~>c~~}{~~d~>~~}",
+        "{++x++[{--y--}]}",
+        "{++ a ++}++}",
+        "{{++double brace++}}",
+        "{== {== nested marks ==} ==}",
+        "C++ and -- dashes -- everywhere, {++ but one addition ++}.",
+    ]
+    tokens = ["{++", "{--", "{>>", "{==", "{~~", "++}", "--}", "<<}", "==}", "~>", "~~}",
+        "++ [m] }", "-- [m]}", "[", "]", "{", "}", ">", "~", "++", "--", "\n\n", "\n", " ", "a", "b"]
+    rng = random.Random(0)
+    for i in range(20000):
+        corpus.append("".join(rng.choice(tokens) for j in range(rng.randint(1, 24))))
+
+    scanned = 0
+    for doc in corpus:
+        assert preprocessor.render(doc) == unbounded(doc), repr(doc)
+        assert preprocessor.renderPasses(doc) == unbounded(doc), repr(doc)
+        scanned += preprocessor.scan(doc) is not None
+    print("corpus: %d documents match, %d of them converted in one scan" % (len(corpus), scanned))
+
+    # Converting a piece at a time must give the same text, wherever the
+    # pieces are split.
+    streamed = 0
+    for i in range(3000):
+        doc = "\n\n".join(rng.choice(corpus) for j in range(rng.randint(1, 8)))
+        cuts = sorted(rng.randint(0, len(doc)) for j in range(rng.randint(0, 6)))
+        chunks = [doc[a:b] for (a, b) in zip([0] + cuts, cuts + [len(doc)])]
+        pieces = list(preprocessor.preprocessChunks(chunks))
+        assert "".join(pieces) == preprocessor.preprocessText(doc), repr(chunks)
+        streamed += len(pieces)
+    print("chunks: 3000 documents match, converted in %d pieces" % streamed)
+
+    # With a limit, markup that closes within it converts the same, and
+    # markup left open doesn't hold back the rest of the document.
+    doc = "\n\n".join([corpus[2]] * 200)
+    chunks = [doc[i:i + 100] for i in range(0, len(doc), 100)]
+    assert "".join(preprocessor.preprocessChunks(chunks, 1000)) == preprocessor.preprocessText(doc)
+    doc = "{++ never closed\n\n" + "\n\n".join(["plain text"] * 5000)
+    read = [0]
+
+    def reading():
+        for i in range(0, len(doc), 100):
+            read[0] = i + 100
+            yield doc[i:i + 100]
+    yielded = 0
+    for piece in preprocessor.preprocessChunks(reading(), 1000):
+        yielded += len(piece)
+        assert read[0] - yielded <= 1100, "held back %d characters" % (read[0] - yielded)
+    assert yielded == len(doc)
+    print("limit: open markup converted within 1000 characters")
+
+    paragraphs = [
+        "Lorem ipsum dolor sit amet, {++consectetur++} adipiscing elit. Sed do "
+        "eiusmod tempor {--incididunt--} ut labore et dolore magna aliqua.",
+        "Ut enim ad {~~minim~>maximal~~} veniam, quis nostrud {==exercitation==}"
+        "{>>check this<<} ullamco laboris nisi ut aliquip ex ea commodo.",
+        "Duis aute irure dolor in reprehenderit in voluptate velit esse cillum "
+        "dolore eu fugiat nulla pariatur -- excepteur sint occaecat.",
+        "{++\n\nA whole new paragraph, with a deletion after it.++}{--\n\n--}",
+        "Sunt in culpa qui officia {++deserunt [@ed]++} mollit anim id est laborum.",
+    ]
+    # Mostly prose, as a manuscript under review usually is.
+    paragraphs += [paragraphs[2]] * 10
+    manuscript = []
+    size = 0
+    while size < 4 * 1024 * 1024:
+        paragraph = rng.choice(paragraphs)
+        manuscript.append(paragraph)
+        size += len(paragraph) + 2
+    manuscript = "\n\n".join(manuscript)
+    # The same, with a closing section full of comments that were started
+    # but never finished.
+    careless = manuscript + "\n\n" + "\n\n".join(rng.choice(paragraphs).replace("<<}", "") + " {>>todo"
+        for i in range(2000))
+    # And with nested markup at the very end, which is found only once the
+    # scan has done all the rest.
+    nested = manuscript + "\n\n{++A new paragraph, with {--a deletion--} inside it.++}"
+
+    for (name, doc) in (("manuscript", manuscript), ("manuscript with unterminated comments", careless),
+            ("manuscript with nested markup", nested)):
+        start = time.time()
+        expected = unbounded(doc)
+        before = time.time() - start
+        start = time.time()
+        result = preprocessor.render(doc)
+        after = time.time() - start
+        assert result == expected
+        print("%.1f MB %s: unbounded passes %.2fs, render %.2fs (%s)" % (len(doc) / 1048576.0, name, before, after,
+            "one scan" if preprocessor.scan(doc) is not None else "a scan, then bounded passes"))
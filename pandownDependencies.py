@@ -0,0 +1,166 @@
+import codecs
+import json
+import os
+import threading
+
+# Pandoc options whose value is a file the output depends on.
+FILE_ARGUMENTS = set([
+    "bibliography", "csl", "citation-abbreviations", "template", "css", "include-in-header",
+    "include-before-body", "include-after-body", "reference-doc", "reference-docx", "reference-odt",
+    "epub-stylesheet", "epub-cover-image", "epub-metadata", "lua-filter", "filter",
+    "syntax-definition", "abbreviations",
+])
+
+# Variables and metadata fields that name files, as in --metadata=bibliography:refs.bib.
+FILE_VARIABLES = set(["bibliography", "csl", "citation-abbreviations"])
+
+
+def fileArguments(cmd, workingDIR):
+    '''
+    The existing files named by the options in `cmd`, including those given
+    as plain strings in pandoc_arguments, which walkIncludes never sees.
+    '''
+    found = []
+    for arg in cmd[1:]:
+        if not arg.startswith("--") or "=" not in arg:
+            continue
+        (key, value) = arg[2:].split("=", 1)
+        if key in ("variable", "metadata"):
+            if ":" not in value:
+                continue
+            (key, value) = value.split(":", 1)
+            if key not in FILE_VARIABLES:
+                continue
+        elif key not in FILE_ARGUMENTS:
+            continue
+        path = os.path.abspath(os.path.join(workingDIR, os.path.expanduser(value)))
+        if os.path.isfile(path):
+            found.append(path)
+    return found
+
+
+class PandownDependencyGraph(object):
+    '''
+    What each output file was built from: its source, and every include,
+    template, stylesheet, bibliography and config file the build read, with
+    the time the build started. An output is stale once any of those has
+    changed since.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.outputs = None
+
+    def load(self):
+        # Called with the lock held.
+        if self.outputs is not None:
+            return
+        self.outputs = {}
+        try:
+            with codecs.open(self.path, "r", "utf-8") as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get("version") == 1:
+            self.outputs = data.get("outputs", {})
+
+    def record(self, outFile, source, inputs, to, pandoc_from, built):
+        entry = {
+            "source": source,
+            "inputs": sorted(set(inputs) - set([source])),
+            "to": list(to),
+            "from": pandoc_from or "",
+            "built": built,
+        }
+        with self.lock:
+            self.load()
+            self.outputs[os.path.abspath(outFile)] = entry
+
+    def forget(self, outFile):
+        with self.lock:
+            self.load()
+            self.outputs.pop(os.path.abspath(outFile), None)
+
+    def paths(self):
+        '''
+        Every source and input of a recorded output.
+        '''
+        with self.lock:
+            self.load()
+            paths = set()
+            for entry in self.outputs.values():
+                paths.add(entry["source"])
+                paths.update(entry["inputs"])
+            return paths
+
+    def staleness(self, outFile, entry):
+        '''
+        Why `outFile` needs rebuilding, or None if it's up to date.
+        '''
+        if not os.path.isfile(outFile):
+            return "output missing"
+        for path in [entry["source"]] + entry["inputs"]:
+            try:
+                if os.path.getmtime(path) > entry["built"]:
+                    return "%s changed" % os.path.basename(path)
+            except OSError:
+                return "%s missing" % os.path.basename(path)
+        return None
+
+    def stale(self, folders=None):
+        '''
+        (outFile, entry, reason) for each stale output whose source is in one
+        of `folders` (any, if not given). Outputs whose source has gone are
+        forgotten.
+        '''
+        with self.lock:
+            self.load()
+            outputs = list(self.outputs.items())
+        if folders:
+            roots = [os.path.join(os.path.abspath(folder), "") for folder in folders]
+            outputs = [(outFile, entry) for (outFile, entry) in outputs
+                if any(entry["source"].startswith(root) for root in roots)]
+        stale = []
+        for (outFile, entry) in sorted(outputs):
+            if not os.path.isfile(entry["source"]):
+                self.forget(outFile)
+                continue
+            reason = self.staleness(outFile, entry)
+            if reason:
+                stale.append((outFile, entry, reason))
+        return stale
+
+    def save(self):
+        with self.lock:
+            if self.outputs is None:
+                return
+            data = json.dumps({"version": 1, "outputs": self.outputs}, indent=1, sort_keys=True)
+            try:
+                if not os.path.isdir(os.path.dirname(self.path)):
+                    os.makedirs(os.path.dirname(self.path))
+                # Write a whole new file, so that a crash can't leave half of one.
+                temp = "%s.%d.tmp" % (self.path, os.getpid())
+                with codecs.open(temp, "w", "utf-8") as f:
+                    f.write(data)
+                if os.name == "nt" and os.path.exists(self.path):
+                    os.remove(self.path)
+                os.rename(temp, self.path)
+            except (IOError, OSError) as e:
+                print("[Pandown: couldn't save the dependency graph: %s]" % e)
+
+
+_graphs = {}
+_graphsLock = threading.Lock()
+
+
+def graphFor(path):
+    '''
+    The shared graph stored at `path`.
+    '''
+    with _graphsLock:
+        graph = _graphs.get(path)
+        if graph is None:
+            graph = PandownDependencyGraph(path)
+            _graphs[path] = graph
+        return graph
@@ -0,0 +1,216 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+try:
+    from Pandown.pandownJobs import processGroupOptions, terminateGroup
+except ImportError:
+    from pandownJobs import processGroupOptions, terminateGroup
+
+# This module is loaded by Sublime Text 2 and 3 too, whose Pythons have no
+# asyncio, so it sticks to asyncio's callback interface rather than
+# coroutine syntax they can't parse.
+
+_loop = [None]
+_lock = threading.Lock()
+
+
+def available():
+    '''
+    Whether builds can run on the event loop. Before Python 3.8, asyncio
+    could only wait for child processes from a loop on the main thread.
+    '''
+    return asyncio is not None and sys.version_info >= (3, 8)
+
+
+def eventLoop():
+    '''
+    The event loop every build's pipes are read on, running on a thread of
+    its own, which is started the first time it's needed.
+    '''
+    with _lock:
+        if _loop[0] is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="Pandown event loop")
+            thread.daemon = True
+            thread.start()
+            _loop[0] = loop
+        return _loop[0]
+
+
+def stopEventLoop():
+    with _lock:
+        loop = _loop[0]
+        _loop[0] = None
+    if loop is not None:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+class PandownEventLoopProtocol(asyncio.SubprocessProtocol if asyncio else object):
+    def __init__(self, owner):
+        self.owner = owner
+
+    def connection_made(self, transport):
+        # Called on the loop's thread before any other callback, which may
+        # come before run_coroutine_threadsafe() returns to the caller.
+        self.owner.transport = transport
+        self.owner.pid = transport.get_pid()
+
+    def pipe_data_received(self, fd, data):
+        self.owner.received(fd, data)
+
+    def connection_lost(self, exc):
+        # Only called once the process has exited and all of its pipes are
+        # closed.
+        self.owner.finished()
+
+
+class PandownEventLoopProcess(object):
+    '''
+    Runs a command with the same interface as PandownAsyncProcess, but with
+    its pipes read on the shared event loop rather than by threads of its
+    own. The listener is called from the loop's thread; if its backlogged()
+    is true, reading pauses until it isn't. on_finished is called exactly
+    once, after the process has exited and all its output has been passed
+    on. `timeout`, if given, is the number of seconds after which the
+    process is stopped and reported as failed.
+    '''
+
+    def __init__(self, command, env, listener, input_data=None, timeout=None, shell=False):
+        self.listener = listener
+        self.killed = False
+        self.start_time = time.time()
+        self.returncode = None
+        self.open_streams = 2
+        self.timer = None
+        self.transport = None
+        self.pid = None
+        self.loop = eventLoop()
+
+        options = processGroupOptions()
+        if os.name == "nt":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            options["startupinfo"] = startupinfo
+        stdin = subprocess.PIPE if input_data is not None else subprocess.DEVNULL
+        factory = lambda: PandownEventLoopProtocol(self)
+        if shell:
+            create = self.loop.subprocess_shell(factory, subprocess.list2cmdline(command),
+                stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, **options)
+        else:
+            create = self.loop.subprocess_exec(factory, *command,
+                stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, **options)
+        # Wait for the process to start, so that a missing Pandoc raises
+        # here just as it would from Popen. The protocol has already handed
+        # over its transport.
+        asyncio.run_coroutine_threadsafe(create, self.loop).result()
+        self.loop.call_soon_threadsafe(self.started, input_data, timeout)
+
+    def started(self, input_data, timeout):
+        if input_data is not None:
+            pipe = self.transport.get_pipe_transport(0)
+            if pipe:
+                pipe.write(input_data)
+                pipe.write_eof()
+        if timeout and self.returncode is None:
+            self.timer = self.loop.call_later(timeout, self.time_out, timeout)
+
+    def time_out(self, timeout):
+        if self.returncode is not None or self.killed:
+            return
+        if self.listener:
+            self.listener.on_data_err(self, ("[Timed out after %ss]\n" % timeout).encode("utf-8"))
+        terminateGroup(self.pid)
+
+    def kill(self):
+        if not self.killed:
+            self.killed = True
+            self.listener = None
+            if self.returncode is None:
+                terminateGroup(self.pid)
+
+    def poll(self):
+        return self.returncode is None
+
+    def exit_code(self):
+        return self.returncode
+
+    def received(self, fd, data):
+        listener = self.listener
+        if not listener:
+            return
+        if fd == 1:
+            listener.on_data_out(self, data)
+        else:
+            listener.on_data_err(self, data)
+        if listener.backlogged():
+            pipe = self.transport.get_pipe_transport(fd)
+            pipe.pause_reading()
+            self.loop.call_later(0.01, self.resume, pipe)
+
+    def resume(self, pipe):
+        if self.listener and self.listener.backlogged():
+            self.loop.call_later(0.01, self.resume, pipe)
+        else:
+            pipe.resume_reading()
+
+    def finished(self):
+        if self.timer:
+            self.timer.cancel()
+        self.returncode = self.transport.get_returncode()
+        self.open_streams = 0
+        self.transport.close()
+        if self.listener:
+            self.listener.on_finished(self)
+
+
+if __name__ == "__main__":
+    # Run a batch of builds on the loop and on threads, checking that each
+    # reports its output and finishes exactly once, and compare how many
+    # threads each approach needs.
+    class Listener(object):
+        def __init__(self):
+            self.out = []
+            self.finishes = 0
+            self.done = threading.Event()
+
+        def on_data_out(self, proc, data):
+            self.out.append(data)
+
+        def on_data_err(self, proc, data):
+            self.out.append(data)
+
+        def backlogged(self):
+            return False
+
+        def on_finished(self, proc):
+            self.finishes += 1
+            self.done.set()
+
+    if not available():
+        print("asyncio subprocesses need Python 3.8")
+        sys.exit(0)
+    script = "import sys; sys.stdout.write(sys.stdin.read().upper()); sys.stderr.write('done')"
+    listeners = [Listener() for i in range(20)]
+    start = time.time()
+    procs = [PandownEventLoopProcess([sys.executable, "-c", script], dict(os.environ), listener, b"x" * 100000)
+        for listener in listeners]
+    peak = threading.active_count()
+    for listener in listeners:
+        listener.done.wait(10)
+    time.sleep(0.1)
+    assert all(listener.finishes == 1 for listener in listeners)
+    assert all(b"".join(listener.out) in (b"X" * 100000 + b"done", b"done" + b"X" * 100000) for listener in listeners)
+    assert all(proc.exit_code() == 0 for proc in procs)
+    print("20 builds on the event loop: %.2fs, %d threads" % (time.time() - start, peak))
+
+    listener = Listener()
+    proc = PandownEventLoopProcess([sys.executable, "-c", "import time; time.sleep(10)"], dict(os.environ), listener, timeout=0.5)
+    listener.done.wait(5)
+    assert listener.finishes == 1 and proc.exit_code() != 0 and b"Timed out" in b"".join(listener.out)
+    print("Timed out after %.1fs with exit code %s" % (time.time() - proc.start_time, proc.exit_code()))
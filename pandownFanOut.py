@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+try:
+    from Pandown.pandownBatch import PandownBatchJob, PandownBatchRunner
+    from Pandown.pandownCommandBuilder import STDIN, argumentName
+    from Pandown.pandownDependencies import fileArguments
+except ImportError:
+    from pandownBatch import PandownBatchJob, PandownBatchRunner
+    from pandownCommandBuilder import STDIN, argumentName
+    from pandownDependencies import fileArguments
+
+# Arguments that affect how the source is read rather than how it's written.
+# They're passed when parsing to JSON and dropped when writing from it.
+# Anything else is a writer argument, including filters and citation
+# processing: Pandoc applies those after reading, so running them on each
+# writer's JSON input sees the target FORMAT and keeps their order, just as in
+# a single-target build.
+READER_ARGUMENTS = (
+    "from", "indented-code-classes", "default-image-extension", "tab-stop",
+    "base-header-level", "old-dashes", "smart", "normalize", "parse-raw",
+    "preserve-tabs", "abbreviations", "metadata",
+)
+# Arguments that both steps need.
+SHARED_ARGUMENTS = ("data-dir",)
+
+
+def splitCommand(cmd):
+    '''
+    Split a single-target Pandoc command into its reader arguments, writer
+    arguments, and input file.
+    '''
+    reader = []
+    writer = []
+    inFile = cmd[-1]
+    for arg in cmd[1:-1]:
+        name = argumentName(arg)
+        if name in SHARED_ARGUMENTS:
+            reader.append(arg)
+            writer.append(arg)
+        elif name in READER_ARGUMENTS:
+            reader.append(arg)
+        elif name != "to":
+            writer.append(arg)
+    return (reader, writer, inFile)
+
+
+def parseCommand(cmd, astFile):
+    (reader, writer, inFile) = splitCommand(cmd)
+    return cmd[:1] + reader + ["--to=json", "--output=" + astFile, inFile]
+
+
+def writerCommand(cmd, astFile):
+    '''
+    The command that writes `cmd`'s target from an already-parsed AST.
+    '''
+    (reader, writer, inFile) = splitCommand(cmd)
+    to = [arg for arg in cmd if argumentName(arg) == "to"]
+    return cmd[:1] + ["--from=json"] + to + writer + [astFile]
+
+
+class PandownFanOut(object):
+    '''
+    Produces several output formats from one parse: the source is read once
+    into Pandoc's JSON AST, which is cached, and each writer then runs from
+    the AST concurrently.
+
+    `commands` are the single-target commands from buildPandocCmd, one per
+    format, and `cache` a PandownBuildCache in which to keep the AST, keyed
+    on the source's bytes, the reader arguments, the files they name, and
+    `dependencies`. Without a cache, the AST is parsed into a temporary
+    folder, which is removed once the writers are done.
+    '''
+
+    def __init__(self, source, commands, outFiles, cache, inputData, dependencies=(), env=None, onResult=None):
+        self.source = source
+        self.commands = commands
+        self.outFiles = outFiles
+        self.cache = cache
+        self.env = env
+        self.inputData = inputData
+        self.dependencies = dependencies
+        self.onResult = onResult
+        self.parseJob = None
+        self.runner = None
+        self.astCached = False
+        self.cancelled = False
+        # Where the AST was parsed to, when it isn't kept in the cache.
+        self.tempDir = None
+
+    def ensureAst(self):
+        '''
+        Return the path of the parsed AST, running the reader only if an
+        identical parse isn't already in the cache.
+        '''
+        key = None
+        if self.cache:
+            parse = parseCommand(self.commands[0], "")
+            workingDIR = os.path.dirname(self.source) if self.source else ""
+            key = self.cache.key(parse[:-1], self.inputData, list(self.dependencies) + fileArguments(parse, workingDIR))
+            cached = self.cache.lookup(key)
+            if cached:
+                self.astCached = True
+                return cached
+
+        self.tempDir = tempfile.mkdtemp(prefix="pandown-ast-")
+        astFile = os.path.join(self.tempDir, "ast.json")
+        cmd = parseCommand(self.commands[0], astFile)
+        self.parseJob = PandownBatchJob(self.source, cmd, astFile,
+            inputData=self.inputData if cmd[-1] == STDIN else None)
+        PandownBatchRunner([self.parseJob], self.env, 1).runJob(self.parseJob)
+        if self.onResult:
+            self.onResult(self.parseJob)
+        if self.parseJob.returncode != 0:
+            return None
+        if key and self.cache.store(key, fromFile=astFile):
+            self.cleanUp()
+            return self.cache.pathFor(key)
+        return astFile
+
+    def cancel(self):
+        '''
+        Stop before the writers start, or before any more of them do.
+        '''
+        self.cancelled = True
+        if self.runner:
+            self.runner.cancel()
+
+    def cleanUp(self):
+        if self.tempDir:
+            shutil.rmtree(self.tempDir, ignore_errors=True)
+            self.tempDir = None
+
+    def run(self):
+        try:
+            astFile = self.ensureAst()
+            if not astFile or self.cancelled:
+                return []
+            jobs = [PandownBatchJob(self.source, writerCommand(cmd, astFile), outFile)
+                    for (cmd, outFile) in zip(self.commands, self.outFiles)]
+            self.runner = PandownBatchRunner(jobs, self.env, len(jobs), onResult=self.onResult)
+            self.runner.run()
+            return jobs
+        finally:
+            self.cleanUp()
@@ -0,0 +1,260 @@
+import os
+import threading
+
+
+class PandownIncludeIndex(object):
+    '''
+    An index of every file under a set of project folders, keyed by directory
+    and by basename, so that include and config lookups don't have to walk
+    the tree. The index is built once and kept current by re-listing only
+    those directories whose mtime has changed since they were last seen.
+    '''
+
+    def __init__(self, folders):
+        self.folders = tuple(os.path.abspath(f) for f in folders)
+        self.lock = threading.RLock()
+        self.dirMtimes = {}
+        self.byDir = {}
+        self.subDirs = {}
+        self.byName = {}
+        self.generation = 0
+        self.built = False
+
+    def build(self):
+        with self.lock:
+            self.dirMtimes = {}
+            self.byDir = {}
+            self.subDirs = {}
+            self.byName = {}
+            for folder in self.folders:
+                self.scanTree(folder)
+            self.built = True
+            self.generation += 1
+
+    def refresh(self):
+        '''
+        Bring the index up to date. Only directories whose mtime has changed
+        (i.e. that have had entries added, removed, or renamed) are re-listed.
+        '''
+        with self.lock:
+            if not self.built:
+                self.build()
+                return
+            changed = False
+            for dirPath in list(self.dirMtimes.keys()):
+                if dirPath not in self.dirMtimes:
+                    # Dropped while rescanning a parent.
+                    continue
+                try:
+                    mtime = os.stat(dirPath).st_mtime
+                except OSError:
+                    self.dropTree(dirPath)
+                    changed = True
+                    continue
+                if mtime != self.dirMtimes[dirPath]:
+                    for newDir in self.scanDir(dirPath, mtime):
+                        self.scanTree(newDir)
+                    changed = True
+            if changed:
+                self.generation += 1
+
+    def noteFile(self, path):
+        '''
+        Record a single file, e.g. one that was just saved from the editor.
+        Cheaper than waiting for the next refresh to notice its directory.
+        '''
+        path = os.path.abspath(path)
+        dirPath, name = os.path.split(path)
+        with self.lock:
+            if dirPath not in self.byDir or name in self.byDir[dirPath]:
+                return
+            self.byDir[dirPath].add(name)
+            self.byName.setdefault(name, set()).add(dirPath)
+            self.generation += 1
+
+    def forgetFile(self, path):
+        '''
+        Drop a file, or a whole directory, that has been deleted.
+        '''
+        path = os.path.abspath(path)
+        dirPath, name = os.path.split(path)
+        with self.lock:
+            if path in self.byDir:
+                self.dropTree(path)
+            elif name in self.byDir.get(dirPath, ()):
+                self.byDir[dirPath].discard(name)
+                self.forgetName(name, dirPath)
+            else:
+                return
+            self.generation += 1
+
+    def scanTree(self, top):
+        pending = [top]
+        while pending:
+            dirPath = pending.pop()
+            try:
+                mtime = os.stat(dirPath).st_mtime
+            except OSError:
+                continue
+            pending.extend(self.scanDir(dirPath, mtime))
+
+    def scanDir(self, dirPath, mtime):
+        '''
+        (Re)list a single directory. Returns any subdirectories that are new to
+        the index; the caller is responsible for scanning them.
+        '''
+        try:
+            entries = os.listdir(dirPath)
+        except OSError:
+            self.dropTree(dirPath)
+            return []
+
+        files = set()
+        subdirs = set()
+        for name in entries:
+            fullPath = os.path.join(dirPath, name)
+            if os.path.isdir(fullPath):
+                if not os.path.islink(fullPath):
+                    subdirs.add(fullPath)
+            else:
+                files.add(name)
+
+        oldFiles = self.byDir.get(dirPath, set())
+        for name in oldFiles - files:
+            self.forgetName(name, dirPath)
+        for name in files - oldFiles:
+            self.byName.setdefault(name, set()).add(dirPath)
+
+        for gone in self.subDirs.get(dirPath, set()) - subdirs:
+            self.dropTree(gone)
+
+        self.byDir[dirPath] = files
+        self.subDirs[dirPath] = subdirs
+        self.dirMtimes[dirPath] = mtime
+        return [d for d in subdirs if d not in self.dirMtimes]
+
+    def forgetName(self, name, dirPath):
+        dirs = self.byName.get(name)
+        if dirs:
+            dirs.discard(dirPath)
+            if not dirs:
+                del self.byName[name]
+
+    def dropTree(self, top):
+        pending = [top]
+        while pending:
+            dirPath = pending.pop()
+            for name in self.byDir.pop(dirPath, ()):
+                self.forgetName(name, dirPath)
+            pending.extend(self.subDirs.pop(dirPath, ()))
+            self.dirMtimes.pop(dirPath, None)
+        parent = self.subDirs.get(os.path.dirname(top))
+        if parent:
+            parent.discard(top)
+
+    def exists(self, dirPath, lookFor):
+        '''
+        Is `lookFor` (a filename, or a relative path) present in `dirPath`?
+        '''
+        candidate = os.path.normpath(os.path.join(dirPath, lookFor))
+        head, name = os.path.split(candidate)
+        with self.lock:
+            if name in self.byDir.get(head, ()):
+                return True
+            # Directories are indexed by path rather than by name.
+            return candidate in self.byDir
+
+    def files(self):
+        '''
+        A snapshot of every indexed directory and the names of the files in
+        it, safe to go through while the index changes.
+        '''
+        with self.lock:
+            return dict((dirPath, set(names)) for (dirPath, names) in self.byDir.items())
+
+    def dirsContaining(self, name):
+        with self.lock:
+            return set(self.byName.get(name, ()))
+
+    def projectFolderFor(self, path):
+        '''
+        The deepest project folder containing `path`, or None.
+        '''
+        path = os.path.abspath(path)
+        best = None
+        for folder in self.folders:
+            prefix = folder.rstrip(os.sep) + os.sep
+            if path == folder or path.startswith(prefix):
+                if best is None or len(folder) > len(best):
+                    best = folder
+        return best
+
+    def ancestorsOf(self, workingDIR):
+        '''
+        The directories to search for an include, from the working directory up
+        to (and including) the project folder that contains it.
+        '''
+        topLevel = self.projectFolderFor(workingDIR)
+        if not topLevel:
+            return []
+        dirs = []
+        checkDIR = os.path.abspath(workingDIR)
+        while True:
+            dirs.append(checkDIR)
+            if checkDIR == topLevel:
+                break
+            parent = os.path.dirname(checkDIR)
+            if parent == checkDIR:
+                break
+            checkDIR = parent
+        return dirs
+
+    def find(self, lookFor, workingDIR):
+        '''
+        Search the working directory and then each of its ancestors within the
+        project for `lookFor`. Returns the full path, or None.
+        '''
+        for checkDIR in self.ancestorsOf(workingDIR):
+            if self.exists(checkDIR, lookFor):
+                return os.path.join(checkDIR, lookFor)
+        return None
+
+
+_indexes = {}
+_indexesLock = threading.Lock()
+
+
+def indexFor(folders):
+    '''
+    Return the shared, up-to-date index for a set of project folders.
+    '''
+    key = tuple(sorted(os.path.abspath(f) for f in folders))
+    with _indexesLock:
+        index = _indexes.get(key)
+        if index is None:
+            index = PandownIncludeIndex(key)
+            _indexes[key] = index
+    index.refresh()
+    return index
+
+
+def noteFile(path):
+    '''
+    Tell every index that covers `path` about it.
+    '''
+    with _indexesLock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        if index.projectFolderFor(path):
+            index.noteFile(path)
+
+
+def forgetFile(path):
+    '''
+    Tell every index that covers `path` that it has been deleted.
+    '''
+    with _indexesLock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        if index.projectFolderFor(path):
+            index.forgetFile(path)
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import re
+import subprocess
+import threading
+import uuid
+try:
+    from Pandown.pandownCommandBuilder import STDIN
+    from Pandown.pandownFanOut import argumentName
+except ImportError:
+    from pandownCommandBuilder import STDIN
+    from pandownFanOut import argumentName
+
+# Writers whose output can be cut apart at an HTML comment and stitched back
+# together.
+HTML_WRITERS = ("html", "html4", "html5")
+# Arguments whose effect spans the whole document, so that converting it a
+# section at a time would give a different result.
+FULL_BUILD_ARGUMENTS = (
+    "toc", "table-of-contents", "number-sections", "number-offset",
+    "section-divs", "reference-links", "self-contained", "embed-resources",
+    "bibliography", "citeproc", "csl", "natbib", "biblatex", "filter",
+    "lua-filter", "metadata-file", "file-scope",
+)
+# Arguments that only affect the standalone document around the body.
+SHELL_ARGUMENTS = (
+    "standalone", "template", "include-in-header", "include-before-body",
+    "include-after-body", "css", "variable", "title-prefix", "metadata",
+    "output",
+)
+# Markup that refers across sections: footnotes, citations, reference link
+# definitions, example lists, LaTeX macro definitions, fenced and raw HTML
+# divs that may contain headings, and YAML or title blocks, which feed the
+# standalone document.
+WHOLE_DOCUMENT_MARKUP = re.compile(r'''(?mx)
+    \[\^ | \^\[ | \[-?@ | (?<![\w.])@[\w_] | ^[ ]{0,3}\[[^\]\n]+\]:
+    | \(@ | \\(?:re)?newcommand | \\def\b
+    | ^:::+ | <div\b | <section\b
+    | ^---[ \t]*\n(?![ \t]*\n) | \A%
+''')
+FENCE = re.compile(r'''^(`{3,}|~{3,})''')
+HEADING = re.compile(r'''^#{1,6}(?:[ \t]|$)''')
+BODY_PLACEHOLDER = "pandown-incremental-body"
+
+_lock = threading.Lock()
+_blocks = {}
+_shells = {}
+MAX_BLOCKS = 4096
+MAX_SHELLS = 16
+
+
+def splitBlocks(text):
+    '''
+    Split Markdown into sections, each starting at a top-level ATX heading
+    (one after a blank line and outside any fenced code block). Anything
+    before the first heading is a section of its own.
+    '''
+    blocks = []
+    current = []
+    fence = None
+    previousBlank = True
+    for line in text.splitlines(True):
+        stripped = line.rstrip("\r\n")
+        if fence:
+            if stripped.startswith(fence):
+                fence = None
+        else:
+            opener = FENCE.match(stripped)
+            if opener:
+                fence = opener.group(1)
+            elif previousBlank and HEADING.match(stripped) and current:
+                blocks.append("".join(current))
+                current = []
+        current.append(line)
+        previousBlank = not stripped.strip()
+    if current:
+        blocks.append("".join(current))
+    return blocks
+
+
+def headingText(block):
+    first = block.split("\n", 1)[0]
+    return re.sub(r'''\s*\{[^}]*\}\s*$''', "", first.lstrip("#").strip().rstrip("#").strip()) if HEADING.match(first) else None
+
+
+def runPandoc(cmd, inputData, env=None, cwd=None):
+    startupinfo = None
+    if os.name == "nt":
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        cwd=cwd or None, env=env, startupinfo=startupinfo)
+    (out, errors) = proc.communicate(inputData)
+    return (proc.returncode, out.decode("utf-8"), errors.decode("utf-8", "replace"))
+
+
+def remember(cache, limit, key, value):
+    with _lock:
+        if len(cache) >= limit:
+            cache.clear()
+        cache[key] = value
+
+
+class PandownIncrementalBuild(object):
+    '''
+    Converts a Markdown document to HTML a section at a time, re-running
+    Pandoc only on sections that have changed since they were last converted
+    with the same arguments. The changed sections go through a single Pandoc
+    run, separated by comments that survive into the output, and for
+    standalone builds the converted body is dropped into a shell made once
+    per set of arguments.
+
+    `cmd` is the single-file command from buildPandocCmd, and `dependencies`
+    the files it pulled in, which the shell depends on.
+    '''
+
+    def __init__(self, cmd, text, dependencies=()):
+        self.cmd = cmd
+        self.text = text
+        self.dependencies = dependencies
+        self.blocks = splitBlocks(text)
+        args = cmd[1:-1]
+        self.standalone = any(argumentName(arg) in ("standalone", "template") or arg == "-s" for arg in args)
+        self.fragmentCmd = cmd[:1] + [arg for arg in args if argumentName(arg) not in SHELL_ARGUMENTS and arg != "-s"] + [STDIN]
+        self.shellCmd = cmd[:1] + [arg for arg in args if argumentName(arg) != "output"] + [STDIN]
+        self.converted = 0
+        self.reused = 0
+        self.messages = ""
+
+    def fallbackReason(self):
+        '''
+        Why this document needs a full build, or None if it can be built
+        incrementally.
+        '''
+        for arg in self.cmd[1:-1]:
+            name = argumentName(arg)
+            if name == "to" and arg.partition("=")[2].split("+")[0] not in HTML_WRITERS:
+                return "the output isn't HTML"
+            if name in FULL_BUILD_ARGUMENTS:
+                return "--%s applies to the whole document" % name
+        if len(self.blocks) < 2:
+            return "there's only one section"
+        if WHOLE_DOCUMENT_MARKUP.search(self.text):
+            return "the document has footnotes, citations, or other cross-section markup"
+        headings = [headingText(block) for block in self.blocks if headingText(block) is not None]
+        if len(set(headings)) != len(headings):
+            return "two sections have the same heading, so their identifiers depend on each other"
+        for heading in headings:
+            if re.search(r"\[%s\](?![(\[])" % re.escape(heading), self.text):
+                return "a section refers to the heading \"%s\"" % heading
+        return None
+
+    def hash(self, *parts):
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def run(self, env=None, cwd=None):
+        '''
+        The converted document, or None if Pandoc failed (with its errors
+        in self.messages), in which case a full build will report them.
+        '''
+        configKey = self.hash(*(self.fragmentCmd + [(env or {}).get("PATH", "")]))
+        keys = [self.hash(configKey, block) for block in self.blocks]
+        with _lock:
+            fragments = [_blocks.get(key) for key in keys]
+        dirty = [i for (i, fragment) in enumerate(fragments) if fragment is None]
+        self.reused = len(self.blocks) - len(dirty)
+        self.converted = len(dirty)
+
+        if dirty:
+            sentinel = "<!-- pandown-block-%s -->" % uuid.uuid4().hex
+            source = ("\n\n" + sentinel + "\n\n").join(self.blocks[i].rstrip("\r\n") for i in dirty) + "\n"
+            (returncode, out, errors) = runPandoc(self.fragmentCmd, source.encode("utf-8"), env, cwd)
+            self.messages += errors
+            if returncode != 0:
+                return None
+            pieces = out.split(sentinel)
+            if len(pieces) != len(dirty):
+                return None
+            for (i, piece) in zip(dirty, pieces):
+                fragments[i] = piece.strip("\n")
+                remember(_blocks, MAX_BLOCKS, keys[i], fragments[i])
+
+        body = "\n".join(fragment for fragment in fragments if fragment)
+        if not self.standalone:
+            return body + "\n"
+        shell = self.shell(env, cwd)
+        if shell is None:
+            return None
+        return shell.replace("<p>%s</p>" % BODY_PLACEHOLDER, body, 1)
+
+    def shell(self, env, cwd):
+        stamps = []
+        for dep in sorted(set(self.dependencies)):
+            try:
+                st = os.stat(dep)
+                stamps.append("%s:%s:%s" % (dep, st.st_mtime, st.st_size))
+            except OSError:
+                stamps.append(dep)
+        key = self.hash(*(self.shellCmd + stamps + [(env or {}).get("PATH", "")]))
+        with _lock:
+            shell = _shells.get(key)
+        if shell is not None:
+            return shell
+        (returncode, out, errors) = runPandoc(self.shellCmd, (BODY_PLACEHOLDER + "\n").encode("utf-8"), env, cwd)
+        self.messages += errors
+        if returncode != 0 or "<p>%s</p>" % BODY_PLACEHOLDER not in out:
+            return None
+        remember(_shells, MAX_SHELLS, key, out)
+        return out
@@ -0,0 +1,237 @@
+import itertools
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+def processGroupOptions():
+    '''
+    Popen arguments that start a process in a group of its own, so that
+    terminateGroup can stop whatever it starts in turn (pdflatex, filters)
+    along with it.
+    '''
+    if os.name == "nt":
+        return {"creationflags": getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0x200)}
+    if sys.version_info >= (3, 2):
+        return {"start_new_session": True}
+    return {"preexec_fn": os.setsid}
+
+
+def terminateGroup(pid):
+    '''
+    Stop a running process started with processGroupOptions, and everything
+    in its group.
+    '''
+    try:
+        if os.name == "nt":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            subprocess.call(["taskkill", "/T", "/F", "/PID", str(pid)], startupinfo=startupinfo,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            os.killpg(pid, signal.SIGTERM)
+    except OSError:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+class PandownJob(object):
+    '''
+    One build waiting for, or holding, a slot in a PandownJobQueue. `start`
+    is called with the job when its turn comes, and returns the process,
+    which needs only kill(). `build` is whatever the caller wants to find
+    the job's output by later. `onEnd`, if given, is called with the job
+    once it has ended in any way, including being cancelled before it
+    started.
+    '''
+    _ids = itertools.count(1)
+
+    def __init__(self, key, description, start, build=None, onEnd=None):
+        self.id = next(PandownJob._ids)
+        self.key = key
+        self.description = description
+        self.start = start
+        self.build = build
+        self.onEnd = onEnd
+        self.state = QUEUED
+        self.proc = None
+        self.exitCode = None
+        self.queued = time.time()
+        self.started = None
+        self.ended = None
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.time()) - self.started
+
+    def describe(self):
+        if self.state == QUEUED:
+            timing = "waiting %.0fs" % (time.time() - self.queued)
+        elif self.state == FAILED and self.exitCode is not None:
+            timing = "%.1fs, exit code %s" % (self.elapsed(), self.exitCode)
+        else:
+            timing = "%.1fs" % self.elapsed()
+        return "[%s] %s (%s)" % (self.state, self.description, timing)
+
+
+class PandownJobQueue(object):
+    '''
+    Runs builds at most `limit` at a time, oldest first. Each build has a key,
+    such as the view it's for and the file it writes, and submitting a new
+    build cancels any queued or running build with the same key, since its
+    output is about to be replaced anyway.
+
+    All methods are meant to be called from one thread (Sublime's main
+    thread), except jobs(), which may be called from any.
+    '''
+
+    def __init__(self, limit=2, history=20):
+        self.limit = limit
+        self.history = history
+        self.queued = []
+        self.running = []
+        self.ended = []
+        self.lock = threading.Lock()
+
+    def submit(self, key, description, start, build=None, onEnd=None):
+        for job in self.active():
+            if job.key == key:
+                self.cancel(job)
+        job = PandownJob(key, description, start, build, onEnd)
+        with self.lock:
+            self.queued.append(job)
+        self.pump()
+        return job
+
+    def cancel(self, job):
+        with self.lock:
+            if job.state == QUEUED:
+                self.queued.remove(job)
+            elif job.state == RUNNING:
+                self.running.remove(job)
+            else:
+                return
+            self.end(job, CANCELLED)
+        if job.proc:
+            job.proc.kill()
+        self.notifyEnded(job)
+        self.pump()
+
+    def done(self, job, exitCode):
+        '''
+        Record that a running job's process has exited, and start the next.
+        '''
+        with self.lock:
+            if job.state != RUNNING:
+                return
+            self.running.remove(job)
+            job.exitCode = exitCode
+            self.end(job, FINISHED if not exitCode else FAILED)
+        self.notifyEnded(job)
+        self.pump()
+
+    def end(self, job, state):
+        job.state = state
+        job.ended = time.time()
+        self.ended.insert(0, job)
+        del self.ended[self.history:]
+
+    def notifyEnded(self, job):
+        # Outside the lock, so that onEnd can submit more jobs.
+        if job.onEnd:
+            job.onEnd(job)
+
+    def pump(self):
+        while True:
+            with self.lock:
+                if not self.queued or len(self.running) >= max(1, self.limit):
+                    return
+                job = self.queued.pop(0)
+                job.state = RUNNING
+                job.started = time.time()
+                self.running.append(job)
+            try:
+                job.proc = job.start(job)
+            except Exception:
+                with self.lock:
+                    failed = job in self.running
+                    if failed:
+                        self.running.remove(job)
+                        self.end(job, FAILED)
+                if failed:
+                    self.notifyEnded(job)
+                raise
+
+    def active(self):
+        with self.lock:
+            return self.running + self.queued
+
+    def jobs(self):
+        '''
+        Running jobs, then queued ones, then the most recently ended.
+        '''
+        with self.lock:
+            return self.running + self.queued + self.ended
+
+
+if __name__ == "__main__":
+    # Queue more builds than the limit allows, supersede one, and check that
+    # no more than `limit` run at once, that the superseded build never
+    # starts, and that a cancelled process group takes its children with it.
+    class FakeProcess(object):
+        def __init__(self, job):
+            self.job = job
+            self.killed = False
+
+        def kill(self):
+            self.killed = True
+
+    queue = PandownJobQueue(limit=2)
+    started = []
+    ended = []
+
+    def start(job):
+        started.append(job.description)
+        assert len(queue.running) <= 2
+        return FakeProcess(job)
+
+    jobs = [queue.submit(("view", n), "build %d" % n, start, onEnd=lambda job: ended.append(job.description)) for n in range(4)]
+    replacement = queue.submit(("view", 3), "build 3 again", start)
+    assert jobs[3].state == CANCELLED and started == ["build 0", "build 1"]
+    assert ended == ["build 3"], "a job cancelled before it started has still ended"
+    queue.done(jobs[0], 0)
+    queue.done(jobs[1], 1)
+    assert started == ["build 0", "build 1", "build 2", "build 3 again"]
+    assert [job.state for job in jobs[:3]] == [FINISHED, FAILED, RUNNING]
+    queue.cancel(replacement)
+    assert replacement.proc.killed
+    for job in queue.jobs():
+        print(job.describe())
+
+    if os.name != "nt":
+        # A shell that starts a grandchild; both should be gone after
+        # terminateGroup.
+        proc = subprocess.Popen(["sh", "-c", "sleep 30 & echo $!; wait"], stdout=subprocess.PIPE, **processGroupOptions())
+        grandchild = int(proc.stdout.readline())
+        terminateGroup(proc.pid)
+        proc.wait()
+        time.sleep(0.1)
+        try:
+            os.kill(grandchild, 0)
+            alive = open("/proc/%d/stat" % grandchild).read().split()[2] != "Z" if os.path.exists("/proc") else True
+        except OSError:
+            alive = False
+        assert not alive, "grandchild survived"
+        print("Process group terminated")
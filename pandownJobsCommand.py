@@ -0,0 +1,36 @@
+import sublime
+import sublime_plugin
+if int(sublime.version()) >= 3000:
+    from Pandown.pandownProcess import jobQueue
+else:
+    from pandownProcess import jobQueue
+
+
+class PandownJobsCommand(sublime_plugin.WindowCommand):
+    '''
+    List running, queued, and recent builds; picking one that hasn't ended
+    cancels it.
+    '''
+
+    def run(self):
+        jobs = jobQueue().jobs()
+        if not jobs:
+            sublime.status_message("Pandown: no builds")
+            return
+        running = len(jobQueue().running)
+        sublime.status_message("Pandown: %d of at most %d builds running" % (running, jobQueue().limit))
+        items = []
+        for job in jobs:
+            action = "Select to cancel" if job in jobQueue().active() else "Ended"
+            items.append([job.describe(), action])
+        self.window.show_quick_panel(items, lambda index: self.picked(jobs, index))
+
+    def picked(self, jobs, index):
+        if index < 0:
+            return
+        job = jobs[index]
+        if job in jobQueue().active():
+            jobQueue().cancel(job)
+            if job.build:
+                job.build.append_string_err(None, "[Cancelled]")
+            sublime.status_message("Pandown: cancelled " + job.description)
@@ -0,0 +1,53 @@
+import sublime
+import sublime_plugin
+
+# The number of edits seen in each live-previewed view, so that a rebuild
+# only goes ahead if nothing has been typed since it was scheduled.
+_edits = {}
+
+
+def schedulePreview(view):
+    if not view.settings().get("pandown_live_preview", False):
+        return
+    s = sublime.load_settings("Pandown.sublime-settings")
+    viewId = view.id()
+    _edits[viewId] = _edits.get(viewId, 0) + 1
+    count = _edits[viewId]
+    sublime.set_timeout(lambda: runPreview(view, count), s.get("live_preview_delay", 750))
+
+
+def runPreview(view, count):
+    if _edits.get(view.id()) != count:
+        return
+    window = view.window()
+    if window and view.settings().get("pandown_live_preview", False):
+        window.run_command("pandown_build", {"to_window": True, "view_id": view.id(), "live": True})
+
+
+class PandownToggleLivePreviewCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        view = self.window.active_view()
+        enabled = not view.settings().get("pandown_live_preview", False)
+        view.settings().set("pandown_live_preview", enabled)
+        if enabled:
+            sublime.status_message("Pandown live preview on")
+            self.window.run_command("pandown_build", {"to_window": True, "view_id": view.id(), "live": True})
+        else:
+            _edits.pop(view.id(), None)
+            sublime.status_message("Pandown live preview off")
+
+    def is_checked(self):
+        view = self.window.active_view()
+        return bool(view and view.settings().get("pandown_live_preview", False))
+
+
+class PandownLivePreviewListener(sublime_plugin.EventListener):
+    def on_modified_async(self, view):
+        schedulePreview(view)
+
+    if int(sublime.version()) < 3000:
+        # Sublime Text 2 has no asynchronous events.
+        on_modified = on_modified_async
+
+    def on_close(self, view):
+        _edits.pop(view.id(), None)
@@ -0,0 +1,127 @@
+import codecs
+import collections
+import threading
+
+
+class PandownOutputBuffer(object):
+    '''
+    A bounded queue of output chunks, filled as a process's pipes are read
+    and drained on the main thread a slice at a time. Each chunk is tagged
+    with a key (the stream it came from), and consecutive chunks
+    with the same key are drained together, so that a flood of small reads
+    becomes a few large appends.
+
+    Once `limit` bytes are waiting the buffer is full(), and whoever is
+    reading the process's pipes should stop until the main thread catches
+    up, which in turn stops Pandoc, rather than let the backlog grow without
+    bound.
+    '''
+
+    def __init__(self, limit=2 ** 22):
+        self.limit = limit
+        self.chunks = collections.deque()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def full(self):
+        return self.size >= self.limit
+
+    def put(self, key, data):
+        with self.lock:
+            self.chunks.append((key, data))
+            self.size += len(data)
+
+    def take(self, maxSize):
+        '''
+        Remove up to maxSize bytes from the front of the buffer, all with the
+        same key, and return (key, data), or None if the buffer is empty.
+        A chunk too big to fit is split.
+        '''
+        with self.lock:
+            if not self.chunks:
+                return None
+            key = self.chunks[0][0]
+            pieces = []
+            taken = 0
+            while self.chunks and self.chunks[0][0] == key and taken < maxSize:
+                data = self.chunks.popleft()[1]
+                if taken + len(data) > maxSize:
+                    self.chunks.appendleft((key, data[maxSize - taken:]))
+                    data = data[:maxSize - taken]
+                pieces.append(data)
+                taken += len(data)
+            self.size -= taken
+        return (key, pieces[0][:0].join(pieces))
+
+    def discard(self, key):
+        '''
+        Drop everything queued under key.
+        '''
+        with self.lock:
+            kept = [chunk for chunk in self.chunks if chunk[0] != key]
+            self.size = sum(len(chunk[1]) for chunk in kept)
+            self.chunks = collections.deque(kept)
+
+
+class PandownDecoder(object):
+    '''
+    Decodes one output stream a chunk at a time, so that a character or a
+    "\\r\\n" split between two reads comes out whole, and converts line
+    endings to "\\n" for Sublime.
+    '''
+
+    def __init__(self, encoding="utf-8"):
+        self.decoder = codecs.getincrementaldecoder(encoding)("replace")
+        self.pendingCR = False
+
+    def decode(self, data, final=False):
+        text = self.decoder.decode(data, final)
+        if self.pendingCR:
+            text = "\r" + text
+            self.pendingCR = False
+        if text.endswith("\r") and not final:
+            text = text[:-1]
+            self.pendingCR = True
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+if __name__ == "__main__":
+    # Feed the buffer from a reader thread in pipe-sized reads and drain it
+    # the way the flusher does, checking that multibyte characters and line
+    # endings split between reads survive, and that the buffer never holds
+    # much more than its limit.
+    import time
+
+    text = (u"Café — \U0001F600 line\r\n" * 200000)
+    data = text.encode("utf-8")
+    buf = PandownOutputBuffer(limit=2 ** 20)
+    peak = [0]
+
+    def read():
+        for i in range(0, len(data), 2 ** 15 - 1):
+            while buf.full():
+                time.sleep(0.001)
+            buf.put("out", data[i:i + 2 ** 15 - 1])
+            peak[0] = max(peak[0], len(buf))
+
+    start = time.time()
+    reader = threading.Thread(target=read)
+    reader.start()
+    decoder = PandownDecoder()
+    out = []
+    appends = 0
+    while reader.is_alive() or len(buf):
+        chunk = buf.take(2 ** 16)
+        if chunk is None:
+            time.sleep(0.001)
+            continue
+        out.append(decoder.decode(chunk[1]))
+        appends += 1
+    out.append(decoder.decode(b"", True))
+    reader.join()
+    assert u"".join(out) == text.replace(u"\r\n", u"\n")
+    print("%.1f MB in %d appends (instead of %d reads), peak backlog %.1f MB, %.2fs" % (
+        len(data) / 1e6, appends, len(data) // (2 ** 15 - 1) + 1, peak[0] / 1e6, time.time() - start))
@@ -0,0 +1,91 @@
+'''
+Works out how little of an output view has to change to show a rebuild's
+output, so that it can be updated in one edit that Sublime only has to lay
+out and highlight again where the text is different.
+'''
+import difflib
+
+# Past this many differing lines, between the first and last that differ,
+# they're replaced wholesale rather than matched up line by line.
+MAX_DIFF_LINES = 20000
+
+
+def outputEdits(old, new, limit=MAX_DIFF_LINES):
+    '''
+    The edits that turn `old` into `new`, as (begin, end, text): replace
+    old[begin:end] with text. They're a line or more each, in order, and
+    don't overlap, so they should be made last to first.
+    '''
+    if old == new:
+        return []
+    oldLines = old.splitlines(True)
+    newLines = new.splitlines(True)
+    shortest = min(len(oldLines), len(newLines))
+    start = 0
+    while start < shortest and oldLines[start] == newLines[start]:
+        start += 1
+    end = 0
+    while end < shortest - start and oldLines[-1 - end] == newLines[-1 - end]:
+        end += 1
+    offsets = [sum(len(line) for line in oldLines[:start])]
+    oldLines = oldLines[start:len(oldLines) - end]
+    newLines = newLines[start:len(newLines) - end]
+    for line in oldLines:
+        offsets.append(offsets[-1] + len(line))
+    if len(oldLines) + len(newLines) > limit:
+        return [(offsets[0], offsets[-1], "".join(newLines))]
+    edits = []
+    matcher = difflib.SequenceMatcher(None, oldLines, newLines)
+    for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+        if tag != "equal":
+            edits.append((offsets[i1], offsets[i2], "".join(newLines[j1:j2])))
+    return edits
+
+
+def applyEdits(old, edits):
+    pieces = []
+    last = 0
+    for (begin, end, text) in edits:
+        pieces.append(old[last:begin])
+        pieces.append(text)
+        last = end
+    pieces.append(old[last:])
+    return "".join(pieces)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    rng = random.Random(0)
+    words = ["<p>", "</p>", "lorem", "ipsum", "dolor", "\n", "\n\n", "<h2>", "</h2>\n"]
+
+    def page(count):
+        return "".join(rng.choice(words) + " " for i in range(count))
+
+    for i in range(2000):
+        old = page(rng.randint(0, 60))
+        new = list(old)
+        for j in range(rng.randint(0, 4)):
+            at = rng.randint(0, len(new))
+            new[at:at + rng.randint(0, 10)] = page(rng.randint(0, 5))
+        new = "".join(new)
+        for limit in (MAX_DIFF_LINES, 2):
+            edits = outputEdits(old, new, limit)
+            assert applyEdits(old, edits) == new, (old, new, edits)
+            assert all(a[1] <= b[0] for (a, b) in zip(edits, edits[1:]))
+    assert outputEdits("same\n", "same\n") == []
+    print("random: 4000 diffs reproduce the new text")
+
+    # A long document with one paragraph changed should come out as one
+    # small edit, however long it is.
+    paragraphs = ["<p>Paragraph %d of a long document, with some text in it.</p>\n" % i for i in range(200000)]
+    old = "".join(paragraphs)
+    paragraphs[120000] = "<p>Paragraph 120000, <em>edited</em>.</p>\n"
+    new = "".join(paragraphs)
+    start = time.time()
+    edits = outputEdits(old, new)
+    elapsed = time.time() - start
+    assert applyEdits(old, edits) == new
+    changed = sum(end - begin + len(text) for (begin, end, text) in edits)
+    print("%.1f MB document: %d edit of %d characters in %.3fs" % (len(new) / 1e6, len(edits), changed, elapsed))
@@ -0,0 +1,263 @@
+'''
+PDF builds that keep their LaTeX state between runs. Pandoc writes the .tex
+into a build directory beside the document, where LaTeX's auxiliary files
+are kept, so that an unchanged document needs a single pass. The preamble is
+precompiled into a format (with pdflatex and the mylatexformat package)
+that's reused until the preamble itself changes.
+'''
+import codecs
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+try:
+    from Pandown.pandownCommandBuilder import argumentName
+    from Pandown.pandownJobs import processGroupOptions, terminateGroup
+    from Pandown.pandownStream import communicate
+except ImportError:
+    from pandownCommandBuilder import argumentName
+    from pandownJobs import processGroupOptions, terminateGroup
+    from pandownStream import communicate
+
+PDF_WRITERS = ("latex", "beamer")
+ENGINE_ARGUMENTS = ("latex-engine", "pdf-engine")
+ENGINE_OPTIONS = ("latex-engine-opt", "pdf-engine-opt")
+# Only pdflatex can load a format dumped with mylatexformat reliably.
+FORMAT_ENGINES = ("pdflatex",)
+# The files whose contents decide whether another pass would change anything.
+STATE_EXTENSIONS = (".aux", ".toc", ".lof", ".lot", ".out", ".nav", ".snm", ".bbl")
+RERUN = re.compile(r"Rerun to get|Label\(s\) may have changed|Please rerun LaTeX|Please \(re\)run")
+ERROR = re.compile(r"^(! .*|.*:\d+: .*)$", re.M)
+MAX_PASSES = 5
+
+# Engines that failed to dump a format this session, so it's not tried again.
+_noFormat = set()
+_locksLock = threading.Lock()
+_locks = {}
+
+
+def usesPipeline(cmd):
+    '''
+    Whether `cmd` makes a PDF through LaTeX.
+    '''
+    output = [arg for arg in cmd if argumentName(arg) == "output"]
+    writers = [arg.partition("=")[2].split("+")[0].split("-")[0] for arg in cmd if argumentName(arg) == "to"]
+    return bool(output and writers) and output[-1].lower().endswith(".pdf") and writers[-1] in PDF_WRITERS
+
+
+def digest(paths):
+    h = hashlib.sha1()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except (IOError, OSError):
+            h.update(b"\0missing")
+    return h.hexdigest()
+
+
+def lockFor(buildDir):
+    with _locksLock:
+        return _locks.setdefault(buildDir, threading.Lock())
+
+
+class PandownPdfBuild(object):
+    '''
+    One document's PDF build. `cmd` is the command Pandoc would have made the
+    PDF with, and `inputData` what to pipe to it, if anything. run() can be
+    called from any thread; builds of the same document take turns.
+    '''
+
+    def __init__(self, cmd, workingDIR, inputData=None, buildDirName=".pandown-build", useFormat=True):
+        self.workingDIR = workingDIR
+        self.inputData = inputData
+        self.outFile = [arg for arg in cmd if argumentName(arg) == "output"][-1].partition("=")[2]
+        self.stem = os.path.splitext(os.path.basename(self.outFile))[0]
+        root = os.path.join(os.path.dirname(self.outFile), buildDirName)
+        self.buildDir = os.path.join(root, self.stem)
+        self.formatDir = os.path.join(root, "formats")
+        self.texFile = os.path.join(self.buildDir, self.stem + ".tex")
+        self.engine = "pdflatex"
+        self.engineOptions = []
+        self.texCmd = []
+        for arg in cmd:
+            name = argumentName(arg)
+            if name in ENGINE_ARGUMENTS:
+                self.engine = arg.partition("=")[2] or self.engine
+            elif name in ENGINE_OPTIONS:
+                self.engineOptions.append(arg.partition("=")[2])
+            elif name == "output":
+                self.texCmd.append("--output=" + self.texFile)
+            else:
+                self.texCmd.append(arg)
+        if not any(argumentName(arg) == "standalone" or arg == "-s" for arg in self.texCmd):
+            self.texCmd.insert(1, "--standalone")
+        self.useFormat = useFormat and os.path.basename(self.engine) in FORMAT_ENGINES
+        self.passes = 0
+        self.formatReused = False
+        self.process = None
+        self.cancelled = False
+
+    def run(self, env=None):
+        '''
+        Build the PDF. Returns (returncode, messages).
+        '''
+        with lockFor(self.buildDir):
+            if not os.path.isdir(self.buildDir):
+                os.makedirs(self.buildDir)
+            env = dict(env or os.environ)
+            # Figures and other inputs are relative to the document.
+            env["TEXINPUTS"] = self.workingDIR + os.pathsep + env.get("TEXINPUTS", "") + os.pathsep
+            env["BIBINPUTS"] = self.workingDIR + os.pathsep + env.get("BIBINPUTS", "") + os.pathsep
+            env["TEXFORMATS"] = self.formatDir + os.pathsep + env.get("TEXFORMATS", "") + os.pathsep
+
+            (code, output) = self.call(self.texCmd, env, self.inputData)
+            if code != 0:
+                return (code, output)
+            fmt = self.preambleFormat(env) if self.useFormat else None
+            (code, messages) = self.typeset(env, fmt)
+            if code != 0 and fmt:
+                # The precompiled preamble may be at fault; try once without.
+                (code, messages) = self.typeset(env, None)
+            if code != 0:
+                return (code, (output + "\n" + messages).strip())
+            try:
+                shutil.copyfile(os.path.join(self.buildDir, self.stem + ".pdf"), self.outFile)
+            except (IOError, OSError) as e:
+                return (1, str(e))
+            return (0, output.strip())
+
+    def cancel(self):
+        self.cancelled = True
+        if self.process and self.process.poll() is None:
+            terminateGroup(self.process.pid)
+
+    def call(self, cmd, env, inputData=None, cwd=None):
+        if self.cancelled:
+            return (-1, "[Cancelled]")
+        startupinfo = None
+        if os.name == "nt":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        try:
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE if inputData is not None else None,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd or self.workingDIR or None, env=env,
+                startupinfo=startupinfo, **processGroupOptions())
+            output = communicate(self.process, inputData)[0]
+        except OSError as e:
+            return (-1, "%s: %s" % (cmd[0], e))
+        return (self.process.returncode, output.decode("utf-8", "replace"))
+
+    def preambleFormat(self, env):
+        '''
+        The name of the format with this document's preamble dumped into it,
+        made if there isn't one yet, or None if it can't be.
+        '''
+        if self.engine in _noFormat:
+            return None
+        with codecs.open(self.texFile, "r", "utf-8") as f:
+            text = f.read()
+        end = text.find("\\begin{document}")
+        if end < 0:
+            return None
+        h = hashlib.sha1((self.engine + "\0" + " ".join(self.engineOptions) + "\0" + text[:end]).encode("utf-8"))
+        name = "preamble-" + h.hexdigest()[:16]
+        if os.path.isfile(os.path.join(self.formatDir, name + ".fmt")):
+            self.formatReused = True
+            return name
+        with lockFor(self.formatDir):
+            if os.path.isfile(os.path.join(self.formatDir, name + ".fmt")):
+                # Another document with the same preamble just made it.
+                self.formatReused = True
+                return name
+            if not os.path.isdir(self.formatDir):
+                os.makedirs(self.formatDir)
+            (code, output) = self.call([self.engine, "-ini", "-interaction=nonstopmode", "-output-directory=" + self.formatDir,
+                "-jobname=" + name, "&" + os.path.basename(self.engine), "mylatexformat.ltx", self.texFile], env)
+        if code != 0 or not os.path.isfile(os.path.join(self.formatDir, name + ".fmt")):
+            print("[Pandown: couldn't precompile the preamble with %s and mylatexformat; building without]" % self.engine)
+            _noFormat.add(self.engine)
+            return None
+        return name
+
+    def typeset(self, env, fmt):
+        '''
+        Run LaTeX (and BibTeX or Biber, if they're needed) until the
+        auxiliary files stop changing. Those from the last build count, so
+        an unchanged document is done after one pass.
+        '''
+        cmd = [self.engine, "-interaction=nonstopmode", "-halt-on-error", "-file-line-error",
+            "-output-directory=" + self.buildDir]
+        latexmk = os.path.basename(self.engine).startswith("latexmk")
+        if latexmk:
+            # It decides on passes itself.
+            cmd.insert(1, "-pdf")
+        if fmt:
+            cmd.append("-fmt=" + fmt)
+        cmd += self.engineOptions + [self.texFile]
+        state = [os.path.join(self.buildDir, self.stem + ext) for ext in STATE_EXTENSIONS]
+        before = digest(state)
+        self.passes = 0
+        while self.passes < MAX_PASSES:
+            (code, output) = self.call(cmd, env)
+            self.passes += 1
+            log = self.readLog()
+            if code != 0:
+                errors = ERROR.findall(log) or [output.strip()[-2000:]]
+                return (code, "\n".join(errors))
+            if latexmk:
+                break
+            ranBibliography = self.bibliography(env)
+            after = digest(state)
+            if after == before and not ranBibliography and not RERUN.search(log):
+                break
+            before = after
+        return (0, "")
+
+    def readLog(self):
+        try:
+            with codecs.open(os.path.join(self.buildDir, self.stem + ".log"), "r", "utf-8", "replace") as f:
+                return f.read()
+        except (IOError, OSError):
+            return ""
+
+    def bibliography(self, env):
+        '''
+        Run Biber (for biblatex) or BibTeX (for natbib), if the citations
+        have changed since they last ran. Returns whether either ran.
+        '''
+        base = os.path.join(self.buildDir, self.stem)
+        if os.path.isfile(base + ".bcf"):
+            tool = ["biber", "--input-directory=" + self.workingDIR, self.stem]
+            key = digest([base + ".bcf"])
+        else:
+            try:
+                with codecs.open(base + ".aux", "r", "utf-8", "replace") as f:
+                    cited = [line for line in f if line.startswith(("\\citation", "\\bibdata", "\\bibstyle"))]
+            except (IOError, OSError):
+                return False
+            if not any(line.startswith("\\bibdata") for line in cited):
+                return False
+            tool = ["bibtex", self.stem]
+            key = hashlib.sha1("".join(cited).encode("utf-8")).hexdigest()
+        stampFile = base + ".pandown-bib"
+        try:
+            with open(stampFile) as f:
+                if f.read() == key and os.path.isfile(base + ".bbl"):
+                    return False
+        except (IOError, OSError):
+            pass
+        (code, output) = self.call(tool, env, cwd=self.buildDir)
+        if code != 0:
+            # LaTeX will report the missing citations.
+            print("[Pandown: %s failed: %s]" % (tool[0], output.strip()))
+            return False
+        with open(stampFile, "w") as f:
+            f.write(key)
+        return True
+
+    def describe(self):
+        return "%d LaTeX pass%s%s" % (self.passes, "" if self.passes == 1 else "es",
+            ", precompiled preamble" if self.formatReused else "")
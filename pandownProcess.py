@@ -6,6 +6,188 @@ import os
 import subprocess
 import threading
 import functools
+if int(sublime.version()) >= 3000:
+    from Pandown.pandownServer import PandownServerProcess, server
+    import Pandown.pandownBuildCache as pandownBuildCache
+    from Pandown.pandownOutputBuffer import PandownOutputBuffer, PandownDecoder
+    from Pandown.pandownJobs import PandownJobQueue, QUEUED, CANCELLED, processGroupOptions, terminateGroup
+    import Pandown.pandownEventLoop as pandownEventLoop
+    from Pandown.pandownEventLoop import PandownEventLoopProcess
+    from Pandown.pandownTimings import PandownTimingLog
+    from Pandown.pandownToolchain import processEnvironment
+    from Pandown.pandownStream import isStreamed, writeInput
+    import Pandown.pandownDependencies as pandownDependencies
+else:
+    from pandownServer import PandownServerProcess, server
+    import pandownBuildCache
+    from pandownOutputBuffer import PandownOutputBuffer, PandownDecoder
+    from pandownJobs import PandownJobQueue, QUEUED, CANCELLED, processGroupOptions, terminateGroup
+    import pandownEventLoop
+    from pandownEventLoop import PandownEventLoopProcess
+    from pandownTimings import PandownTimingLog
+    from pandownToolchain import processEnvironment
+    from pandownStream import isStreamed, writeInput
+    import pandownDependencies
+
+# Output is appended to its view at most APPENDS_PER_FLUSH times, of up to
+# APPEND_SIZE bytes each, every FLUSH_INTERVAL milliseconds, so that a large
+# build can't monopolize the main thread.
+APPEND_SIZE = 2 ** 16
+APPENDS_PER_FLUSH = 4
+FLUSH_INTERVAL = 16
+
+
+def plugin_unloaded():
+    server.stop()
+    pandownEventLoop.stopEventLoop()
+
+
+def buildCache():
+    s = sublime.load_settings("Pandown.sublime-settings")
+    if int(sublime.version()) >= 3000:
+        root = os.path.join(sublime.cache_path(), "Pandown", "build-cache")
+    else:
+        root = os.path.join(sublime.packages_path(), "User", "Pandown.cache", "build-cache")
+    return pandownBuildCache.cacheFor(root,
+        s.get("build_cache_max_size", 256) * 1024 * 1024,
+        s.get("build_cache_max_age", 30) * 24 * 60 * 60)
+
+
+def logTimings(timer, **extra):
+    '''
+    Append a finished build's timings to the log, if "log_build_timings" is
+    on.
+    '''
+    s = sublime.load_settings("Pandown.sublime-settings")
+    if timer is None or not s.get("log_build_timings", True):
+        return
+    timingLog().append(timer.record(**extra))
+
+
+def timingLog():
+    if int(sublime.version()) >= 3000:
+        root = os.path.join(sublime.cache_path(), "Pandown")
+    else:
+        root = os.path.join(sublime.packages_path(), "User", "Pandown.cache")
+    return PandownTimingLog(os.path.join(root, "build-timings.jsonl"))
+
+
+def dependencyGraph():
+    if int(sublime.version()) >= 3000:
+        root = os.path.join(sublime.cache_path(), "Pandown")
+    else:
+        root = os.path.join(sublime.packages_path(), "User", "Pandown.cache")
+    return pandownDependencies.graphFor(os.path.join(root, "dependencies.json"))
+
+
+def recordDependencies(outFile, record, save=True):
+    '''
+    Note what a successful build of `outFile` read, from the record a build
+    command made with its command line (see PandownBuildCommand.dependencyRecord).
+    '''
+    dependencyGraph().record(outFile, record["source"], record["inputs"], record["to"], record["from"], record["built"])
+    if save:
+        dependencyGraph().save()
+
+
+_pendingInputs = {}
+_inputCounter = [0]
+
+
+def stashInput(data):
+    '''
+    Hold on to the bytes a build pipes to Pandoc (or the iterator that
+    streams them), or its timer, until pandown_exec picks them up, since
+    they can't be passed around as command arguments.
+    Returns the key to pass as pandown_exec's input_key.
+    '''
+    _inputCounter[0] += 1
+    key = "input-%d" % _inputCounter[0]
+    _pendingInputs[key] = data
+    return key
+
+
+def takeInput(key):
+    return _pendingInputs.pop(key, None)
+
+
+_jobQueue = PandownJobQueue()
+
+
+def jobQueue():
+    '''
+    The queue every pandown_exec build waits in, which runs at most
+    "max_concurrent_builds" of them at a time.
+    '''
+    s = sublime.load_settings("Pandown.sublime-settings")
+    _jobQueue.limit = s.get("max_concurrent_builds", 2)
+    return _jobQueue
+
+
+class PandownThreadBuild(object):
+    '''
+    Stands in for the process of a build that runs on a thread of its own,
+    such as a PDF pipeline, an incremental build or a fan-out, while it
+    holds a slot in the job queue. kill() calls `cancel`, and messages about
+    the build go to `panel`.
+    '''
+
+    def __init__(self, panel, cancel=None):
+        self.panel = panel
+        self.cancel = cancel
+
+    def kill(self):
+        if self.cancel:
+            self.cancel()
+
+    def append_string_err(self, proc, string):
+        appendToView(self.panel, string)
+
+
+def submitThreadBuild(key, description, panel, run, finish, cancel=None, onEnd=None):
+    '''
+    Queue a build like pandown_exec's, keyed and described the same way,
+    that calls run() on a thread of its own once there's a slot for it.
+    run() returns the build's exit code; then, back on the main thread, the
+    job ends and finish() is called, unless the build was cancelled.
+    `onEnd` is the job's, called however it ends.
+    '''
+    build = PandownThreadBuild(panel, cancel)
+
+    def start(job):
+        def work():
+            exitCode = -1
+            try:
+                exitCode = run()
+            finally:
+                sublime.set_timeout(functools.partial(end, job, exitCode), 0)
+        threading.Thread(target=work).start()
+        return build
+
+    def end(job, exitCode):
+        if job.state == CANCELLED:
+            return
+        jobQueue().done(job, exitCode)
+        finish()
+
+    job = jobQueue().submit(key, description, start, build, onEnd)
+    if job.state == QUEUED:
+        sublime.status_message("Build queued until one of %d running builds finishes" % len(jobQueue().running))
+    return job
+
+
+def appendToView(view, string):
+    '''
+    Append to an output panel from the main thread, under either Sublime.
+    '''
+    if int(sublime.version()) >= 3000:
+        view.run_command("append", {"characters": string, "force": True, "scroll_to_end": True})
+    else:
+        view.set_read_only(False)
+        edit = view.begin_edit()
+        view.insert(edit, view.size(), string)
+        view.end_edit(edit)
+        view.set_read_only(True)
 
 
 class PandownProcessListener(object):
@@ -16,130 +198,171 @@ class PandownProcessListener(object):
     def on_data_err(self, proc, data):
         pass
 
+    def backlogged(self):
+        # True to have the process stop reading Pandoc's output for a while.
+        return False
+
     def on_finished(self, proc):
         pass
 
 
+def startProcess(command, env, listener, input_data=None, timeout=None):
+    '''
+    Start a build, on the shared event loop if this Python can run one
+    (Sublime Text 4's 3.8 plugin host), or else with threads of its own.
+    Streamed input is always written from a thread, whose blocking writes
+    keep it in step with Pandoc's reading.
+    '''
+    merged = processEnvironment(env)
+    shell = sublime.platform() == "windows"
+    if pandownEventLoop.available() and not isStreamed(input_data):
+        return PandownEventLoopProcess(command, merged, listener, input_data, timeout, shell)
+    return PandownAsyncProcess(command, merged, listener, input_data, timeout, shell)
+
+
 class PandownAsyncProcess(object):
-    def __init__(self, command, env, listener):
+    '''
+    Runs a command with a thread reading each of its pipes (and one writing
+    to stdin, if there's input). on_finished is called exactly once, by the
+    last reader, after the process has exited and the other threads have
+    been joined. The listener is called from the reader threads, which wait
+    while it's backlogged().
+    '''
+
+    def __init__(self, command, env, listener, input_data=None, timeout=None, shell=False):
         self.listener = listener
         self.killed = False
         self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.timer = None
 
         startupinfo = None
         if os.name == "nt":
             startupinfo = subprocess.STARTUPINFO()
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
 
-        processEnvironment = os.environ.copy()
-        processEnvironment.update(env)
-        for k, v in list(processEnvironment.items()):
-            processEnvironment[k] = os.path.expandvars(v)
-
-        if sublime.platform() == "windows":
-            shell = True
-        else:
-            shell = False
-        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=startupinfo, env=processEnvironment, shell=shell)
-        if self.process.stdout:
-            # _thread.start_new_thread(self.read_stdout, ())
-            threading.Thread(target=self.read_stdout).start()
-
-        if self.process.stderr:
-            # _thread.start_new_thread(self.read_stderr, ())
-            threading.Thread(target=self.read_stderr).start()
+        stdin = subprocess.PIPE if input_data is not None else None
+        # In a process group of its own, so that killing it also stops any
+        # LaTeX run or filter it started.
+        self.process = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=startupinfo, env=env, shell=shell,
+            **processGroupOptions())
+        self.open_streams = 2
+        self.threads = []
+        if input_data is not None:
+            # Written from its own thread so that Pandoc can't fill its output
+            # pipes and stall while we're still feeding it.
+            self.threads.append(threading.Thread(target=self.write_stdin, args=(input_data,)))
+        self.threads.append(threading.Thread(target=self.read, args=(self.process.stdout, "on_data_out")))
+        self.threads.append(threading.Thread(target=self.read, args=(self.process.stderr, "on_data_err")))
+        for thread in self.threads:
+            thread.start()
+        if timeout:
+            self.timer = threading.Timer(timeout, self.time_out, args=(timeout,))
+            self.timer.daemon = True
+            self.timer.start()
 
     def kill(self):
         if not self.killed:
             self.killed = True
-            self.process.terminate()
+            if self.process.poll() is None:
+                terminateGroup(self.process.pid)
             self.listener = None
 
+    def time_out(self, timeout):
+        if self.process.poll() is not None or self.killed:
+            return
+        listener = self.listener
+        if listener:
+            listener.on_data_err(self, ("[Timed out after %ss]\n" % timeout).encode("utf-8"))
+        terminateGroup(self.process.pid)
+
     def poll(self):
         return self.process.poll() == None
 
     def exit_code(self):
         return self.process.poll()
 
-    def read_stdout(self):
-        while True:
-            data = os.read(self.process.stdout.fileno(), 2 ** 15)
+    def write_stdin(self, data):
+        writeInput(self.process.stdin, data)
 
-            if len(data) > 0:
-                if self.listener:
-                    self.listener.on_data_out(self, data)
-            else:
-                self.process.stdout.close()
-                if self.listener:
-                    self.listener.on_finished(self)
-                break
-
-    def read_stderr(self):
+    def read(self, stream, callback):
         while True:
-            data = os.read(self.process.stderr.fileno(), 2 ** 15)
-
-            if len(data) > 0:
-                if self.listener:
-                    self.listener.on_data_err(self, data)
-            else:
-                self.process.stderr.close()
-                if self.listener:
-                    self.listener.on_finished(self)
+            data = os.read(stream.fileno(), 2 ** 15)
+            if not data:
                 break
-
-
-class PandownExecCommand(sublime_plugin.WindowCommand, PandownProcessListener):
-    def run(self, cmd=None, env={}, file_regex="", line_regex="", encoding="utf-8", quiet=True, kill=False, word_wrap=True, syntax="Packages/Text/Plain text.tmLanguage", working_dir="", output_view=None, **kwargs):
+            listener = self.listener
+            if listener:
+                getattr(listener, callback)(self, data)
+                while listener.backlogged() and not self.killed:
+                    time.sleep(0.01)
+        stream.close()
+
+        with self.lock:
+            self.open_streams -= 1
+            if self.open_streams > 0:
+                return
+        # The last reader out waits for the process and the other threads.
+        self.process.wait()
+        if self.timer:
+            self.timer.cancel()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        if self.listener:
+            self.listener.on_finished(self)
+
+
+class PandownExecCommand(sublime_plugin.WindowCommand):
+    def run(self, cmd=None, env={}, file_regex="", line_regex="", encoding="utf-8", quiet=True, kill=False, word_wrap=True, syntax="Packages/Text/Plain text.tmLanguage", working_dir="", output_view=None, use_server=False, cache_key=None, out_file=None, input_key=None, view_id=None, live=False, timer_key=None, dependency_record=None, **kwargs):
         __ST3 = int(sublime.version()) >= 3000
         if kill:
-            if self.proc:
-                self.proc.kill()
-                self.proc = None
-                self.append_string_err(None, "[Cancelled]")
+            for job in jobQueue().active():
+                if job.key[0] == self.window.id():
+                    jobQueue().cancel(job)
+                    job.build.append_string_err(None, "[Cancelled]")
             return
 
+        build = PandownExecBuild(encoding, quiet, cache_key, out_file)
+        build.timer = takeInput(timer_key) if timer_key else None
+        build.dependency_record = dependency_record
         if not output_view:
-            self.output_view = self.window.create_output_panel("exec") if __ST3 else self.window.get_output_panel("exec")
-            self.error_view = self.output_view
-            self.to_window = False
+            build.output_view = self.window.create_output_panel("exec") if __ST3 else self.window.get_output_panel("exec")
+            build.error_view = build.output_view
+            build.to_window = False
         elif output_view != None:
             for aView in self.window.views():
                 if aView.id() == output_view:
-                    self.output_view = aView
-            self.error_view = self.window.create_output_panel("exec") if __ST3 else self.window.get_output_panel("exec")
-            self.to_window = True
+                    build.output_view = aView
+            build.error_view = self.window.create_output_panel("exec") if __ST3 else self.window.get_output_panel("exec")
+            build.to_window = True
 
         if (working_dir == "" and self.window.active_view() and self.window.active_view().file_name()):
             working_dir = os.path.dirname(self.window.active_view().file_name())
 
-        self.error_view.settings().set("result_file_regex", "")
-        self.error_view.settings().set("result_line_regex", "")
-        self.error_view.settings().set("result_base_dir", working_dir)
-        self.error_view.settings().set("word_wrap", word_wrap)
-        self.error_view.settings().set("line_numbers", False)
-        self.error_view.settings().set("gutter", False)
-        self.error_view.settings().set("scroll_past_end", False)
+        build.error_view.settings().set("result_file_regex", "")
+        build.error_view.settings().set("result_line_regex", "")
+        build.error_view.settings().set("result_base_dir", working_dir)
+        build.error_view.settings().set("word_wrap", word_wrap)
+        build.error_view.settings().set("line_numbers", False)
+        build.error_view.settings().set("gutter", False)
+        build.error_view.settings().set("scroll_past_end", False)
         if __ST3:
-            self.error_view.assign_syntax(syntax)
+            build.error_view.assign_syntax(syntax)
         else:
-            self.error_view.set_syntax_file(syntax)
+            build.error_view.set_syntax_file(syntax)
 
         if __ST3:
             self.window.create_output_panel("exec")
         else:
             self.window.get_output_panel("exec")
 
-        self.encoding = encoding
-        self.quiet = quiet
+        input_data = takeInput(input_key) if input_key else None
 
-        self.proc = None
-        if not self.quiet:
+        if not quiet:
             print("Running " + " ".join(cmd))
-        
-        sublime.status_message("Building")
 
         show_panel_on_build = self.window.active_view().settings().get("show_panel_on_build", True)
-        if show_panel_on_build:
+        if show_panel_on_build and not live:
             self.window.run_command("show_panel", {"panel": "output.exec"})
 
         merged_env = env.copy()
@@ -155,48 +378,126 @@ class PandownExecCommand(sublime_plugin.WindowCommand, PandownProcessListener):
         if working_dir != "":
             os.chdir(working_dir)
 
-        self.debug_text = ""
-        self.debug_text += "[cmd: " + str(cmd) + "]\n"
-        self.debug_text += "[dir: " + str(os.getcwd()) + "]\n"
+        build.debug_text = ""
+        build.debug_text += "[cmd: " + str(cmd) + "]\n"
+        build.debug_text += "[dir: " + str(os.getcwd()) + "]\n"
 
         if "PATH" in merged_env:
-            self.debug_text += "[path: " + str(merged_env["PATH"]) + "]"
+            build.debug_text += "[path: " + str(merged_env["PATH"]) + "]"
         else:
-            self.debug_text += "[path: " + str(os.environ["PATH"]) + "]"
-
-        try:
-            self.proc = PandownAsyncProcess(cmd, merged_env, self)
-        except Exception as e:
-            self.append_string_err(None, str(e) + "\n")
-            self.append_string_err(None, self.debug_text + "\n")
-            print(self.debug_text)
-            print(e)
-            if not self.quiet:
-                self.append_string_err(None, "[Finished]")
+            build.debug_text += "[path: " + str(os.environ["PATH"]) + "]"
+
+        s = sublime.load_settings("Pandown.sublime-settings")
+        timeout = s.get("build_timeout", 0) or None
+
+        def start(job):
+            build.job = job
+            sublime.status_message("Building")
+            if build.timer:
+                build.timer.stop("queued")
+                build.timer.mark("pandoc")
+            try:
+                if use_server:
+                    return PandownServerProcess(cmd, merged_env, build,
+                        s.get("pandoc_server_url", "http://127.0.0.1:3030"),
+                        s.get("pandoc_server_command", ["pandoc", "server", "--port", "3030"]),
+                        s.get("pandoc_server_autostart", True),
+                        functools.partial(startProcess, timeout=timeout), input_data, timeout)
+                if build.timer:
+                    with build.timer.phase("process spawn"):
+                        return startProcess(cmd, merged_env, build, input_data, timeout)
+                return startProcess(cmd, merged_env, build, input_data, timeout)
+            except Exception as e:
+                build.append_string_err(None, str(e) + "\n")
+                build.append_string_err(None, build.debug_text + "\n")
+                print(build.debug_text)
+                print(e)
+                if not quiet:
+                    build.append_string_err(None, "[Finished]")
+                jobQueue().done(job, -1)
+                return None
+
+        # Builds are keyed by the window, the view they're for, and where
+        # their output goes, so that a new build of the same thing replaces
+        # one that hasn't finished.
+        target = out_file or "window %s" % output_view
+        source = None
+        for aView in self.window.views():
+            if aView.id() == view_id:
+                source = os.path.basename(aView.file_name() or "") or aView.name()
+        description = "%s to %s" % (source or "untitled", os.path.basename(out_file) if out_file else "Pandoc Output")
+        if build.timer:
+            build.timer.mark("queued")
+        job = jobQueue().submit((self.window.id(), view_id, target), description, start, build)
+        if job.state == QUEUED:
+            sublime.status_message("Build queued until one of %d running builds finishes" % len(jobQueue().running))
 
     def is_enabled(self, kill=False):
         if kill:
-            return hasattr(self, 'proc') and self.proc and self.proc.poll()
+            return any(job.key[0] == self.window.id() for job in jobQueue().active())
         else:
             return True
 
+
+class PandownExecBuild(PandownProcessListener):
+    '''
+    The output of one pandown_exec build, which appends what Pandoc writes to
+    the build panel, or collects it for the output view and shows it there
+    once Pandoc is done, and reports to the job queue when it's done.
+    '''
+
+    def __init__(self, encoding, quiet, cache_key, out_file):
+        self.encoding = encoding
+        self.quiet = quiet
+        self.cache_key = cache_key
+        self.out_file = out_file
+        self.cache_buffer = []
+        self.window_text = []
+        self.job = None
+        self.timer = None
+        self.dependency_record = None
+        self.finished = False
+        self.buffer = PandownOutputBuffer()
+        self.decoders = {}
+        self.flush_lock = threading.Lock()
+        self.flush_scheduled = False
+        self.last_flush = 0
+
+    def cancelled(self):
+        return self.job is not None and self.job.state == CANCELLED
+
     def append_string_err(self, proc, string):
-        self.append_data_error(proc, string.encode(self.encoding))
+        self.queue_data(proc, "message", string.encode(self.encoding))
 
     def append_string_out(self, proc, string):
-        self.append_data_output(proc, string.encode(self.encoding))
+        self.queue_data(proc, "out", string.encode(self.encoding))
 
     def finish(self, proc):
+        if self.finished or self.cancelled():
+            return
+        self.finished = True
+        exit_code = proc.exit_code()
+        if self.to_window:
+            self.render(exit_code)
+        if self.timer:
+            self.timer.stop("pandoc")
+            self.logTimings(exit_code)
+
         if not self.quiet:
             elapsed = time.time() - proc.start_time
-            exit_code = proc.exit_code()
-            if exit_code == 0 or exit_code == None:
+            if exit_code == 0:
                 self.append_string_err(proc, ("[Finished in %.1fs]" % (elapsed)))
             else:
                 self.append_string_err(proc, ("[Finished in %.1fs with exit code %d]\n" % (elapsed, exit_code)))
 
-        if proc != self.proc:
-            return
+        if self.job:
+            jobQueue().done(self.job, exit_code)
+
+        if self.cache_key:
+            self.storeInCache(exit_code)
+
+        if exit_code == 0 and self.out_file and self.dependency_record:
+            recordDependencies(self.out_file, self.dependency_record)
 
         errs = self.error_view.find_all_results()
         if len(errs) == 0:
@@ -204,66 +505,125 @@ class PandownExecCommand(sublime_plugin.WindowCommand, PandownProcessListener):
         else:
             sublime.status_message("Build finished with %d errors" % len(errs))
 
-    def append_data_error(self, proc, data):
-        __ST3 = int(sublime.version()) >= 3000
-        if proc != self.proc:
-            if proc:
-                proc.kill()
+    def render(self, exit_code):
+        '''
+        Replace the output view's text with Pandoc's output, in one edit that
+        touches only what changed. If Pandoc failed, the last output stays.
+        '''
+        if len(self.buffer):
+            sublime.set_timeout(functools.partial(self.render, exit_code), 50)
+            return
+        text = self.window_text
+        self.window_text = []
+        if exit_code != 0 or self.cancelled():
             return
+        if "out" in self.decoders:
+            text.append(self.decoders["out"].decode(b"", True))
+        renderStart = time.time()
+        self.output_view.run_command("pandown_out_view_replace", {"text_key": stashInput("".join(text))})
+        if self.timer:
+            self.timer.add("output streaming", time.time() - renderStart)
+
+    def logTimings(self, exit_code):
+        # Wait for the output view to catch up, which is part of the build.
+        if len(self.buffer):
+            sublime.set_timeout(functools.partial(self.logTimings, exit_code), 50)
+            return
+        logTimings(self.timer, exit_code=exit_code)
 
-        try:
-            string = data.decode(self.encoding)
-        except:
-            string = "[Decode error: output not " + self.encoding + "]\n"
-            proc = None
+    def storeInCache(self, exit_code):
+        # The output view may still be catching up with the process.
+        if len(self.buffer):
+            sublime.set_timeout(functools.partial(self.storeInCache, exit_code), 50)
+            return
+        key = self.cache_key
+        self.cache_key = None
+        if exit_code != 0:
+            return
+        if self.to_window:
+            buildCache().store(key, data=b"".join(self.cache_buffer))
+        elif self.out_file and os.path.isfile(self.out_file):
+            buildCache().store(key, fromFile=self.out_file)
+        self.cache_buffer = []
+
+    def queue_data(self, proc, stream, data):
+        '''
+        Queue output for the flusher, which appends it on the main thread a
+        frame at a time. While the backlog is full, the process stops reading
+        Pandoc's output.
+        '''
+        self.buffer.put(stream, data)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        with self.flush_lock:
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+            # Let Sublime draw a frame between flushes, and let output pile
+            # up in the meantime so that it's appended in fewer pieces.
+            wait = FLUSH_INTERVAL - (time.time() - self.last_flush) * 1000
+        sublime.set_timeout(self.flush, max(0, int(wait)))
+
+    def flush(self):
+        with self.flush_lock:
+            self.flush_scheduled = False
+            self.last_flush = time.time()
+        for i in range(APPENDS_PER_FLUSH):
+            chunk = self.buffer.take(APPEND_SIZE)
+            if chunk is None:
+                return
+            (stream, data) = chunk
+            self.append_data(stream, data)
+        if len(self.buffer):
+            self.schedule_flush()
+
+    def append_data(self, stream, data):
+        if self.cancelled() and stream != "message":
+            self.buffer.discard(stream)
+            return
 
-        string = string.replace("\r\n", "\n").replace("\r", "\n")
-        if __ST3:
-            self.error_view.run_command("append", {"characters": string, "force": True})
-        else:
-            selection_was_at_end = (len(self.error_view.sel()) == 1
-                and self.error_view.sel()[0] == sublime.Region(self.error_view.size()))
-            self.error_view.set_read_only(False)
-            edit = self.error_view.begin_edit()
-            self.error_view.insert(edit, self.error_view.size(), string)
-            if selection_was_at_end:
-                self.error_view.show(self.error_view.size())
-            self.error_view.end_edit(edit)
-            self.error_view.set_read_only(True)
+        if stream not in self.decoders:
+            self.decoders[stream] = PandownDecoder(self.encoding)
+        string = self.decoders[stream].decode(data)
 
-    def append_data_output(self, proc, data):
-        __ST3 = int(sublime.version()) >= 3000
-        if proc != self.proc:
-            if proc:
-                proc.kill()
+        if stream == "out" and self.to_window:
+            # Held until Pandoc is done, to be shown in a single edit.
+            if self.cache_key:
+                self.cache_buffer.append(data)
+            self.window_text.append(string)
+            return
+        view = self.error_view
+        if not string:
             return
 
-        try:
-            string = data.decode(self.encoding)
-        except:
-            string = "[Decode error: output not " + self.encoding + "]\n"
-            proc = None
-
-        string = string.replace("\r\n", "\n").replace("\r", "\n")
-        if __ST3:
-            self.output_view.run_command("append", {"characters": string, "force": True})
+        appendStart = time.time()
+        if int(sublime.version()) >= 3000:
+            view.run_command("append", {"characters": string, "force": True})
         else:
-            selection_was_at_end = (len(self.output_view.sel()) == 1
-                and self.output_view.sel()[0] == sublime.Region(self.output_view.size()))
-            edit = self.output_view.begin_edit()
-            self.output_view.insert(edit, self.output_view.size(), string)
+            selection_was_at_end = (len(view.sel()) == 1
+                and view.sel()[0] == sublime.Region(view.size()))
+            panel = view == self.error_view
+            if panel:
+                view.set_read_only(False)
+            edit = view.begin_edit()
+            view.insert(edit, view.size(), string)
             if selection_was_at_end:
-                self.output_view.show(self.output_view.size())
-            self.output_view.end_edit(edit)
+                view.show(view.size())
+            view.end_edit(edit)
+            if panel:
+                view.set_read_only(True)
+        if self.timer:
+            self.timer.add("output streaming", time.time() - appendStart)
 
     def on_data_out(self, proc, data):
-        if self.to_window == False:
-            sublime.set_timeout(functools.partial(self.append_data_error, proc, data), 0)
-        else:
-            sublime.set_timeout(functools.partial(self.append_data_output, proc, data), 0)
+        self.queue_data(proc, "out", data)
 
     def on_data_err(self, proc, data):
-        sublime.set_timeout(functools.partial(self.append_data_error, proc, data), 0)
+        self.queue_data(proc, "err", data)
+
+    def backlogged(self):
+        return self.buffer.full()
 
     def on_finished(self, proc):
         sublime.set_timeout(functools.partial(self.finish, proc), 0)
@@ -0,0 +1,31 @@
+import sublime
+import os
+if int(sublime.version()) >= 3000:
+    from Pandown.pandownBatch import makeJob
+    import Pandown.pandownBuildProjectCommand as pandownBuildProjectCommand
+    from Pandown.pandownProcess import dependencyGraph
+else:
+    from pandownBatch import makeJob
+    import pandownBuildProjectCommand
+    from pandownProcess import dependencyGraph
+
+
+# The module, not the class, is imported so that Sublime doesn't register
+# pandown_build_project a second time from here.
+class PandownRebuildStaleCommand(pandownBuildProjectCommand.PandownBuildProjectCommand):
+    '''
+    Rebuild, in parallel, only the project's outputs whose source or any file
+    they were built from has changed since they were last built.
+    '''
+
+    def makeJobs(self, folders, index, pandoc_from, pandoc_to, arguments, includes_paths, defaults, preprocess):
+        stale = dependencyGraph().stale(folders)
+        root = folders[0] if len(folders) == 1 else None
+        if not stale:
+            self.append("[Nothing to rebuild]\n")
+        jobs = []
+        for (outFile, entry, reason) in stale:
+            self.append("[stale] %s (%s)\n" % (os.path.relpath(outFile, root) if root else outFile, reason))
+            jobs.append(makeJob(entry["source"], entry["to"], entry["from"], arguments, includes_paths, index,
+                defaults=defaults, preprocess=preprocess, pandoc=self.pandoc, pdfBuildDir=self.pdfBuildDir))
+        return jobs
@@ -0,0 +1,332 @@
+from __future__ import print_function
+import base64
+import codecs
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import URLError
+except ImportError:
+    from urllib2 import Request, urlopen, URLError
+try:
+    from Pandown.pandownCommandBuilder import STDIN
+    from Pandown.pandownStream import isStreamed
+except ImportError:
+    from pandownCommandBuilder import STDIN
+    from pandownStream import isStreamed
+
+# How many seconds to wait for the server to answer a conversion, when
+# builds have no timeout of their own, before spawning pandoc instead.
+REQUEST_TIMEOUT = 30
+
+# Arguments that the server accepts, under a different name where pandoc's
+# HTTP API has renamed them. Anything not listed here (or handled specially
+# in translateCommand) can't be expressed as a server request, and the build
+# falls back to spawning pandoc.
+FLAG_OPTIONS = {
+    "standalone": "standalone",
+    "table-of-contents": "table-of-contents",
+    "number-sections": "number-sections",
+    "section-divs": "section-divs",
+    "html-q-tags": "html-q-tags",
+    "ascii": "ascii",
+    "reference-links": "reference-links",
+    "incremental": "incremental",
+    "listings": "listings",
+}
+VALUE_OPTIONS = {
+    "highlight-style": "highlight-style",
+    "email-obfuscation": "email-obfuscation",
+    "id-prefix": "identifier-prefix",
+    "default-image-extension": "default-image-extension",
+    "toc-depth": "toc-depth",
+    "tab-stop": "tab-stop",
+    "columns": "columns",
+    "slide-level": "slide-level",
+}
+INT_OPTIONS = ("toc-depth", "tab-stop", "columns", "slide-level")
+INCLUDE_VARIABLES = {
+    "include-in-header": "header-includes",
+    "include-before-body": "include-before",
+    "include-after-body": "include-after",
+}
+# Binary writers return base64-encoded output; PDF isn't produced by the
+# server at all.
+UNSUPPORTED_EXTENSIONS = (".pdf",)
+
+
+def readText(path):
+    with codecs.open(path, "r", "utf-8") as f:
+        return f.read()
+
+
+def translateCommand(cmd, inputText=None):
+    '''
+    Turn an argv list from buildPandocCmd into a (request, outFile) pair for
+    pandoc's HTTP server. Returns (None, None) if the command uses anything the
+    server can't do, in which case the caller should run pandoc directly.
+    `inputText` is the document, if the command reads it from stdin.
+    '''
+    request = {"variables": {}}
+    outFile = None
+    inFile = None
+    for arg in cmd[1:]:
+        if not arg.startswith("--"):
+            inFile = arg
+            continue
+        key, sep, value = arg[2:].partition("=")
+        if key == "output":
+            outFile = value
+        elif key in ("from", "to"):
+            request[key] = value
+        elif key in FLAG_OPTIONS and not sep:
+            request[FLAG_OPTIONS[key]] = True
+        elif key in VALUE_OPTIONS and sep:
+            request[VALUE_OPTIONS[key]] = int(value) if key in INT_OPTIONS else value
+        elif key == "no-wrap":
+            request["wrap"] = "none"
+        elif key == "no-highlight":
+            request["highlight-style"] = None
+        elif key == "base-header-level":
+            request["shift-heading-level-by"] = int(value) - 1
+        elif key == "number-offset":
+            request["number-offset"] = [int(n) for n in value.split(",")]
+        elif key == "indented-code-classes":
+            request["indented-code-classes"] = value.split(",")
+        elif key == "variable":
+            (k, ign, v) = value.partition(":")
+            addVariable(request["variables"], k, v)
+        elif key == "title-prefix":
+            addVariable(request["variables"], "title-prefix", value)
+        elif key == "css":
+            addVariable(request["variables"], "css", value)
+        elif key in INCLUDE_VARIABLES or key == "template":
+            # The server can't read files, so send their contents instead.
+            if not os.path.isfile(value):
+                return (None, None)
+            if key == "template":
+                request["template"] = readText(value)
+            else:
+                addVariable(request["variables"], INCLUDE_VARIABLES[key], readText(value))
+        else:
+            return (None, None)
+
+    if inFile == STDIN and inputText is not None:
+        request["text"] = inputText
+    elif inFile is not None and os.path.isfile(inFile):
+        request["text"] = readText(inFile)
+    else:
+        return (None, None)
+    if outFile and os.path.splitext(outFile)[1].lower() in UNSUPPORTED_EXTENSIONS:
+        return (None, None)
+    return (request, outFile)
+
+
+def addVariable(variables, k, v):
+    if k in variables:
+        if not isinstance(variables[k], list):
+            variables[k] = [variables[k]]
+        variables[k].append(v)
+    else:
+        variables[k] = v
+
+
+class PandownServer(object):
+    '''
+    Keeps track of a single long-lived `pandoc server` process, which is
+    started on first use if the user has asked for that and shared by every
+    subsequent build.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process = None
+        self.url = None
+
+    def isAlive(self, url):
+        try:
+            urlopen(url.rstrip("/") + "/version", timeout=1).read()
+        except (URLError, IOError, OSError):
+            return False
+        return True
+
+    def ensureRunning(self, url, command, env, autostart):
+        with self.lock:
+            if self.url == url and self.process and self.process.poll() is None:
+                return True
+            if self.isAlive(url):
+                self.url = url
+                return True
+            if not autostart:
+                return False
+            startupinfo = None
+            if os.name == "nt":
+                startupinfo = subprocess.STARTUPINFO()
+                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            # Nothing reads the server's output, which would otherwise fill
+            # its pipes and stop it once it had logged enough.
+            devnull = getattr(subprocess, "DEVNULL", None) or open(os.devnull, "wb")
+            try:
+                self.process = subprocess.Popen(command, stdout=devnull, stderr=devnull, startupinfo=startupinfo, env=env)
+            except OSError as e:
+                print("[Pandown: could not start pandoc server: " + str(e) + "]")
+                return False
+            finally:
+                if devnull is not getattr(subprocess, "DEVNULL", None):
+                    devnull.close()
+            self.url = url
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                if self.process.poll() is not None:
+                    return False
+                if self.isAlive(url):
+                    return True
+                time.sleep(0.1)
+            return False
+
+    def stop(self):
+        with self.lock:
+            if self.process and self.process.poll() is None:
+                self.process.terminate()
+            self.process = None
+            self.url = None
+
+
+server = PandownServer()
+
+
+class PandownFallbackListener(object):
+    '''
+    Forwards a fallback subprocess's events as though they came from the
+    server process it stands in for.
+    '''
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    def on_data_out(self, proc, data):
+        if self.owner.listener:
+            self.owner.listener.on_data_out(self.owner, data)
+
+    def on_data_err(self, proc, data):
+        if self.owner.listener:
+            self.owner.listener.on_data_err(self.owner, data)
+
+    def on_finished(self, proc):
+        if self.owner.listener:
+            self.owner.listener.on_finished(self.owner)
+
+
+class PandownServerProcess(object):
+    '''
+    Runs a build against the pandoc server, with the same interface as
+    PandownAsyncProcess. If the server can't handle the command or isn't
+    reachable, or doesn't answer within `timeout` seconds, `fallback` is
+    called to spawn pandoc as usual.
+    '''
+
+    def __init__(self, command, env, listener, url, server_command, autostart, fallback, input_data=None, timeout=None):
+        self.listener = listener
+        self.killed = False
+        self.start_time = time.time()
+        self.command = command
+        self.env = env
+        self.input_data = input_data
+        self.url = url
+        self.server_command = server_command
+        self.autostart = autostart
+        self.fallback = fallback
+        self.fallbackProc = None
+        self.returncode = None
+        self.timeout = timeout or REQUEST_TIMEOUT
+        threading.Thread(target=self.convert).start()
+
+    def kill(self):
+        if not self.killed:
+            self.killed = True
+            if self.fallbackProc:
+                self.fallbackProc.kill()
+            self.listener = None
+
+    def poll(self):
+        if self.fallbackProc:
+            return self.fallbackProc.poll()
+        return self.returncode is None
+
+    def exit_code(self):
+        if self.fallbackProc:
+            return self.fallbackProc.exit_code()
+        return self.returncode
+
+    @property
+    def open_streams(self):
+        return self.fallbackProc.open_streams if self.fallbackProc else 0
+
+    def runFallback(self):
+        if not self.killed:
+            self.fallbackProc = self.fallback(self.command, self.env, PandownFallbackListener(self), self.input_data)
+
+    def convert(self):
+        if isStreamed(self.input_data):
+            # The server would need the whole document in one request.
+            self.runFallback()
+            return
+        try:
+            inputText = self.input_data.decode("utf-8") if self.input_data is not None else None
+            (request, outFile) = translateCommand(self.command, inputText)
+        except (IOError, OSError, ValueError):
+            request = None
+        if request is None or not server.ensureRunning(self.url, self.server_command, self.env, self.autostart):
+            self.runFallback()
+            return
+
+        body = json.dumps(request).encode("utf-8")
+        req = Request(self.url, body, {"Content-Type": "application/json", "Accept": "application/json"})
+        try:
+            response = json.loads(urlopen(req, timeout=self.timeout).read().decode("utf-8"))
+        except (URLError, IOError, OSError, ValueError) as e:
+            if isinstance(e, socket.timeout) or isinstance(getattr(e, "reason", None), socket.timeout):
+                # The server may be wedged; the next build starts it afresh.
+                server.stop()
+            self.runFallback()
+            return
+
+        if self.killed:
+            return
+
+        for message in response.get("messages", []):
+            self.emitErr("[%s] %s\n" % (message.get("verbosity", "INFO"), message.get("message", "")))
+
+        if "error" in response:
+            self.emitErr(response["error"] + "\n")
+            self.returncode = 1
+        else:
+            output = response.get("output", "")
+            if response.get("base64"):
+                data = base64.b64decode(output)
+            else:
+                data = output.encode("utf-8")
+            if outFile:
+                try:
+                    with open(outFile, "wb") as f:
+                        f.write(data)
+                except (IOError, OSError) as e:
+                    self.emitErr(str(e) + "\n")
+                    self.returncode = 1
+                else:
+                    self.returncode = 0
+            else:
+                self.returncode = 0
+                if self.listener:
+                    self.listener.on_data_out(self, data)
+
+        if self.listener:
+            self.listener.on_finished(self)
+
+    def emitErr(self, string):
+        if self.listener:
+            self.listener.on_data_err(self, string.encode("utf-8"))
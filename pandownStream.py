@@ -0,0 +1,84 @@
+'''
+Input that's piped to Pandoc a piece at a time, for documents too big to
+hold in memory more than once or twice: a buffer read a region at a time, or
+a file a block at a time, converted and encoded as Pandoc reads it. Such
+input is an iterator of bytes where it would otherwise be bytes.
+'''
+import io
+import threading
+
+CHUNK_SIZE = 2 ** 18
+
+
+def regionChunks(read, size, chunk=CHUNK_SIZE):
+    '''
+    The text from 0 to `size` in pieces of `chunk` characters, each got by
+    calling read(start, end). Stops early if read() comes back empty, as it
+    does once a view has been closed.
+    '''
+    for start in range(0, size, chunk):
+        piece = read(start, min(start + chunk, size))
+        if not piece:
+            return
+        yield piece
+
+
+def fileChunks(path, chunk=CHUNK_SIZE):
+    '''
+    The UTF-8 text of `path` in pieces of `chunk` characters, with its line
+    endings as they are.
+    '''
+    with io.open(path, "r", encoding="utf-8", newline="") as f:
+        while True:
+            piece = f.read(chunk)
+            if not piece:
+                return
+            yield piece
+
+
+def encodeChunks(chunks):
+    for piece in chunks:
+        if piece:
+            yield piece.encode("utf-8")
+
+
+def isStreamed(data):
+    return data is not None and not isinstance(data, bytes)
+
+
+def writeInput(pipe, data):
+    '''
+    Write `data`, bytes or an iterator of them, to `pipe`, and close it.
+    '''
+    try:
+        if isStreamed(data):
+            for piece in data:
+                pipe.write(piece)
+        else:
+            pipe.write(data)
+    except (IOError, OSError):
+        # Pandoc quit without reading it all; its stderr will say why.
+        pass
+    finally:
+        try:
+            pipe.close()
+        except (IOError, OSError):
+            pass
+
+
+def communicate(process, data):
+    '''
+    process.communicate(data), where `data` may also be an iterator of bytes,
+    which is written from a thread of its own as Pandoc reads it.
+    '''
+    if not isStreamed(data):
+        return process.communicate(data)
+    writer = threading.Thread(target=writeInput, args=(process.stdin, data))
+    writer.daemon = True
+    writer.start()
+    # communicate() would close stdin under the writer.
+    process.stdin = None
+    try:
+        return process.communicate()
+    finally:
+        writer.join()
@@ -0,0 +1,188 @@
+from __future__ import print_function
+import codecs
+import json
+import os
+import threading
+import time
+
+# Phases in the order a build goes through them, for the summary.
+PHASES = (
+    "settings", "config merge", "include resolution", "critic preprocessing",
+    "cache lookup", "queued", "process spawn", "pandoc", "output streaming",
+    "open/display",
+)
+
+_lock = threading.Lock()
+
+
+class PandownPhase(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.time() - self.start)
+        return False
+
+
+class PandownTimer(object):
+    '''
+    Collects how long each phase of one build takes, and how many times it
+    ran (include resolution, say, happens once per included file).
+    '''
+
+    def __init__(self, source=None, target=None):
+        self.source = source
+        self.target = target
+        self.started = time.time()
+        self.phases = {}
+        self.counts = {}
+        self.marks = {}
+
+    def phase(self, name):
+        '''
+        A context manager timing the code it wraps as part of `name`.
+        '''
+        return PandownPhase(self, name)
+
+    def add(self, name, seconds):
+        with _lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def mark(self, name):
+        '''
+        Start timing a phase that ends somewhere else, in stop().
+        '''
+        self.marks[name] = time.time()
+
+    def stop(self, name):
+        if name in self.marks:
+            self.add(name, time.time() - self.marks.pop(name))
+
+    def record(self, **extra):
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "source": self.source,
+            "target": self.target,
+            "total_ms": round((time.time() - self.started) * 1000, 1),
+            "phases_ms": dict((name, round(seconds * 1000, 1)) for (name, seconds) in self.phases.items()),
+            "counts": self.counts,
+        }
+        record.update(extra)
+        return record
+
+
+class PandownTimingLog(object):
+    '''
+    Build timings, one JSON record per line, in a file that's rotated once
+    it's bigger than `maxSize` bytes, keeping `backups` old files.
+    '''
+
+    def __init__(self, path, maxSize=2 ** 20, backups=3):
+        self.path = path
+        self.maxSize = maxSize
+        self.backups = backups
+
+    def append(self, record):
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with _lock:
+            try:
+                if not os.path.isdir(os.path.dirname(self.path)):
+                    os.makedirs(os.path.dirname(self.path))
+                if os.path.isfile(self.path) and os.path.getsize(self.path) + len(line) > self.maxSize:
+                    self.rotate()
+                with codecs.open(self.path, "a", "utf-8") as f:
+                    f.write(line)
+            except (IOError, OSError) as e:
+                print("[Pandown: couldn't log build timings: %s]" % e)
+
+    def rotate(self):
+        oldest = "%s.%d" % (self.path, self.backups)
+        if os.path.isfile(oldest):
+            os.remove(oldest)
+        for n in range(self.backups - 1, 0, -1):
+            older = "%s.%d" % (self.path, n)
+            if os.path.isfile(older):
+                os.rename(older, "%s.%d" % (self.path, n + 1))
+        os.rename(self.path, self.path + ".1")
+
+    def records(self):
+        '''
+        Every logged record, oldest first.
+        '''
+        paths = ["%s.%d" % (self.path, n) for n in range(self.backups, 0, -1)] + [self.path]
+        records = []
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            with codecs.open(path, "r", "utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        pass
+        return records
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def summarize(records):
+    '''
+    A plain-text table of median and 95th-percentile times for each target
+    format, overall and for each phase.
+    '''
+    byTarget = {}
+    for record in records:
+        byTarget.setdefault(record.get("target") or "unknown", []).append(record)
+    lines = []
+    for target in sorted(byTarget):
+        group = byTarget[target]
+        lines.append("%s (%d builds)" % (target, len(group)))
+        lines.append("    %-24s %10s %10s" % ("", "p50 ms", "p95 ms"))
+        totals = [record.get("total_ms", 0) for record in group]
+        lines.append("    %-24s %10.1f %10.1f" % ("total", percentile(totals, 50), percentile(totals, 95)))
+        names = set()
+        for record in group:
+            names.update(record.get("phases_ms", {}))
+        for name in [phase for phase in PHASES if phase in names] + sorted(names - set(PHASES)):
+            values = [record.get("phases_ms", {}).get(name, 0.0) for record in group]
+            label = name
+            counts = [record.get("counts", {}).get(name, 0) for record in group]
+            if max(counts) > 1:
+                label += " (x%d)" % percentile(counts, 50)
+            lines.append("    %-24s %10.1f %10.1f" % (label, percentile(values, 50), percentile(values, 95)))
+        lines.append("")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Log a few hundred made-up builds through a tiny rotating log and print
+    # the summary.
+    import random
+    import shutil
+    import tempfile
+
+    folder = tempfile.mkdtemp()
+    try:
+        log = PandownTimingLog(os.path.join(folder, "timings.jsonl"), maxSize=16 * 1024, backups=2)
+        for i in range(300):
+            timer = PandownTimer("chapter%d.md" % (i % 7), random.choice(["html5", "docx", "pdf"]))
+            timer.add("settings", random.uniform(0.001, 0.003))
+            for n in range(5):
+                timer.add("include resolution", random.uniform(0.0001, 0.001))
+            timer.add("pandoc", random.uniform(0.2, 2.0) * (5 if timer.target == "pdf" else 1))
+            log.append(timer.record())
+        print(summarize(log.records()))
+        print("%d records kept in %s" % (len(log.records()), sorted(os.listdir(folder))))
+    finally:
+        shutil.rmtree(folder)
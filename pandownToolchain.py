@@ -0,0 +1,193 @@
+'''
+The Pandoc and LaTeX a build runs, resolved once per session: the build
+environment, the absolute path of each program, and what Pandoc says it
+supports, probed once in the background so that builds can check their
+formats and Markdown extensions without running anything.
+'''
+from __future__ import print_function
+import json
+import os
+import re
+import subprocess
+import threading
+try:
+    import Pandown.pandownConfig as pandownConfig
+    from Pandown.pandownCommandBuilder import buildEnvironment
+except ImportError:
+    import pandownConfig
+    from pandownCommandBuilder import buildEnvironment
+
+LATEX_ENGINES = ("pdflatex", "xelatex", "lualatex", "latexmk")
+
+
+def findExecutable(name, path):
+    '''
+    The absolute path of `name` on the search path `path`, or None.
+    '''
+    extensions = [""]
+    if os.name == "nt":
+        extensions += os.environ.get("PATHEXT", ".COM;.EXE;.BAT;.CMD").lower().split(";")
+    for folder in path.split(os.pathsep):
+        if not folder:
+            continue
+        for extension in extensions:
+            candidate = os.path.join(os.path.expanduser(folder), name + extension)
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                return os.path.abspath(candidate)
+    return None
+
+
+def expandEnvironment(env):
+    '''
+    The environment a process is started with: the current one, overlaid
+    with `env`, with variables like $HOME expanded.
+    '''
+    merged = os.environ.copy()
+    merged.update(env)
+    for (k, v) in list(merged.items()):
+        merged[k] = os.path.expandvars(v)
+    return merged
+
+
+_processEnvironments = {}
+MAX_PROCESS_ENVIRONMENTS = 16
+
+
+def processEnvironment(env):
+    '''
+    expandEnvironment(env), remembered, since most builds pass the same one.
+    '''
+    key = tuple(sorted(env.items()))
+    merged = _processEnvironments.get(key)
+    if merged is None:
+        if len(_processEnvironments) >= MAX_PROCESS_ENVIRONMENTS:
+            _processEnvironments.clear()
+        merged = _processEnvironments[key] = expandEnvironment(env)
+    return merged
+
+
+def probe(cmd, env):
+    '''
+    The lines `cmd` prints, or None if it fails.
+    '''
+    startupinfo = None
+    if os.name == "nt":
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, startupinfo=startupinfo)
+        out = proc.communicate()[0]
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return out.decode("utf-8", "replace").splitlines()
+
+
+class PandownToolchain(object):
+    '''
+    One set of install_path, texbin_path and build_env settings, resolved.
+    `env` is the complete, read-only environment builds run in, `pandoc` the
+    absolute path of Pandoc (None if it can't be found), and `engines` the
+    paths of the LaTeX programs that could be.
+    '''
+
+    def __init__(self, install_path=None, texbin_path=None, user_env=None):
+        self.env = pandownConfig.freeze(expandEnvironment(buildEnvironment(install_path, texbin_path, user_env)))
+        self.pandoc = findExecutable("pandoc", self.env.get("PATH", ""))
+        self.stamp = self.binaryStamp()
+        self.engines = {}
+        for engine in LATEX_ENGINES:
+            path = findExecutable(engine, self.env.get("PATH", ""))
+            if path:
+                self.engines[engine] = path
+        self.lock = threading.Lock()
+        self.probing = False
+        self.probed = False
+        self.version = None
+        self.inputFormats = None
+        self.outputFormats = None
+        self.extensions = None
+        self.warned = set()
+
+    def binaryStamp(self):
+        try:
+            return os.stat(self.pandoc).st_mtime if self.pandoc else None
+        except OSError:
+            return None
+
+    def current(self):
+        '''
+        Whether Pandoc is still the binary that was resolved and probed.
+        '''
+        if not self.pandoc:
+            return not findExecutable("pandoc", self.env.get("PATH", ""))
+        return self.binaryStamp() == self.stamp
+
+    def probeInBackground(self):
+        with self.lock:
+            if self.probing or self.probed or not self.pandoc:
+                return
+            self.probing = True
+        t = threading.Thread(target=self.probe)
+        t.daemon = True
+        t.start()
+
+    def probe(self):
+        try:
+            version = probe([self.pandoc, "--version"], self.env)
+            self.version = version[0].split()[-1] if version else "?"
+            # Pandoc 1.x has none of the --list options.
+            inputs = probe([self.pandoc, "--list-input-formats"], self.env)
+            outputs = probe([self.pandoc, "--list-output-formats"], self.env)
+            extensions = probe([self.pandoc, "--list-extensions"], self.env)
+            self.inputFormats = set(line.strip() for line in inputs) if inputs else None
+            self.outputFormats = set(line.strip() for line in outputs) if outputs else None
+            self.extensions = set(line.strip().lstrip("+-") for line in extensions) if extensions else None
+        finally:
+            self.probed = True
+            self.probing = False
+
+    def problems(self, cmd):
+        '''
+        Reasons Pandoc can't run `cmd`, from what it reported when it was
+        probed: an unknown output or input format, or extension. Empty if it
+        hasn't been probed yet. Each is only reported once.
+        '''
+        problems = []
+        for arg in cmd[1:-1]:
+            if arg.startswith("--to="):
+                (formats, verb) = (self.outputFormats, "write")
+            elif arg.startswith("--from="):
+                (formats, verb) = (self.inputFormats, "read")
+            else:
+                continue
+            parts = re.split(r"([+-])", arg.split("=", 1)[1])
+            name = parts[0]
+            if formats is not None and name not in formats and not name.endswith(".lua"):
+                problems.append("Pandoc %s can't %s %s" % (self.version, verb, name))
+            unknown = [ext for ext in parts[2::2] if self.extensions is not None and ext not in self.extensions]
+            if unknown:
+                problems.append("Pandoc %s has no %s extension%s" % (self.version, ", ".join(unknown), "s" if len(unknown) > 1 else ""))
+        problems = [problem for problem in problems if problem not in self.warned]
+        self.warned.update(problems)
+        return problems
+
+
+_toolchains = {}
+_toolchainsLock = threading.Lock()
+
+
+def toolchainFor(install_path=None, texbin_path=None, user_env=None):
+    '''
+    The shared toolchain for these settings, resolved again only if they
+    change or Pandoc's binary is replaced.
+    '''
+    key = (install_path, texbin_path, json.dumps(user_env, sort_keys=True))
+    with _toolchainsLock:
+        toolchain = _toolchains.get(key)
+    if toolchain is None or not toolchain.current():
+        toolchain = PandownToolchain(install_path, texbin_path, user_env)
+        with _toolchainsLock:
+            _toolchains[key] = toolchain
+    return toolchain
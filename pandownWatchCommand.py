@@ -0,0 +1,70 @@
+import sublime
+import sublime_plugin
+import os
+if int(sublime.version()) >= 3000:
+    import Pandown.pandownIncludeIndex as pandownIncludeIndex
+    from Pandown.pandownProcess import dependencyGraph
+    from Pandown.pandownWatcher import PandownWatcher
+else:
+    import pandownIncludeIndex
+    from pandownProcess import dependencyGraph
+    from pandownWatcher import PandownWatcher
+
+# The watcher for each window that has watch mode on.
+_watchers = {}
+
+
+def plugin_unloaded():
+    for watcher in _watchers.values():
+        watcher.stop()
+    _watchers.clear()
+
+
+class PandownToggleWatchCommand(sublime_plugin.WindowCommand):
+    '''
+    Watch the project's folders and includes_paths, and rebuild any document
+    whose source or inputs change outside the editor.
+    '''
+
+    def run(self):
+        watcher = _watchers.pop(self.window.id(), None)
+        if watcher:
+            watcher.stop()
+            sublime.status_message("Pandown watch mode off")
+            return
+        folders = self.window.folders()
+        if not folders:
+            sublime.status_message("Pandown: there are no project folders to watch.")
+            return
+        s = sublime.load_settings("Pandown.sublime-settings")
+        roots = list(folders)
+        for path in s.get("includes_paths", []):
+            path = os.path.expanduser(path)
+            if os.path.isdir(path) and not any(path.startswith(os.path.join(root, "")) for root in roots):
+                roots.append(path)
+        try:
+            watcher = PandownWatcher(roots, self.changed, s.get("watch_debounce", 500) / 1000.0,
+                s.get("watch_backend", "auto"), s.get("watch_poll_interval", 2))
+        except (IOError, OSError) as e:
+            sublime.status_message("Pandown: can't watch the project: %s" % e)
+            return
+        watcher.start()
+        _watchers[self.window.id()] = watcher
+        sublime.status_message("Pandown watch mode on (%s)" % watcher.backend.name)
+
+    def changed(self, paths):
+        '''
+        Called from the watcher's thread with a batch of changed paths.
+        '''
+        for path in paths:
+            if os.path.isfile(path):
+                pandownIncludeIndex.noteFile(path)
+            elif not os.path.exists(path):
+                pandownIncludeIndex.forgetFile(path)
+        # Anything could have changed if inotify dropped events, in which
+        # case the watcher reports the folders themselves.
+        if any(os.path.isdir(path) for path in paths) or not dependencyGraph().paths().isdisjoint(paths):
+            sublime.set_timeout(lambda: self.window.run_command("pandown_rebuild_stale", {"queue_if_busy": True}), 0)
+
+    def is_checked(self):
+        return self.window.id() in _watchers
@@ -0,0 +1,230 @@
+'''
+Watches project folders for files changed outside the editor (by scripts,
+git pulls and the like), and reports them in debounced batches, so that a
+burst of changes is handled once. Uses inotify on Linux, and otherwise polls.
+'''
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+EVENT = struct.Struct("iIII")
+
+
+def watchedDirs(root):
+    '''
+    `root` and every directory under it, except hidden ones (like .git,
+    which a pull rewrites wholesale).
+    '''
+    for (dirPath, dirNames, fileNames) in os.walk(root):
+        dirNames[:] = [name for name in dirNames if not name.startswith(".")]
+        yield (dirPath, fileNames)
+
+
+class PandownPollingBackend(object):
+    '''
+    Finds changes by comparing every file's mtime and size with the last
+    scan, every `interval` seconds.
+    '''
+
+    name = "polling"
+
+    def __init__(self, roots, interval=2.0):
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self.scan()
+        self.nextScan = time.time() + interval
+
+    def scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for (dirPath, fileNames) in watchedDirs(root):
+                for name in fileNames:
+                    path = os.path.join(dirPath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def read(self, timeout):
+        '''
+        The paths that changed, waiting up to `timeout` seconds for a scan.
+        '''
+        wait = self.nextScan - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self.nextScan = time.time() + self.interval
+        (old, self.snapshot) = (self.snapshot, self.scan())
+        changed = [path for (path, stamp) in self.snapshot.items() if old.get(path) != stamp]
+        changed.extend(path for path in old if path not in self.snapshot)
+        return changed
+
+    def close(self):
+        pass
+
+
+class PandownInotifyBackend(object):
+    '''
+    Finds changes with one inotify watch per directory. Raises OSError if
+    inotify isn't available, or the system's watch limit is too low.
+    '''
+
+    name = "inotify"
+
+    def __init__(self, roots):
+        import ctypes
+        import ctypes.util
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.getErrno = ctypes.get_errno
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self.getErrno(), "inotify_init1 failed")
+        self.dirs = {}
+        self.roots = roots
+        try:
+            for root in roots:
+                self.watchTree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def watchTree(self, top):
+        '''
+        Watch `top` and the directories under it. Returns the files found,
+        which may have been written before their directory was watched.
+        '''
+        found = []
+        for (dirPath, fileNames) in watchedDirs(top):
+            wd = self.libc.inotify_add_watch(self.fd, dirPath.encode(sys.getfilesystemencoding() or "utf-8"), WATCH_MASK)
+            if wd < 0:
+                code = self.getErrno()
+                if code == errno.ENOSPC:
+                    raise OSError(code, "too many directories for inotify (raise fs.inotify.max_user_watches)")
+                continue
+            self.dirs[wd] = dirPath
+            found.extend(os.path.join(dirPath, name) for name in fileNames)
+        return found
+
+    def read(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 2 ** 16)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        changed = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            (wd, mask, cookie, length) = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so anything may have changed.
+                changed.extend(self.roots)
+                continue
+            dirPath = self.dirs.get(wd)
+            if dirPath is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                continue
+            if not name:
+                continue
+            path = os.path.join(dirPath, name.decode(sys.getfilesystemencoding() or "utf-8", "replace"))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not os.path.basename(path).startswith("."):
+                    changed.extend(self.watchTree(path))
+            else:
+                changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def backendFor(roots, kind="auto", interval=2.0):
+    '''
+    A backend of the given kind ("inotify", "polling", or "auto" for inotify
+    where it works).
+    '''
+    if kind in ("auto", "inotify"):
+        try:
+            return PandownInotifyBackend(roots)
+        except (OSError, AttributeError) as e:
+            print("[Pandown: watching by polling, since inotify isn't usable: %s]" % e)
+    return PandownPollingBackend(roots, interval)
+
+
+class PandownWatcher(object):
+    '''
+    Calls `onChanges` with the set of paths that changed under `roots`, on
+    its own thread, once nothing has changed for `debounce` seconds (or,
+    while changes keep coming, at least every `maxWait` seconds).
+    '''
+
+    def __init__(self, roots, onChanges, debounce=0.5, kind="auto", interval=2.0, maxWait=None):
+        self.roots = [os.path.abspath(root) for root in roots if os.path.isdir(root)]
+        self.onChanges = onChanges
+        self.debounce = debounce
+        self.maxWait = maxWait or max(5.0, debounce * 10)
+        self.backend = backendFor(self.roots, kind, interval)
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def watch(self):
+        pending = set()
+        first = last = 0
+        try:
+            while not self.stopped:
+                changed = self.backend.read(self.debounce if pending else 1.0)
+                now = time.time()
+                if changed:
+                    pending.update(changed)
+                    last = now
+                    first = first or now
+                if pending and (now - last >= self.debounce or now - first >= self.maxWait) and not self.stopped:
+                    (batch, pending) = (pending, set())
+                    first = 0
+                    try:
+                        self.onChanges(batch)
+                    except Exception as e:
+                        print("[Pandown: error handling changed files: %s]" % e)
+        finally:
+            self.backend.close()